@@ -0,0 +1,147 @@
+import time
+import logging
+import threading
+from datetime import datetime, timezone
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+# Set up Logging
+logger = logging.getLogger(__name__)
+
+class AlertDecision:
+    """Outcome of a dedup check, whether to send and how far the alert has escalated"""
+    __slots__ = ("send", "level", "suppressed")
+
+    def __init__(self, send, level=0, suppressed=0):
+        self.send = send
+        self.level = level
+        self.suppressed = suppressed
+
+    def __repr__(self):
+        return f"AlertDecision(send={self.send}, level={self.level}, suppressed={self.suppressed})"
+
+class InMemoryDedupStore:
+    """Keeps dedup state in this process, suitable for a single worker"""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def update(self, key, decide, now):
+        """Atomically apply decide(entry, now) to the entry for key"""
+        with self._lock:
+            send, entry = decide(self._entries.get(key), now)
+            self._entries[key] = entry
+            if len(self._entries) > self.max_entries:
+                self._prune(now)
+            return send, entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _prune(self, now):
+        expired = [key for key, entry in self._entries.items() if entry["expires_at"] <= now]
+        for key in expired:
+            del self._entries[key]
+
+class MongoDedupStore:
+    """Keeps dedup state in a MongoDB collection so every gunicorn worker shares it
+
+    Updates use a version field for optimistic concurrency, so two workers seeing the same
+    breach at the same moment cannot both decide to send. Entries carry an expires_at date and
+    a TTL index removes them once the breach episode is over (created by db_indexes.provision).
+    """
+
+    def __init__(self, collection, max_attempts=5):
+        self.collection = collection
+        self.max_attempts = max_attempts
+
+    def update(self, key, decide, now):
+        """Atomically apply decide(entry, now) to the entry for key"""
+        for _ in range(self.max_attempts):
+            current = self.collection.find_one({"_id": key})
+            entry = None
+            if current:
+                entry = {k: v for k, v in current.items() if k not in ("_id", "version", "expires_at_date")}
+            send, new_entry = decide(entry, now)
+            document = dict(new_entry, expires_at_date=_utc_datetime(new_entry["expires_at"]))
+
+            if current is None:
+                try:
+                    self.collection.insert_one(dict(document, _id=key, version=1))
+                    return send, new_entry
+                except DuplicateKeyError:
+                    # Another worker created the entry first, decide again against it
+                    continue
+
+            updated = self.collection.find_one_and_update(
+                {"_id": key, "version": current.get("version", 0)},
+                {"$set": document, "$inc": {"version": 1}},
+                return_document=ReturnDocument.AFTER
+            )
+            if updated is not None:
+                return send, new_entry
+
+        # Too much contention, err on the side of not flooding notifications
+        logger.warning(f"Alert dedup contention for {key}, suppressing")
+        return False, decide(None, now)[1]
+
+    def clear(self):
+        self.collection.delete_many({})
+
+def _utc_datetime(timestamp):
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc)
+
+class AlertDeduplicator:
+    """Rate limits alerts per device, room and set of exceeded thresholds
+
+    The first breach of an episode is sent straight away. While the breach continues, further
+    alerts are suppressed until the cooldown passes, then a reminder is sent at the next
+    escalation level and the cooldown is multiplied by escalation_factor (up to max_cooldown).
+    An episode ends once no breach has been seen for reset_after seconds.
+    """
+
+    def __init__(self, store=None, cooldown=900, escalation_factor=2.0, max_cooldown=4 * 3600, reset_after=None, clock=time.time):
+        self.store = store or InMemoryDedupStore()
+        self.cooldown = cooldown
+        self.escalation_factor = escalation_factor
+        self.max_cooldown = max_cooldown
+        self.reset_after = reset_after if reset_after is not None else cooldown
+        self.clock = clock
+
+    @staticmethod
+    def alert_key(sensor_data, exceeded_thresholds):
+        device_id = sensor_data.get("device_id", "unknown_device")
+        room_id = sensor_data.get("room_id", "unknown")
+        return f"{device_id}|{room_id}|{','.join(sorted(exceeded_thresholds))}"
+
+    def check(self, sensor_data, exceeded_thresholds):
+        """Record a breach and return whether an alert should go out for it"""
+        key = self.alert_key(sensor_data, exceeded_thresholds)
+        try:
+            send, entry = self.store.update(key, self._decide, self.clock())
+        except Exception as e:
+            # If the shared store is down, alerts still go out rather than being lost
+            logger.error(f"Alert dedup store failed, sending alert: {str(e)}")
+            return AlertDecision(True)
+        return AlertDecision(send, entry["level"], entry["suppressed"])
+
+    def _cooldown_for(self, level):
+        return min(self.cooldown * (self.escalation_factor ** level), self.max_cooldown)
+
+    def _decide(self, entry, now):
+        # New episode, nothing seen recently for this key
+        if entry is None or now - entry["last_seen"] > self.reset_after:
+            entry = {"level": 0, "suppressed": 0, "first_seen": now, "last_seen": now, "last_sent": now, "next_allowed": now + self._cooldown_for(0)}
+            send = True
+        elif now >= entry["next_allowed"]:
+            level = entry["level"] + 1
+            entry = dict(entry, level=level, suppressed=0, last_seen=now, last_sent=now, next_allowed=now + self._cooldown_for(level))
+            send = True
+        else:
+            entry = dict(entry, suppressed=entry["suppressed"] + 1, last_seen=now)
+            send = False
+        entry["expires_at"] = max(entry["next_allowed"], entry["last_seen"] + self.reset_after)
+        return send, entry
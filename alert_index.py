@@ -0,0 +1,215 @@
+import os
+import json
+import time
+import base64
+import logging
+import argparse
+from datetime import datetime, timedelta
+from boto3.dynamodb.conditions import Key, Attr
+from botocore.exceptions import ClientError
+from dynamo_reader import projection
+
+# Set up Logging
+logger = logging.getLogger(__name__)
+
+SEVERITY_INDEX = "severity-timestamp-index"
+MONTH_INDEX = "month-timestamp-index"
+# Global secondary indexes that turn alert lookups into range queries on timestamp
+ALERT_INDEXES = [
+    {
+        "IndexName": SEVERITY_INDEX,
+        "KeySchema": [{"AttributeName": "severity", "KeyType": "HASH"}, {"AttributeName": "timestamp", "KeyType": "RANGE"}],
+        "Projection": {"ProjectionType": "ALL"}
+    },
+    {
+        # One partition per month, so a time range without a severity is a query per month touched
+        "IndexName": MONTH_INDEX,
+        "KeySchema": [{"AttributeName": "alert_month", "KeyType": "HASH"}, {"AttributeName": "timestamp", "KeyType": "RANGE"}],
+        "Projection": {"ProjectionType": "ALL"}
+    }
+]
+ALERT_ATTRIBUTE_DEFINITIONS = [
+    {"AttributeName": "id", "AttributeType": "S"},
+    {"AttributeName": "severity", "AttributeType": "S"},
+    {"AttributeName": "timestamp", "AttributeType": "S"},
+    {"AttributeName": "alert_month", "AttributeType": "S"}
+]
+# How far back a query without since looks
+DEFAULT_LOOKBACK_DAYS = int(os.getenv("ALERT_LOOKBACK_DAYS", 365))
+
+def alert_month(timestamp):
+    """Month partition of an ISO timestamp, YYYY-MM"""
+    if isinstance(timestamp, datetime):
+        return f"{timestamp:%Y-%m}"
+    return str(timestamp)[:7]
+
+def _months(since, until):
+    """YYYY-MM values from until back to since, newest first"""
+    year, month = until.year, until.month
+    while (year, month) >= (since.year, since.month):
+        yield f"{year:04d}-{month:02d}"
+        year, month = (year, month - 1) if month > 1 else (year - 1, 12)
+
+def encode_cursor(state):
+    return base64.urlsafe_b64encode(json.dumps(state, sort_keys=True).encode()).decode()
+
+def decode_cursor(cursor):
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+def query_alerts(table, since=None, until=None, severity=None, limit=50, cursor=None):
+    """Alerts between since and until, newest first, as (items, next cursor or None)
+
+    With a severity the severity index is queried directly, otherwise the month index is queried
+    one month at a time from until backwards. The cursor carries the month and the
+    LastEvaluatedKey, so following pages continue where the last one stopped.
+    """
+    until = until or datetime.now()
+    since = since or until - timedelta(days=DEFAULT_LOOKBACK_DAYS)
+    state = decode_cursor(cursor) if cursor else {}
+    time_range = Key("timestamp").between(since.isoformat(), until.isoformat())
+
+    if severity:
+        partitions = [(severity, SEVERITY_INDEX, Key("severity").eq(severity))]
+    else:
+        partitions = [(month, MONTH_INDEX, Key("alert_month").eq(month)) for month in _months(since, until)]
+    if state.get("partition"):
+        labels = [label for label, _, _ in partitions]
+        if state["partition"] not in labels:
+            raise ValueError("Cursor does not match the query")
+        partitions = partitions[labels.index(state["partition"]):]
+
+    items = []
+    for position, (label, index_name, partition) in enumerate(partitions):
+        kwargs = {
+            "IndexName": index_name,
+            "KeyConditionExpression": partition & time_range,
+            "ScanIndexForward": False
+        }
+        if position == 0 and state.get("key"):
+            kwargs["ExclusiveStartKey"] = state["key"]
+        while True:
+            kwargs["Limit"] = limit - len(items)
+            response = table.query(**kwargs)
+            items.extend(response.get("Items", []))
+            last_key = response.get("LastEvaluatedKey")
+            if len(items) >= limit:
+                if last_key:
+                    return items, encode_cursor({"partition": label, "key": last_key})
+                # This partition is done, the next page starts on the following (older) one
+                return items, encode_cursor({"partition": partitions[position + 1][0]}) if position + 1 < len(partitions) else None
+            if not last_key:
+                break
+            kwargs["ExclusiveStartKey"] = last_key
+    return items, None
+
+def scan_alerts(table, since=None, until=None, severity=None, limit=50):
+    """Scan fallback used until the indexes exist, filtered on the server side"""
+    condition = None
+    if since or until:
+        until = until or datetime.now()
+        since = since or until - timedelta(days=DEFAULT_LOOKBACK_DAYS)
+        condition = Attr("timestamp").between(since.isoformat(), until.isoformat())
+    if severity:
+        condition = Attr("severity").eq(severity) if condition is None else condition & Attr("severity").eq(severity)
+    kwargs = {}
+    if condition is not None:
+        kwargs["FilterExpression"] = condition
+    items = []
+    while len(items) < limit:
+        response = table.scan(**kwargs)
+        items.extend(response.get("Items", []))
+        if not response.get("LastEvaluatedKey"):
+            break
+        kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+    # Scan order is arbitrary, so this is not necessarily the newest alerts
+    return sorted(items, key=lambda item: str(item.get("timestamp", "")), reverse=True)[:limit], None
+
+def find_alerts(table, since=None, until=None, severity=None, limit=50, cursor=None):
+    """query_alerts, falling back to a scan when the table has not been migrated yet"""
+    try:
+        return query_alerts(table, since, until, severity, limit, cursor)
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") != "ValidationException":
+            raise
+        logger.warning(f"Alert indexes missing, falling back to a scan (run alert_index.py to add them): {str(e)}")
+        return scan_alerts(table, since, until, severity, limit)
+
+def ensure_alert_indexes(client, table_name, wait=True, poll_interval=10):
+    """Add any missing alert GSIs, DynamoDB only allows one index to be created per update"""
+    created = []
+    description = client.describe_table(TableName=table_name)["Table"]
+    existing = {index["IndexName"] for index in description.get("GlobalSecondaryIndexes", [])}
+    on_demand = description.get("BillingModeSummary", {}).get("BillingMode") == "PAY_PER_REQUEST"
+    for index in ALERT_INDEXES:
+        if index["IndexName"] in existing:
+            continue
+        create = dict(index)
+        if not on_demand:
+            create["ProvisionedThroughput"] = {"ReadCapacityUnits": 5, "WriteCapacityUnits": 5}
+        needed = {key["AttributeName"] for key in index["KeySchema"]}
+        client.update_table(
+            TableName=table_name,
+            AttributeDefinitions=[definition for definition in ALERT_ATTRIBUTE_DEFINITIONS if definition["AttributeName"] in needed],
+            GlobalSecondaryIndexUpdates=[{"Create": create}]
+        )
+        logger.info(f"Creating index {index['IndexName']} on {table_name}")
+        created.append(index["IndexName"])
+        if wait:
+            _wait_for_index(client, table_name, index["IndexName"], poll_interval)
+    return created
+
+def _wait_for_index(client, table_name, index_name, poll_interval):
+    while True:
+        indexes = client.describe_table(TableName=table_name)["Table"].get("GlobalSecondaryIndexes", [])
+        status = next((index["IndexStatus"] for index in indexes if index["IndexName"] == index_name), None)
+        if status == "ACTIVE":
+            return
+        time.sleep(poll_interval)
+
+def backfill_alert_months(table, segment=0, total_segments=1):
+    """Set alert_month on alerts written before it existed, returns how many were updated"""
+    expression, names = projection(["id", "timestamp", "alert_month"])
+    kwargs = {
+        "ProjectionExpression": expression,
+        "ExpressionAttributeNames": names,
+        "FilterExpression": Attr("alert_month").not_exists() & Attr("timestamp").exists(),
+        "Segment": segment,
+        "TotalSegments": total_segments
+    }
+    updated = 0
+    while True:
+        response = table.scan(**kwargs)
+        for item in response.get("Items", []):
+            table.update_item(
+                Key={"id": item["id"]},
+                UpdateExpression="SET alert_month = :month",
+                ExpressionAttributeValues={":month": alert_month(item["timestamp"])}
+            )
+            updated += 1
+        if not response.get("LastEvaluatedKey"):
+            return updated
+        kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+if __name__ == "__main__":
+    import boto3
+    from concurrent.futures import ThreadPoolExecutor
+
+    parser = argparse.ArgumentParser(description="Add the time indexes to the Alerts table and backfill existing alerts")
+    parser.add_argument("--table", default=os.getenv("ALERT_TABLE", "Alerts"))
+    parser.add_argument("--skip-indexes", action="store_true", help="Only backfill alert_month")
+    parser.add_argument("--segments", type=int, default=4, help="Parallel scan segments for the backfill")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    dynamodb = boto3.resource("dynamodb", region_name=os.getenv("AWS_REGION", "eu-west-1"))
+    table = dynamodb.Table(args.table)
+    # Backfill first so the month index is complete as soon as it is active
+    with ThreadPoolExecutor(max_workers=args.segments) as executor:
+        updated = sum(executor.map(lambda segment: backfill_alert_months(table, segment, args.segments), range(args.segments)))
+    print(f"Backfilled alert_month on {updated} alerts")
+    if not args.skip_indexes:
+        created = ensure_alert_indexes(dynamodb.meta.client, args.table)
+        print(f"Created indexes: {', '.join(created)}" if created else "All alert indexes already exist")
@@ -0,0 +1,122 @@
+import time
+import queue
+import atexit
+import logging
+import threading
+
+# Set up Logging
+logger = logging.getLogger(__name__)
+
+class AlertPipeline:
+    """Delivers alert notifications and history writes on a bounded pool of worker threads
+
+    AlertService.check_thresholds still evaluates thresholds inline and hands breaches to
+    submit(). Workers look up preferences, then run each delivery task (SMS, email, history)
+    independently with retries, so a slow or failing AWS call never blocks ingestion.
+    """
+
+    def __init__(self, max_workers=4, max_queue_size=1000, max_retries=3, retry_delay=0.5):
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._workers = []
+        self._stopping = threading.Event()
+        self._metrics_lock = threading.Lock()
+        self._metrics = {
+            "submitted": 0,
+            "dropped": 0,
+            "delivered": 0,
+            "retried": 0,
+            "failed": 0
+        }
+
+    def start(self):
+        """Start the worker threads"""
+        if self._workers:
+            return self
+        self._stopping.clear()
+        for i in range(self.max_workers):
+            worker = threading.Thread(target=self._run, name=f"alert-worker-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        atexit.register(self.close)
+        return self
+
+    def submit(self, alert_service, sensor_data, exceeded_thresholds, thresholds):
+        """Queue an alert for delivery, returns False if the queue is full"""
+        # Copy so later changes by the caller (e.g. _id to str) don't leak into the worker
+        job = (alert_service, dict(sensor_data), list(exceeded_thresholds), thresholds)
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            logger.error(f"Alert queue full, dropping alert for {sensor_data.get('device_id')}: {exceeded_thresholds}")
+            self._record("dropped")
+            return False
+        self._record("submitted")
+        return True
+
+    def wait_idle(self, timeout=None):
+        """Block until every queued alert has been processed"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def close(self, timeout=5.0):
+        """Let the workers finish queued alerts and stop them"""
+        if not self._workers:
+            return
+        self.wait_idle(timeout)
+        self._stopping.set()
+        for worker in self._workers:
+            worker.join(timeout)
+        self._workers = []
+
+    def metrics(self):
+        """Return delivery counters and the current queue depth"""
+        with self._metrics_lock:
+            metrics = dict(self._metrics)
+        metrics["queue_depth"] = self._queue.qsize()
+        metrics["workers"] = len(self._workers)
+        return metrics
+
+    def _record(self, key, count=1):
+        with self._metrics_lock:
+            self._metrics[key] += count
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                alert_service, sensor_data, exceeded_thresholds, thresholds = self._queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            try:
+                tasks = alert_service._build_delivery_tasks(sensor_data, exceeded_thresholds, thresholds)
+                for name, task in tasks:
+                    self._run_with_retries(name, task)
+            except Exception as e:
+                logger.error(f"Error processing alert: {str(e)}")
+                self._record("failed")
+            finally:
+                self._queue.task_done()
+
+    def _run_with_retries(self, name, task):
+        for attempt in range(self.max_retries + 1):
+            try:
+                task()
+                self._record("delivered")
+                return True
+            except Exception as e:
+                if attempt == self.max_retries or self._stopping.is_set():
+                    logger.error(f"Alert {name} delivery failed after {attempt + 1} attempts: {str(e)}")
+                    self._record("failed")
+                    return False
+                logger.warning(f"Alert {name} delivery failed, retrying: {str(e)}")
+                self._record("retried")
+                # Exponential backoff between attempts
+                time.sleep(self.retry_delay * (2 ** attempt))
@@ -5,6 +5,10 @@ import boto3
 from datetime import datetime
 from flask import current_app
 from decimal import Decimal
+import threading
+import time
+from threshold_engine import ThresholdEngine, thresholds_for_room
+from alert_index import alert_month
 #Set up Logging
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
@@ -13,16 +17,16 @@ logger = logging.getLogger(__name__)
 class AlertService:
     """Manage alert generation, delivery, and tracking based on sensor thresholds"""
     
-    # Cache alerts to prevent duplicates 
-    _alert_cache = {}
-    _CACHE_TTL = 15 * 60 # Around 15 minutes in seconds
-    
-    def __init__(self,sns_client=None,ses_client=None,dynamodb=None,mongo_db=None):
+    def __init__(self,sns_client=None,ses_client=None,dynamodb=None,mongo_db=None,alert_pipeline=None,deduplicator=None):
         """Initailaise the alert Service with AWS clients ad database connections"""
         self.sns_client = sns_client or boto3.client("sns", region_name="eu-west-1")
         self.ses_client = ses_client or boto3.client("ses", region_name="eu-west-1")
         self.dynamodb = dynamodb or boto3.resource("dynamodb", region_name="eu-west-1")
         self.mongo_db = mongo_db
+        # When set, notifications and history writes are delivered by the pipeline workers
+        self.alert_pipeline = alert_pipeline
+        # When set, repeated alerts for the same breach are suppressed until the cooldown passes
+        self.deduplicator = deduplicator
         
         # Get environment variables
         self.sns_topic_arn = os.getenv("SNS_TOPIC_ARN")
@@ -41,8 +45,10 @@ class AlertService:
         # Connect to DynamoDB tables
         self.threshold_table = self.dynamodb.Table(self.threshold_table_name)
         self._notification_preferences_cache = {}
-        self._cache_expiry = 300 # in 5 minutes
+        self._cache_expiry = int(os.getenv("ALERT_CONFIG_CACHE_TTL", 300)) # in 5 minutes
         self._last_cache_update = 0
+        self._thresholds_cache = None
+        self._cache_lock = threading.Lock()
 
     def get_alerts_history(self):
         """Retrieve alert history from MongoDB or DynamoDB"""
@@ -53,16 +59,13 @@ class AlertService:
             logger.error(f"Error retrieving alerts: {str(e)}")
         return []
         
-    def check_thresholds(self, raw_data):
+    def check_thresholds(self, raw_data, thresholds=None):
         """Check the sensor data against configured thresholds and trigger alerts if exceeded"""
     
         try:
-            exceeded_thresholds = []
-            thresholds = self._get_thresholds()
-        
-            # Log raw data and thresholds for debugging
-            print(f"DEBUG: Raw data: {raw_data}")
-            print(f"DEBUG: Thresholds: {thresholds}")
+            # Batch callers pass in thresholds they already fetched once
+            if thresholds is None:
+                thresholds = self._get_thresholds()
         
             # Extract sensor data from nested structure
             sensor_data = {}
@@ -94,70 +97,69 @@ class AlertService:
             else:
                 # Handle JSON data that's not from DynamoDB
                 sensor_data = raw_data
-        
-            print(f"DEBUG: Processed sensor data: {sensor_data}")
 
-            # Rest of the method with the debug output for fixing bugs
-            if 'temperature' in sensor_data and 'temperature_range' in thresholds:
-                temp = sensor_data['temperature']
-                temp_range = thresholds['temperature_range']
-                print(f"DEBUG: Comparing temperature {temp} with range {temp_range}")
-                print(f"DEBUG: Is temp < low? {temp < temp_range[0]}")
-                print(f"DEBUG: Is temp > high? {temp > temp_range[1]}")
-            
-                if temp < temp_range[0]:
-                    exceeded_thresholds.append('temperature_low')
-                    print("DEBUG: Added temperature_low to exceeded_thresholds")
-            
-                elif temp > temp_range[1]:
-                    exceeded_thresholds.append('temperature_high')
-                    print("DEBUG: Added temperature_high to exceeded_thresholds")
-        
-            if 'humidity' in sensor_data and 'humidity_range' in thresholds:
-                humidity = sensor_data['humidity']
-                humidity_range = thresholds['humidity_range']
-                print(f"DEBUG: Comparing humidity {humidity} with range {humidity_range}")
-                print(f"DEBUG: Is humidity < low? {humidity < humidity_range[0]}")
-                print(f"DEBUG: Is humidity > high? {humidity > humidity_range[1]}")
-            
-                if humidity < humidity_range[0]:
-                    exceeded_thresholds.append('humidity_low')
-                    print("DEBUG: Added humidity_low to exceeded_thresholds")
-                elif humidity > humidity_range[1]:
-                    exceeded_thresholds.append('humidity_high')
-                    print("DEBUG: Added humidity_high to exceeded_thresholds")
-        
-            if 'flow_rate' in sensor_data and 'flow_rate_threshold' in thresholds:
-                flow_rate = sensor_data['flow_rate']
-                flow_threshold = thresholds['flow_rate_threshold']
-                print(f"DEBUG: Comparing flow_rate {flow_rate} with threshold {flow_threshold}")
-                print(f"DEBUG: Is flow_rate > threshold? {flow_rate > flow_threshold}")
-            
-                if flow_rate > flow_threshold:
-                    exceeded_thresholds.append('water_usage_high')
-                    print("DEBUG: Added water_usage_high to exceeded_thresholds")
-        
-            print(f"DEBUG: Final exceeded_thresholds: {exceeded_thresholds}")
+            # Same engine as the batch path, room overrides are applied per reading
+            exceeded_thresholds = ThresholdEngine(thresholds).evaluate_records([sensor_data])[0]
+            logger.debug(f"Thresholds checked for {sensor_data.get('device_id')}: {exceeded_thresholds}")
 
-            # Check for previous sent alert 
-            #alert_key = f"{sensor_data.get('device_id')}_{','.join(sorted(exceeded_thresholds))}"
-            #if self._is_alert_in_cache(alert_key):
-                #logger.info("Duplicate alert skipped, it's already cached")
-               # return []
-            
-            # If thresholds are exceeded trigger alerts
+            # If thresholds are exceeded trigger alerts, repeats are suppressed by the deduplicator
             if exceeded_thresholds:
-              #  self._add_to_cache(alert_key)
-                self._trigger_alerts(sensor_data, exceeded_thresholds, thresholds)
-                self._store_alert_history_dynamodb(sensor_data, exceeded_thresholds, thresholds)
+                self._dispatch_alerts(sensor_data, exceeded_thresholds, thresholds_for_room(thresholds, sensor_data.get('room_id')))
         
             return exceeded_thresholds
         except Exception as e:
             logger.error(f"Error checking thresholds: {str(e)}")
-            print(f"DEBUG: Exception in check_thresholds: {str(e)}")
             return []
+
+    def check_thresholds_batch(self, readings, thresholds=None):
+        """Check a batch of readings in one vectorised pass and trigger alerts for the ones exceeded"""
+        try:
+            if thresholds is None:
+                thresholds = self._get_thresholds()
+            results = ThresholdEngine(thresholds).evaluate_records(readings)
+            for sensor_data, exceeded_thresholds in zip(readings, results):
+                if exceeded_thresholds:
+                    self._dispatch_alerts(sensor_data, exceeded_thresholds, thresholds_for_room(thresholds, sensor_data.get('room_id')))
+            return results
+        except Exception as e:
+            logger.error(f"Error checking batch thresholds: {str(e)}")
+            return [[] for _ in readings]
+
+    def _dispatch_alerts(self, sensor_data, exceeded_thresholds, thresholds):
+        """Hands exceeded thresholds to the pipeline, or delivers them inline when there is none"""
+        if self.deduplicator is not None:
+            decision = self.deduplicator.check(sensor_data, exceeded_thresholds)
+            if not decision.send:
+                logger.info(f"Duplicate alert suppressed for {sensor_data.get('device_id')}: {exceeded_thresholds} ({decision.suppressed} suppressed)")
+                return
+            if decision.level:
+                sensor_data = dict(sensor_data, escalation_level=decision.level)
+        if self.alert_pipeline is not None:
+            self.alert_pipeline.submit(self, sensor_data, exceeded_thresholds, thresholds)
+        else:
+            self._trigger_alerts(sensor_data, exceeded_thresholds, thresholds)
+            self._store_alert_history_dynamodb(sensor_data, exceeded_thresholds, thresholds)
     
+    def invalidate_cache(self):
+        """Drop cached thresholds and notification preferences after they are changed"""
+        with self._cache_lock:
+            self._thresholds_cache = None
+            self._last_cache_update = 0
+            self._notification_preferences_cache = {}
+
     def _get_thresholds(self):
+        """Returns thresholds from the cache, reloading them once the TTL has passed"""
+        with self._cache_lock:
+            if self._thresholds_cache is not None and time.monotonic() - self._last_cache_update < self._cache_expiry:
+                return self._thresholds_cache
+
+        thresholds = self._load_thresholds()
+        with self._cache_lock:
+            self._thresholds_cache = thresholds
+            self._last_cache_update = time.monotonic()
+        return thresholds
+
+    def _load_thresholds(self):
         """Retrieving threhold settings from database, with fallback defaults"""
         
         if self.mongo_db is not None: # Comparing with none
@@ -218,7 +220,46 @@ class AlertService:
         else:
             logger.debug("Email alert suppressed due to user preferences")
     
+    def _build_delivery_tasks(self, sensor_data, exceeded_thresholds, thresholds):
+        """Returns the delivery steps for an alert as (name, callable) pairs that raise on failure"""
+        tasks = []
+        message = self._generate_alert_message(sensor_data, exceeded_thresholds, thresholds)
+        notification_prefs = self._get_notification_preferences(sensor_data.get("user_id", "default_user"))
+        is_critical = any(t in ['temperature_high', 'temperature_low', 'humidity_high', 'humidity_low'] for t in exceeded_thresholds)
+
+        if notification_prefs.get("critical_only", False) and not is_critical:
+            logger.info("Non-critical alert suppressed due to user preferences")
+        else:
+            if notification_prefs.get("sms_enabled", True):
+                tasks.append(("sms", lambda: self._send_sns_alert(message, raise_errors=True)))
+            if notification_prefs.get("email_enabled", True):
+                tasks.append(("email", lambda: self._send_email_alert(
+                    subject="Environmental Alert: Threshold Exceeded",
+                    message=message,
+                    sensor_data=sensor_data,
+                    exceeded_thresholds=exceeded_thresholds,
+                    thresholds=thresholds,
+                    raise_errors=True
+                )))
+
+        # One id for every attempt, a retry after a put that succeeded but timed out rewrites the same item
+        alert_id = f"alert-{datetime.now().timestamp()}"
+        tasks.append(("history", lambda: self._store_alert_history_dynamodb(sensor_data, exceeded_thresholds, thresholds, raise_errors=True, alert_id=alert_id)))
+        return tasks
+
     def _get_notification_preferences(self, user_id):
+        """Get notification preferences for user, cached for the TTL"""
+        with self._cache_lock:
+            cached = self._notification_preferences_cache.get(user_id)
+        if cached and time.monotonic() - cached[1] < self._cache_expiry:
+            return cached[0]
+
+        prefs = self._load_notification_preferences(user_id)
+        with self._cache_lock:
+            self._notification_preferences_cache[user_id] = (prefs, time.monotonic())
+        return prefs
+
+    def _load_notification_preferences(self, user_id):
         """Get notification preferences for user"""
         default_prefs = {
             "email_enabled": True,
@@ -256,6 +297,8 @@ class AlertService:
                 timestamp = datetime.now()
         # Condtions depending on the sensor output
         message = f"Alert: environmental conditions exceeded at {location} ({timestamp.strftime('%Y-%m-%d %H:%M:%S')})"
+        if sensor_data.get('escalation_level'):
+            message = f"Ongoing alert (reminder {sensor_data['escalation_level']}): " + message
         # Checks for any sensor thresholds and delivers the specified alert context with the contexualised sensor value
         for threshold in exceeded_thresholds:
             if threshold == 'temperature_high':
@@ -280,7 +323,7 @@ class AlertService:
         message += "Login to dashboard for more detials and historical data"
         return message
     
-    def _send_sns_alert(self,message):
+    def _send_sns_alert(self,message, raise_errors=False):
         """Sends an SMS notification via AWS SNS"""
         try:
             if not self.sns_topic_arn:
@@ -297,8 +340,10 @@ class AlertService:
         except Exception as e:
             logger.error(f"Failed to send SMS alert: {str(e)}")
             # Logs failure in Cloudwatch
+            if raise_errors:
+                raise
             
-    def _send_email_alert(self,subject, message, sensor_data, exceeded_thresholds,thresholds):
+    def _send_email_alert(self,subject, message, sensor_data, exceeded_thresholds,thresholds, raise_errors=False):
         """Sends an email notification through AWS SES"""
         try:
             if not self.ses_email_sender or not self.ses_email_recipient:
@@ -338,6 +383,8 @@ class AlertService:
             logger.info(f"Email alert sent successfully: {response.get('MessageId')}")
         except Exception as e:
             logger.error(f"Failed to send email alert: {str(e)}")
+            if raise_errors:
+                raise
             
     
     def _generate_html_email(self,sensor_data, exceeded_thresholds, thresholds):
@@ -443,42 +490,6 @@ class AlertService:
         
         return html
 
-    def _is_alert_in_cache(self,key):
-        """Checks if alert was recently sent to avoid any duplicates"""
-        # Gets current timestamp
-        now = datetime.now().timestamp()
-        if key not in self._alert_cache:
-            return False
-        # Check if cahched alert has expired
-        cache_time = self._alert_cache[key]
-        # If cached alert is older than TTL, it should  be considered as expired
-        if now - cache_time > self._CACHE_TTL:
-            # Deletes object
-            del self._alert_cache[key]
-            return False
-        return True
-    
-    def _add_to_cache(self, key):
-        """Adds alerts to cahce with the current timestamp"""
-        
-        # Cleans up the old cache entries
-        self._alert_cache[key] = datetime.now().timestamp()
-        
-        if len(self._alert_cache) > 100:
-            self._clean_cache()
-            
-    def _clean_cache(self):
-        """Removes expired entries for the alert cache"""
-        now = datetime.now().timestamp()
-        # Identify and remove expired cache entries
-        expired_keys = [
-            k for k, v in self._alert_cache.items()
-            if now -v > self._CACHE_TTL
-        ]
-        
-        for key in expired_keys:
-            del self._alert_cache[key]
-
     # For DynamoDB as it cannot take float values to be processed as alerts
     def _convert_floats_to_decimal(self,obj):
         """Recursivley convert all float values to Decimal for DynamoDB compatability"""
@@ -493,15 +504,15 @@ class AlertService:
         else:
             return obj
         
-    def _store_alert_history_dynamodb(self, sensor_data, exceeded_thresholds, thresholds):
-        """Stores alert information in DynamoDB for historical tracking"""
+    def _store_alert_history_dynamodb(self, sensor_data, exceeded_thresholds, thresholds, raise_errors=False, alert_id=None):
+        """Stores alert information in DynamoDB for historical tracking, under alert_id when one is given"""
     
         try:
             # Determine alert severity
             severity = "critical" if any(t in ['temperature_high', 'temperature_low','humidity_high', 'humidity_low'] for t in exceeded_thresholds) else "warning"
         
             # Create alert item with a ID and timestamp
-            alert_id = f"alert-{datetime.now().timestamp()}"
+            alert_id = alert_id or f"alert-{datetime.now().timestamp()}"
             device_id = sensor_data.get("device_id", "unknown_device")
                  
             # Convert all float values to decimal for DynamoDB compatability
@@ -525,9 +536,12 @@ class AlertService:
                 "id": alert_id,
                 "device_id": device_id,
                 "timestamp": timestamp,
+                # Partition key of the month index, so alert history is queried by time range
+                "alert_month": alert_month(timestamp),
                 "sensor_data": sensor_data_for_dynamo,
                 "exceeded_thresholds": exceeded_thresholds,
                 "severity": severity,
+                "escalation_level": sensor_data.get("escalation_level", 0),
                 "processed": True
             }
         
@@ -540,6 +554,8 @@ class AlertService:
         
         except Exception as e:
             logger.error(f"Failed to store alert history in DynamoDB: {str(e)}")
+            if raise_errors:
+                raise
                                          
             
         
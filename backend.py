@@ -1,13 +1,16 @@
 import pytest
-from flask import Flask,jsonify,request,g
+from flask import Flask,jsonify,request,g,Response
 from flask_cors import CORS
 import os
 from dotenv import load_dotenv
 from sense_hat import SenseHat
 from datetime import datetime,timedelta,timezone
 from pymongo import MongoClient
+from pymongo.errors import BulkWriteError
 import logging
 from alert_service import AlertService
+from alert_pipeline import AlertPipeline
+from alert_dedup import AlertDeduplicator, InMemoryDedupStore, MongoDedupStore
 from reports import report_routes
 import boto3
 from boto3.dynamodb.conditions import Key
@@ -28,6 +31,21 @@ import uuid
 import sys
 from device_ml import DeviceMLModel
 from energy_optimiser import EnergyOptimiser
+from ingest_buffer import IngestBuffer, IngestBufferFull
+from downsampling import lttb, time_bucket_pipeline
+from rollups import RollupStore, SENSOR_METRICS, WATER_METRICS
+from latest_cache import LatestReadingCache
+from live_stream import LiveBroadcaster, StreamTickets, MongoStreamTickets
+from sensehat_sampler import SenseHatSampler
+from s3_cache import S3CsvCache, DEFAULT_CACHE_DIR
+from parquet_archive import ParquetArchive, PARQUET_AVAILABLE
+from dynamo_reader import query_items_parallel
+from forecast_registry import ModelRegistry
+from batch_forecast import BatchForecaster
+from alert_index import ALERT_INDEXES, ALERT_ATTRIBUTE_DEFINITIONS, alert_month, find_alerts
+import reports
+import db_indexes
+import cpu_calibration
 #logging setup for debugging and operational visibility
 load_dotenv()
 logging.basicConfig(level=logging.DEBUG)
@@ -46,6 +64,11 @@ sns_client = boto3.client("sns", region_name="eu-west-1")
 ses_client = boto3.client("ses",region_name="eu-west-1")
 # Simple Storage Service for storing long term data
 s3_client = boto3.client('s3', region_name='eu-west-1')
+s3_csv_cache = S3CsvCache(
+    s3_client,
+    cache_dir=os.getenv("S3_CACHE_DIR", DEFAULT_CACHE_DIR),
+    ttl=int(os.getenv("S3_CACHE_TTL", 300))
+)
 # Bedrock runtime for executing AI/ML models for recommendations
 bedrock_client = boto3.client('bedrock-runtime', region_name='eu-west-1')
 
@@ -53,6 +76,9 @@ bedrock_client = boto3.client('bedrock-runtime', region_name='eu-west-1')
 THRESHOLD_TABLE = os.getenv("THRESHOLD_TABLE","Thresholds")
 SENSOR_TABLE = dynamodb.Table(os.getenv("SENSEHAT_TABLE", "SenseHatData"))
 WATER_TABLE = dynamodb.Table(os.getenv("WATER_TABLE", "WaterFlowData"))
+# History ranges are read from DynamoDB as this many time slices in parallel, a page at a time
+DYNAMO_QUERY_SEGMENTS = int(os.getenv("DYNAMO_QUERY_SEGMENTS", 4))
+DYNAMO_PAGE_SIZE = int(os.getenv("DYNAMO_PAGE_SIZE", 1000))
 threshold_table = dynamodb.Table(THRESHOLD_TABLE)
 
 #Database setup in MongoDB for storing sensor data,thresholds and alert history
@@ -63,6 +89,10 @@ thresholds_collection = db.thresholds
 alert_history_collection = db.alert_history
 water_data_collection = db.water_data
 query_logs_collection = db.query_logs
+
+# Indexes are created by `python db_indexes.py` on deploy, this optionally repeats it off the startup path
+if os.getenv("MONGO_ENSURE_INDEXES", "false").lower() == "true":
+    db_indexes.provision_in_background(os.getenv("MONGO_URI"))
 CERTIFICATE_PATH = os.getenv("CERTIFICATE_PATH")
 PRIVATE_KEY_PATH = os.getenv("PRIVATE_KEY_PATH")
 ROOT_CA_PATH = os.getenv("ROOT_CA_PATH")
@@ -90,6 +120,11 @@ default_temperature_range = [20,25] #indoor temperature range in celsius
 default_humidity_range =[30,60] #indoor ranfe in perentage
 HUMIDITY_THRESHOLD_LOW = 30 #low humidity alert threshold
 HUMIDITY_THRESHOLD_HIGH = 60 #high humidity alert threshold
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", 1000)) #max readings accepted per batch upload
+MAX_HISTORY_POINTS = 5000 #max points returned by downsampled history
+ROLLUP_MIN_DAYS = int(os.getenv("ROLLUP_MIN_DAYS", 2)) #ranges this long or longer are served from rollups
+MAX_BATCH_FORECAST_HOURS = int(os.getenv("MAX_BATCH_FORECAST_HOURS", 7 * 24)) #longest horizon for batch forecasts
+MAX_ANOMALY_BATCH = int(os.getenv("MAX_ANOMALY_BATCH", 100000)) #max readings scored per anomaly detection request
 
 #global variables to store latest data 
 latest_co2_data = None
@@ -232,12 +267,20 @@ def auth_middleware():
         return
 
     # Skip token verification for public endpoints
-    if request.path in ['/api/health', '/api/login', '/api/sensor-data-upload', '/api/predictive-analysis','/api/debug/add-test-water-data']:
+    if request.path in ['/api/health', '/api/login', '/api/sensor-data-upload', '/api/sensor-data-upload/batch', '/api/predictive-analysis','/api/debug/add-test-water-data']:
         logging.debug(f"Skipping auth for public endpoint: {request.path}")
         return
     
     # Get the token from the Authorization header
     auth_header = request.headers.get('Authorization')
+    # EventSource cannot send headers, so the live stream accepts a single use ticket instead
+    if not auth_header and request.path == '/api/stream' and request.args.get('ticket'):
+        user = stream_tickets.redeem(request.args.get('ticket'))
+        if user is None:
+            logging.warning("Invalid or expired stream ticket")
+            return jsonify({"error": "Unauthorized: Invalid stream ticket"}), 401
+        g.user = user
+        return
     if not auth_header:
         logging.warning(f"Missing Authorization header for {request.path}")
         return jsonify({"error": "Unauthorized: Missing token"}), 401
@@ -347,11 +390,29 @@ def auth_test():
         return jsonify({"error": str(e)}), 500
     
 # create alert service
+# Alert delivery (SNS, SES and DynamoDB history) runs on worker threads off the ingest path
+alert_pipeline = AlertPipeline(
+    max_workers=int(os.getenv("ALERT_WORKERS", 4)),
+    max_retries=int(os.getenv("ALERT_MAX_RETRIES", 3))
+).start()
+# Suppress repeat alerts during a sustained breach, shared through MongoDB when running several workers
+if os.getenv("ALERT_DEDUP_BACKEND", "memory") == "mongo":
+    alert_dedup_store = MongoDedupStore(db.alert_dedup)
+else:
+    alert_dedup_store = InMemoryDedupStore()
+alert_deduplicator = AlertDeduplicator(
+    store=alert_dedup_store,
+    cooldown=int(os.getenv("ALERT_COOLDOWN", 900)),
+    escalation_factor=float(os.getenv("ALERT_ESCALATION_FACTOR", 2)),
+    max_cooldown=int(os.getenv("ALERT_MAX_COOLDOWN", 4 * 3600))
+)
 alert_service= AlertService(
     sns_client=sns_client,
     ses_client=ses_client,
     dynamodb=dynamodb,
-    mongo_db=db
+    mongo_db=db,
+    alert_pipeline=alert_pipeline,
+    deduplicator=alert_deduplicator
 )
 
 # Initialise device machine learning model for anomaly detection and predictions
@@ -360,6 +421,75 @@ device_ml_model = DeviceMLModel()
 # Initialise optimiser services for providing recommendatiosn
 energy_optimiser = EnergyOptimiser()
 
+# Pre-aggregated 1 minute / 1 hour / 1 day rollups used for long range charts and reports
+rollup_store = RollupStore(db.sensor_rollups)
+reports.set_rollup_store(rollup_store)
+
+def update_rollups(collection, documents):
+    """Keeps the rollups current as readings are stored"""
+    try:
+        if collection.name == water_data_collection.name:
+            rollup_store.update_from_documents(documents, WATER_METRICS)
+        elif collection.name == sensor_data_collection.name:
+            rollup_store.update_from_documents(documents, SENSOR_METRICS)
+    except Exception as e:
+        logging.error(f"Error updating rollups: {str(e)}")
+
+# Pushes stored readings to dashboards subscribed to /api/stream
+live_broadcaster = LiveBroadcaster(
+    max_queue=int(os.getenv("STREAM_QUEUE_SIZE", 100)),
+    max_subscribers=int(os.getenv("STREAM_MAX_SUBSCRIBERS", 1000))
+)
+
+# Tickets handed out by /api/stream/ticket, so the bearer token never goes in the stream URL
+# Shared through MongoDB by default, the worker that redeems a ticket is rarely the one that issued it
+if os.getenv("STREAM_TICKET_BACKEND", "mongo") == "mongo":
+    stream_tickets = MongoStreamTickets(db.stream_tickets, ttl=float(os.getenv("STREAM_TICKET_TTL", 30)))
+else:
+    stream_tickets = StreamTickets(ttl=float(os.getenv("STREAM_TICKET_TTL", 30)))
+
+# Latest reading per room served from memory, kept current by ingest and a change stream
+# Readings from other workers arrive on the change stream and are streamed from here too
+latest_readings = LatestReadingCache(
+    sensor_data_collection,
+    water_data_collection,
+    refresh_interval=float(os.getenv("LATEST_CACHE_REFRESH", 30)),
+    on_change=lambda collection_name, documents: live_broadcaster.publish(collection_name, documents)
+)
+if os.getenv("LATEST_CACHE_ENABLED", "true").lower() == "true":
+    latest_readings.start()
+
+# Fitted forecasting models per series for /api/predictive-analysis, refit in the background
+forecast_registry = ModelRegistry(
+    min_new_points=int(os.getenv("FORECAST_REFIT_POINTS", 10)),
+    max_entries=int(os.getenv("FORECAST_REGISTRY_SIZE", 256))
+)
+
+# Vectorised forecasts for every room and metric at once, cached until the rollups change
+batch_forecaster = BatchForecaster(
+    method=os.getenv("BATCH_FORECAST_METHOD", "ar"),
+    workers=int(os.getenv("BATCH_FORECAST_WORKERS", 2)),
+    ttl=int(os.getenv("BATCH_FORECAST_TTL", 300))
+)
+
+def on_documents_stored(collection, documents):
+    """Runs after readings are written, updates rollups, the latest reading cache and live streams"""
+    update_rollups(collection, documents)
+    latest_readings.update(collection.name, documents)
+    try:
+        live_broadcaster.publish(collection.name, documents)
+    except Exception as e:
+        logging.error(f"Error publishing live readings: {str(e)}")
+
+# Write-behind buffer so ingest requests do not each wait on their own MongoDB round trip
+ingest_buffer = IngestBuffer(
+    on_flush=on_documents_stored,
+    max_batch_size=int(os.getenv("INGEST_BATCH_SIZE", 500)),
+    flush_interval=float(os.getenv("INGEST_FLUSH_INTERVAL", 0.5)),
+    max_queue_size=int(os.getenv("INGEST_QUEUE_SIZE", 10000)),
+    durability=os.getenv("INGEST_DURABILITY", "flush")
+).start()
+
 def validate_environment():
     """Validate critical environment variables are set before the app"""
     required_vars = [
@@ -379,6 +509,16 @@ def health_check():
     """Simple check for checking endpoint API's are working"""
     return jsonify({"status": "healthy"}), 200
 
+@app.route('/api/ingest/metrics', methods=['GET'])
+def get_ingest_metrics():
+    """Queue depth and flush latency of the ingest write buffer and alert pipeline"""
+    metrics = ingest_buffer.metrics()
+    metrics["alerts"] = alert_pipeline.metrics()
+    metrics["latest_cache"] = latest_readings.stats()
+    metrics["stream"] = live_broadcaster.stats()
+    metrics["sensehat_sampler"] = sense_hat_sampler.metrics()
+    return jsonify(metrics), 200
+
 def calculate_carbon_footprint(data):
     """Calcualates carbon footprint"""
     footprint = 0
@@ -403,12 +543,36 @@ def calculate_carbon_footprint(data):
     return min(footprint, 100) # up to 100%
 
 # Retrieves S£ data from its respective bucket
-def fetch_s3_csv(bucket_name, file_key):
-    "Fetch CSV file from S3 and return pandas dataframe"
+# Parquet archives converted from the long term CSVs with parquet_archive.py, keyed by CSV name
+LONG_TERM_ARCHIVE_PREFIXES = {
+    'carbon_footprint_training_sensehat.csv': os.getenv("SENSEHAT_ARCHIVE_PREFIX", "archive/sensehat"),
+    'carbon_footprint_training_waterflow.csv': os.getenv("WATERFLOW_ARCHIVE_PREFIX", "archive/waterflow"),
+    'carbon_footprint_training_combined.csv': os.getenv("COMBINED_ARCHIVE_PREFIX", "archive/combined")
+}
+parquet_archives = {}
+
+def get_parquet_archive(bucket_name, file_key):
+    """Parquet archive standing in for a long term CSV, None if pyarrow is missing or the CSV has none"""
+    prefix = LONG_TERM_ARCHIVE_PREFIXES.get(file_key)
+    if not PARQUET_AVAILABLE or not prefix:
+        return None
+    if (bucket_name, file_key) not in parquet_archives:
+        parquet_archives[(bucket_name, file_key)] = ParquetArchive(s3_client, bucket_name, prefix)
+    return parquet_archives[(bucket_name, file_key)]
+
+def fetch_s3_csv(bucket_name, file_key, tail=None):
+    "Fetch CSV file from S3 and return pandas dataframe, only the last tail rows if given"
     try:
-        response =s3_client.get_object(Bucket=bucket_name, Key=file_key)
-        content = response['Body'].read().decode('utf-8')
-        df = pd.read_csv(StringIO(content))
+        archive = get_parquet_archive(bucket_name, file_key)
+        if archive is not None and archive.exists():
+            # Newest partitions only, timestamps as strings like the CSV
+            df = archive.tail(tail) if tail else archive.read()
+            df['timestamp'] = df['timestamp'].map(lambda t: t.isoformat())
+            return df
+        # Cached by ETag, unchanged files are not downloaded or parsed again
+        df = s3_csv_cache.get_frame(bucket_name, file_key)
+        if tail:
+            df = df.tail(tail)
         
         if df.empty:
             logging.warning(f"No data found in S3 for {file_key}")
@@ -419,7 +583,7 @@ def fetch_s3_csv(bucket_name, file_key):
 
 def get_long_term_sensor_trends():
     try:
-        df = fetch_s3_csv('sensehat-longterm-storage', 'carbon_footprint_training_sensehat.csv')
+        df = fetch_s3_csv('sensehat-longterm-storage', 'carbon_footprint_training_sensehat.csv', tail=7)
         return df.tail(7) if not df.empty else pd.DataFrame()
     except Exception as e:
         logging.error(f"Errror fetching sensor trends: {str(e)}")
@@ -427,14 +591,32 @@ def get_long_term_sensor_trends():
 
 def get_long_term_water_trends():
     try:
-        df = fetch_s3_csv('waterflow-longterm-storage', 'carbon_footprint_training_waterflow.csv')
+        df = fetch_s3_csv('waterflow-longterm-storage', 'carbon_footprint_training_waterflow.csv', tail=7)
         return df.tail(7) if not df.empty else pd.DataFrame()
     except Exception as e:
         logging.error(f"Errror fetching sensor trends: {str(e)}")
         return pd.DataFrame()
 
+# State written by the ProcessCarbonFootprintData Lambda when it merges incrementally
+COMBINED_PARTS_STATE_KEY = os.getenv("COMBINED_PARTS_PREFIX", "combined_parts/") + "_state.json"
+
+def fetch_combined_parts(bucket_name, tail):
+    """Rows the incremental merge has written to part files since the combined CSV was last compacted"""
+    try:
+        response = s3_client.get_object(Bucket=bucket_name, Key=COMBINED_PARTS_STATE_KEY)
+        parts = json.loads(response['Body'].read().decode('utf-8')).get("parts", [])
+    except Exception:
+        # No state, the Lambda is doing full rebuilds
+        return pd.DataFrame()
+    # Every part has at least one row, so the last tail parts are enough. Parts are never rewritten so they stay cached
+    frames = [s3_csv_cache.get_frame(bucket_name, part) for part in parts[-tail:]]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
 def get_training_data():
-    df = fetch_s3_csv('training-ecodetect', 'carbon_footprint_training_combined.csv')
+    df = fetch_s3_csv('training-ecodetect', 'carbon_footprint_training_combined.csv', tail=7)
+    parts = fetch_combined_parts('training-ecodetect', 7)
+    if not parts.empty:
+        df = pd.concat([df, parts], ignore_index=True).drop_duplicates(subset=['timestamp'], keep='last')
     return df.tail(7)
 # Normalises the sensor data to have less noise and be more accurate by taking into account of the CPU temperature   
 def normalize_sensor_data(data):
@@ -523,10 +705,38 @@ def get_default_thresholds():
         }
     return thresholds
 
+def prepare_sensor_document(raw_data):
+    """Normalise an uploaded reading into the sensor document and optional water document"""
+    global latest_flow_data
+    # Normalise the data
+    normalized_data = normalize_sensor_data(raw_data)
+    water_data = None
+
+    if 'flow_rate' in raw_data:
+        normalized_data['flow_rate'] = raw_data['flow_rate']
+        latest_flow_data = raw_data['flow_rate']
+
+        if raw_data.get('device_id') == 'water_sensor_pi':
+            water_data = {
+                'flow_rate': raw_data['flow_rate'],
+                'room_id': raw_data.get('room_id'),
+                'device_id': raw_data.get('device_id'),
+                'location': raw_data.get('location'),
+                'timestamp': datetime.now()
+
+            }
+
+    #Adds time stamp and metadata
+    normalized_data['timestamp'] = datetime.now()
+    normalized_data['location'] = raw_data.get('location', 'Unknown Room')
+    normalized_data['room_id'] = raw_data.get('room_id', 'unknown')
+    normalized_data['device_id'] = raw_data.get('device_id', 'unknown')
+
+    return normalized_data, water_data
+
 #recieves sensor data from the other Raspberry Pi's
 @app.route('/api/sensor-data-upload', methods=['POST'])
 def receive_sensor_data():
-    global latest_co2_data, latest_flow_data
     try:
         raw_data = request.json
         
@@ -538,37 +748,15 @@ def receive_sensor_data():
         if missing_keys:
             raise APIError(f"Missing required keys: {', '.join(missing_keys)}", 400)
         
-        # Normalise the data
-        normalized_data = normalize_sensor_data(raw_data)
-
-        if 'flow_rate' in raw_data:
-            normalized_data['flow_rate'] = raw_data['flow_rate']
-            latest_flow_data = raw_data['flow_rate']
-
-            if raw_data.get('device_id') == 'water_sensor_pi':
-                water_data = {
-                    'flow_rate': raw_data['flow_rate'],
-                    'room_id': raw_data.get('room_id'),
-                    'device_id': raw_data.get('device_id'),
-                    'location': raw_data.get('location'),
-                    'timestamp': datetime.now()
-
-                }
-                water_data_collection.insert_one(water_data)
-
-        #Adds time stamp and metadata
-        normalized_data['timestamp'] = datetime.now()
-        normalized_data['location'] = raw_data.get('location', 'Unknown Room')
-        normalized_data['room_id'] = raw_data.get('room_id', 'unknown')
-        normalized_data['device_id'] = raw_data.get('device_id', 'unknown')
+        normalized_data, water_data = prepare_sensor_document(raw_data)
+        if water_data:
+            ingest_buffer.submit(water_data_collection, water_data)
         
         logging.debug(f"Normalised Data: {normalized_data}")
         
         try:
             # this also includes room_id in MongoDB query to allow filtering
-            result = sensor_data_collection.insert_one(normalized_data)
-            if not result.inserted_id:
-                raise Exception("Failed to insert data into MongoDB")
+            ingest_buffer.submit(sensor_data_collection, normalized_data)
 
             try:
                 exceeded_thresholds = alert_service.check_thresholds(normalized_data)
@@ -583,6 +771,9 @@ def receive_sensor_data():
             if '_id' in normalized_data_response:
                 normalized_data_response['_id'] = str(normalized_data_response['_id'])
                 
+        except IngestBufferFull:
+            logging.error("Ingest queue is full, rejecting sensor data")
+            return jsonify({"error": "Server busy, retry later"}), 503
         except Exception as e:
             logging.error(f"MongoDB insertion error: {str(e)}")
             return jsonify({"error": "Failed to insert sensor data"}), 500
@@ -595,12 +786,94 @@ def receive_sensor_data():
         logging.error(f"Error in /api/sensor-data: {str(e)}", exc_info=True)
         raise APIError("Failed to process sensor data", 500)
 
+def _failed_batch_indexes(error):
+    """Map a BulkWriteError back to the positions of the documents that failed"""
+    return {write_error['index']: write_error.get('errmsg', 'Write failed') for write_error in error.details.get('writeErrors', [])}
+
+# Recieves a batch of readings from a Pi in one request, written with a single bulk insert
+@app.route('/api/sensor-data-upload/batch', methods=['POST'])
+def receive_sensor_data_batch():
+    try:
+        raw_data = request.json
+
+        # Accept either a plain list or {"readings": [...]}
+        readings = raw_data.get('readings') if isinstance(raw_data, dict) else raw_data
+        if not readings or not isinstance(readings, list):
+            raise APIError("Request body must be a non-empty list of readings", 400)
+        if len(readings) > MAX_BATCH_SIZE:
+            raise APIError(f"Batch size exceeds the limit of {MAX_BATCH_SIZE} readings", 413)
+
+        results = [None] * len(readings)
+        sensor_documents = []
+        sensor_positions = []
+        water_documents = []
+
+        # Validate and normalise every reading before touching the database
+        for index, reading in enumerate(readings):
+            if not isinstance(reading, dict) or 'room_id' not in reading:
+                results[index] = {"index": index, "status": "error", "error": "Missing required keys: room_id"}
+                continue
+            try:
+                normalized_data, water_data = prepare_sensor_document(reading)
+            except Exception as e:
+                results[index] = {"index": index, "status": "error", "error": str(e)}
+                continue
+            sensor_documents.append(normalized_data)
+            sensor_positions.append(index)
+            if water_data:
+                water_documents.append(water_data)
+
+        failed = {}
+        if sensor_documents:
+            try:
+                # Unordered so one bad document does not stop the rest of the batch
+                sensor_data_collection.insert_many(sensor_documents, ordered=False)
+            except BulkWriteError as e:
+                logging.error(f"Bulk insert partially failed: {e.details.get('writeErrors')}")
+                failed = _failed_batch_indexes(e)
+            except Exception as e:
+                logging.error(f"MongoDB bulk insertion error: {str(e)}")
+                return jsonify({"error": "Failed to insert sensor data"}), 500
+
+        if water_documents:
+            try:
+                water_data_collection.insert_many(water_documents, ordered=False)
+                on_documents_stored(water_data_collection, water_documents)
+            except Exception as e:
+                logging.error(f"Error inserting water data batch: {str(e)}")
+
+        # Thresholds for every stored reading are evaluated together in one vectorised pass
+        stored = [position for position in range(len(sensor_documents)) if position not in failed]
+        on_documents_stored(sensor_data_collection, [sensor_documents[position] for position in stored])
+        exceeded = alert_service.check_thresholds_batch([sensor_documents[position] for position in stored]) if stored else []
+        exceeded_by_position = dict(zip(stored, exceeded))
+
+        for position, document in enumerate(sensor_documents):
+            index = sensor_positions[position]
+            if position in failed:
+                results[index] = {"index": index, "status": "error", "error": failed[position]}
+                continue
+            results[index] = {"index": index, "status": "ok", "_id": str(document.get('_id')), "exceeded_thresholds": exceeded_by_position.get(position, [])}
+
+        accepted = sum(1 for result in results if result['status'] == 'ok')
+        # 207 tells the device to check the per-item status and retry only the failed readings
+        status_code = 200 if accepted == len(readings) else 207
+        return jsonify({"message": f"{accepted} of {len(readings)} readings stored", "accepted": accepted, "rejected": len(readings) - accepted, "results": results}), status_code
+
+    except APIError:
+        raise
+    except Exception as e:
+        logging.error(f"Error in /api/sensor-data-upload/batch: {str(e)}", exc_info=True)
+        raise APIError("Failed to process sensor data batch", 500)
+
 @app.route('/api/rooms', methods=['GET'])
 def get_room_list():
     """Get list of all rooms with sensors"""
     try:
-        # Distinct query to find all unique room_ids
-        rooms = sensor_data_collection.distinct("room_id")
+        rooms = latest_readings.rooms()
+        if not rooms:
+            # Distinct query to find all unique room_ids
+            rooms = sensor_data_collection.distinct("room_id")
         return jsonify(rooms)
     except Exception as e:
         logging.error(f"Error getting room list: {str(e)}")
@@ -610,6 +883,11 @@ def get_room_list():
 def get_room_sensor_data(room_id):
     """Get sensor data for a specific room"""
     try:
+        cached = latest_readings.get(room_id)
+        if cached is not None:
+            cached["_id"] = str(cached.get("_id"))
+            return jsonify(cached)
+
         # Find the latest data for this room
         latest_data = sensor_data_collection.find_one(
             {"room_id": room_id},
@@ -644,6 +922,31 @@ def get_room_sensor_data(room_id):
         logging.error(f"Error in room sensor data: {str(e)}")
         return jsonify({"error": str(e)}), 500
     
+@app.route('/api/stream/ticket', methods=['POST'])
+def issue_stream_ticket():
+    """Single use ticket for opening /api/stream?ticket=, valid for STREAM_TICKET_TTL seconds"""
+    ticket = stream_tickets.issue(dict(g.user))
+    return jsonify({"ticket": ticket, "expires_in": stream_tickets.ttl})
+
+@app.route('/api/stream', methods=['GET'])
+def stream_sensor_data():
+    """Server-Sent Events stream of readings as they are stored, filtered by ?rooms= and ?metrics=
+
+    Browsers authenticate with a ?ticket= from /api/stream/ticket, other clients can send the usual header.
+    """
+    rooms = [room for room in request.args.get('rooms', '').split(',') if room]
+    metrics = [metric for metric in request.args.get('metrics', '').split(',') if metric]
+    subscription = live_broadcaster.subscribe(rooms=rooms, metrics=metrics)
+    if subscription is None:
+        return jsonify({"error": "Too many live stream subscribers, try again later"}), 503
+
+    heartbeat = float(os.getenv("STREAM_HEARTBEAT", 15))
+    return Response(
+        subscription.events(heartbeat=heartbeat),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 # monitoring thresholds
 @app.route('/api/monitor-thresholds', methods=['POST'])
 def monitor_thresholds():
@@ -1377,6 +1680,117 @@ def generate_fallback_response(query, temperature, humidity, flow_rate, vehicle_
     return "I can help you reduce your environmental impact and monitor your resource usage. Feel free to ask about your sensor readings, carbon footprint reduction tips, or water conservation strategies"
 
 # For getting previous historical data for the predicitve analysis
+def fetch_dynamodb_history(data_type, start_time=None, end_time=None):
+    """Fallback history from DynamoDB when MongoDB has too little data"""
+    logging.info(f"Insufficient histroical data in MongoDB, trying DynamoDB")
+    historical_data = []
+    # Determine the appropriate table
+    if data_type == 'flow_rate':
+        table = WATER_TABLE
+        device_id = 'WaterSensor'
+    else:
+        table = SENSOR_TABLE
+        device_id = os.getenv('THING_NAME2', "Main_Pi")
+    
+    # Query DynamoDB, the time range is in the key condition and only the one value is projected
+    try:
+        items = query_items_parallel(
+            table, 'device_id', device_id, start_time, end_time or (datetime.now() if start_time else None),
+            segments=DYNAMO_QUERY_SEGMENTS,
+            attributes=['timestamp', data_type, f"payload.{data_type}"],
+            page_size=DYNAMO_PAGE_SIZE
+        )
+
+        for item in items:
+            timestamp = item.get('timestamp')
+
+            # Try to extract the value
+            value = None
+            if data_type in item:
+                value = item[data_type]
+            elif 'payload' in item and isinstance(item['payload'], dict):
+                payload = item['payload']
+                if data_type in payload:
+                    value = payload[data_type]
+            
+            if timestamp and value is not None:
+                try:
+                    float_value = float(value)
+                    historical_data.append({
+                        "timestamp": timestamp,
+                        "value": round(float_value, 2)
+                    })
+                except (ValueError, TypeError):
+                    continue
+    except Exception as e:
+        logging.error(f"Error fetching DynamoDB: {str(e)}")
+    return historical_data
+
+def _lttb_points(historical_data, points):
+    """Downsample a list of {timestamp, value} points with LTTB"""
+    if len(historical_data) <= points:
+        return historical_data
+    x = pd.to_datetime([point["timestamp"] for point in historical_data], errors='coerce', format='mixed')
+    x = np.where(x.isna(), np.arange(len(historical_data)), x.asi8 / 1e9)
+    y = np.array([point["value"] for point in historical_data], dtype=float)
+    return [historical_data[i] for i in lttb(x, y, points)]
+
+def get_downsampled_history(data_type, collection, start_time, end_time, points, mode):
+    """History downsampled to about points values, bucketed in MongoDB or picked with LTTB"""
+    historical_data = []
+    if mode == 'lttb':
+        # Only the two fields come back from MongoDB, already sorted
+        cursor = collection.find(
+            {data_type: {"$exists": True, "$ne": None}, "timestamp": {"$gte": start_time, "$lte": end_time}},
+            {"timestamp": 1, data_type: 1, "_id": 0}
+        ).sort("timestamp", 1)
+        timestamps, values = [], []
+        for record in cursor:
+            try:
+                values.append(float(record[data_type]))
+                timestamps.append(record["timestamp"])
+            except (KeyError, ValueError, TypeError):
+                continue
+        if timestamps:
+            x = np.array([t.timestamp() if isinstance(t, datetime) else float(i) for i, t in enumerate(timestamps)])
+            for i in lttb(x, values, points):
+                timestamp = timestamps[i]
+                historical_data.append({
+                    "timestamp": timestamp.isoformat() if isinstance(timestamp, datetime) else timestamp,
+                    "value": round(values[i], 2)
+                })
+    else:
+        # Each bucket is averaged server side so only about points documents come back
+        for bucket in collection.aggregate(time_bucket_pipeline(data_type, start_time, end_time, points)):
+            try:
+                historical_data.append({
+                    "timestamp": bucket["timestamp"].isoformat() if isinstance(bucket["timestamp"], datetime) else bucket["timestamp"],
+                    "value": round(float(bucket["value"]), 2),
+                    "min": round(float(bucket["min"]), 2),
+                    "max": round(float(bucket["max"]), 2),
+                    "count": bucket["count"]
+                })
+            except (KeyError, ValueError, TypeError):
+                continue
+
+    if len(historical_data) < 5:
+        fallback = sorted(fetch_dynamodb_history(data_type, start_time, end_time), key=lambda x: x["timestamp"])
+        historical_data.extend(_lttb_points(fallback, points))
+    return historical_data
+
+def get_rollup_history(data_type, start_time, end_time, points):
+    """History from the best rollup resolution for the range"""
+    historical_data = []
+    for bucket in rollup_store.read(data_type, start_time, end_time, max_points=points):
+        historical_data.append({
+            "timestamp": bucket["bucket_start"].isoformat(),
+            "value": round(bucket["mean"], 2),
+            "min": round(bucket["min"], 2),
+            "max": round(bucket["max"], 2),
+            "count": bucket["count"]
+        })
+    return historical_data
+
 @app.route('/api/historical-data', methods=['GET'])
 def get_historical_data():
     """Fetch historical data sensor data for chart visualisation"""
@@ -1384,6 +1798,9 @@ def get_historical_data():
         # Get query parameters 
         data_type = request.args.get('data_type', 'temperature')
         days = int(request.args.get('days', 7))
+        points = request.args.get('points', type=int)
+        mode = request.args.get('mode', 'bucket')
+        source = request.args.get('source', 'auto')
 
         # Calculate the cutoff time based on requested days
         cutoff_time = datetime.now() - timedelta(days=days)
@@ -1394,6 +1811,29 @@ def get_historical_data():
         else:
             collection = sensor_data_collection
 
+        # Downsampling mode, the full range is never loaded into Python
+        if points is not None:
+            if points < 3 or points > MAX_HISTORY_POINTS:
+                return jsonify({"error": f"points must be between 3 and {MAX_HISTORY_POINTS}"}), 400
+            if mode not in ('bucket', 'lttb'):
+                return jsonify({"error": "mode must be 'bucket' or 'lttb'"}), 400
+            historical_data = []
+            # Long ranges read the pre-aggregated rollups instead of raw readings, once they reach back far enough
+            if data_type in SENSOR_METRICS + WATER_METRICS and (source == 'rollup' or (source == 'auto' and days >= ROLLUP_MIN_DAYS and rollup_store.covers(data_type, cutoff_time, collection))):
+                historical_data = get_rollup_history(data_type, cutoff_time, datetime.now(), points)
+                if historical_data:
+                    mode = 'rollup'
+            if not historical_data:
+                historical_data = get_downsampled_history(data_type, collection, cutoff_time, datetime.now(), points, mode)
+            return jsonify({
+                "data_type": data_type,
+                "historical_data": historical_data,
+                "start_date": historical_data[0]["timestamp"] if historical_data else None,
+                "end_date": historical_data[-1]["timestamp"] if historical_data else None,
+                "point_count": len(historical_data),
+                "mode": mode
+            })
+
         # Query for data points, limiting to reasonable amount for visualisation
         cursor = collection.find(
             {
@@ -1434,45 +1874,7 @@ def get_historical_data():
         
         # If mongDB data is not enough or insufficient, try DynamoDB as a fallback
         if len(historical_data) < 5:
-            logging.info(f"Insufficient histroical data in MongoDB, trying DynamoDB")
-            # Determine the appropriate table
-            if data_type == 'flow_rate':
-                table = WATER_TABLE
-                device_id = 'WaterSensor'
-            else:
-                table = SENSOR_TABLE
-                device_id = os.getenv('THING_NAME2', "Main_Pi")
-            
-            # Query DynamoDB
-            try:
-                response = table.query(
-                    KeyConditionExpression=Key('device_id').eq(device_id),
-                    ScanIndexForward=True
-                )
-
-                for item in response.get('Items', []):
-                    timestamp = item.get('timestamp')
-
-                    # Try to extract the value
-                    value = None
-                    if data_type in item:
-                        value = item[data_type]
-                    elif 'payload' in item and isinstance(item['payload'], dict):
-                        payload = item['payload']
-                        if data_type in payload:
-                            value = payload[data_type]
-                    
-                    if timestamp and value is not None:
-                        try:
-                            float_value = float(value)
-                            historical_data.append({
-                                "timestamp": timestamp,
-                                "value": round(float_value, 2)
-                            })
-                        except (ValueError, TypeError):
-                            continue
-            except Exception as e:
-                logging.error(f"Error fetching DynamoDB: {str(e)}")
+            historical_data.extend(fetch_dynamodb_history(data_type, cutoff_time))
 
         # Sort data by timestamp to ensure chronological order
         historical_data = sorted(historical_data, key=lambda x:x["timestamp"])
@@ -1497,136 +1899,152 @@ def get_historical_data():
             "message": str(e)
         }),500
          
-# Fetch sensor data API
-@app.route('/api/sensor-data', methods=['GET'])
-def get_sensor_data():
+def read_sense_hat():
     """Read current sensor data (temperature,humidity) from SENSE HAT"""
     try:
-        try:
-            temperature = sensor.get_temperature()
-            if temperature is None or not isinstance(temperature, (int, float)):
-                logging.warning("Temperature reading is None.Using fallback values")
-                temperature = 22.0
-        except Exception as e:
-            logging.warning(f"Error reading temperature: {str(e)}. Using fallback value")
+        temperature = sensor.get_temperature()
+        if temperature is None or not isinstance(temperature, (int, float)):
+            logging.warning("Temperature reading is None.Using fallback values")
             temperature = 22.0
+    except Exception as e:
+        logging.warning(f"Error reading temperature: {str(e)}. Using fallback value")
+        temperature = 22.0
 
-        try:    
-            humidity = sensor.get_humidity()
-            if humidity is None or not isinstance(humidity, (int, float)):
-                logging.warning("Humidity reading is None.Using fallback values")
-                humidity = 50.0
-        except Exception as e:
-            logging.warning(f"Error reading humidity: {str(e)}. Using fallback value")
+    try:    
+        humidity = sensor.get_humidity()
+        if humidity is None or not isinstance(humidity, (int, float)):
+            logging.warning("Humidity reading is None.Using fallback values")
             humidity = 50.0
+    except Exception as e:
+        logging.warning(f"Error reading humidity: {str(e)}. Using fallback value")
+        humidity = 50.0
 
-        try:
-            pressure = sensor.get_pressure()
-            if pressure is None or not isinstance(pressure, (int, float)):
-                logging.warning("Pressure reading is None or invalid. Usin fallback value")
-                pressure = 1013.25
-        except Exception as e:
-            logging.warning(f"Error reading pressure: {str(e)}. Using fallback value")
+    try:
+        pressure = sensor.get_pressure()
+        if pressure is None or not isinstance(pressure, (int, float)):
+            logging.warning("Pressure reading is None or invalid. Usin fallback value")
             pressure = 1013.25
-                 
-        # Normalise temperature on based on CPU temperature   
-        try:
-            cpu_temperature = get_cpu_temperature()
-            if cpu_temperature is not None:
-                normalized_temperature = temperature -((cpu_temperature - temperature) /5.466)
-            else:
-                logging.warning("CPU temperature is None.Using raw sensor data")
-                normalized_temperature = temperature
-        
-        except FileNotFoundError:
-            logging.warning("CPU temperature unavailable,using raw temperature")
+    except Exception as e:
+        logging.warning(f"Error reading pressure: {str(e)}. Using fallback value")
+        pressure = 1013.25
+             
+    # Normalise temperature on based on CPU temperature   
+    try:
+        cpu_temperature = get_cpu_temperature()
+        if cpu_temperature is not None:
+            normalized_temperature = temperature -((cpu_temperature - temperature) /5.466)
+        else:
+            logging.warning("CPU temperature is None.Using raw sensor data")
             normalized_temperature = temperature
+    
+    except FileNotFoundError:
+        logging.warning("CPU temperature unavailable,using raw temperature")
+        normalized_temperature = temperature
+    
+    #Calculate altitude
+    try:
+        altitude   = round(44330 * (1- (pressure / 1013) ** 0.1903), 2) 
+    except Exception as e:
+        logging.warning(f"Error calculating altitude: {str(e)}")
+        altitude = 0
+    
+    # Get and format IMU data
+    try:
+        accel_raw = sensor.get_accelerometer_raw() or {"x": 0, "y": 0, "z": 0}
+        gyro_raw = sensor.get_gyroscope_raw() or {"x": 0, "y": 0, "z": 0}
+        mag_raw = sensor.get_compass_raw() or {"x": 0, "y": 0, "z": 0}
+
+        # Remove any trailing commas to make this into tuples
+
+        if isinstance(accel_raw, tuple):
+            accel_raw = accel_raw[0]
+        if isinstance(gyro_raw, tuple):
+            gyro_raw = gyro_raw[0]
+        if isinstance(mag_raw, tuple):
+            mag_raw = mag_raw[0]
         
-        #Calculate altitude
-        try:
-            altitude   = round(44330 * (1- (pressure / 1013) ** 0.1903), 2) 
-        except Exception as e:
-            logging.warning(f"Error calculating altitude: {str(e)}")
-            altitude = 0
+        # Safely extract the data and round it to 2
+        imu_data = {
+            "acceleration": [
+                round(float(accel_raw.get("x", 0)), 2),
+                round(float(accel_raw.get("y", 0)), 2),
+                round(float(accel_raw.get("z", 0)), 2)
+            ],
+            "gyroscope": [
+                round(float(gyro_raw.get("x", 0)), 2),
+                round(float(gyro_raw.get("y", 0)), 2),
+                round(float(gyro_raw.get("z", 0)), 2),
+            ],
+            "magnetometer": [
+                round(float(mag_raw.get("x", 0)), 2),
+                round(float(mag_raw.get("y", 0)), 2),
+                round(float(mag_raw.get("z", 0)), 2),
+            ]
         
-        # Get and format IMU data
-        try:
-            accel_raw = sensor.get_accelerometer_raw() or {"x": 0, "y": 0, "z": 0}
-            gyro_raw = sensor.get_gyroscope_raw() or {"x": 0, "y": 0, "z": 0}
-            mag_raw = sensor.get_compass_raw() or {"x": 0, "y": 0, "z": 0}
-
-            # Remove any trailing commas to make this into tuples
-
-            if isinstance(accel_raw, tuple):
-                accel_raw = accel_raw[0]
-            if isinstance(gyro_raw, tuple):
-                gyro_raw = gyro_raw[0]
-            if isinstance(mag_raw, tuple):
-                mag_raw = mag_raw[0]
-            
-            # Safely extract the data and round it to 2
-            imu_data = {
-                "acceleration": [
-                    round(float(accel_raw.get("x", 0)), 2),
-                    round(float(accel_raw.get("y", 0)), 2),
-                    round(float(accel_raw.get("z", 0)), 2)
-                ],
-                "gyroscope": [
-                    round(float(gyro_raw.get("x", 0)), 2),
-                    round(float(gyro_raw.get("y", 0)), 2),
-                    round(float(gyro_raw.get("z", 0)), 2),
-                ],
-                "magnetometer": [
-                    round(float(mag_raw.get("x", 0)), 2),
-                    round(float(mag_raw.get("y", 0)), 2),
-                    round(float(mag_raw.get("z", 0)), 2),
-                ]
-            
-            }
-        except Exception as e:
-            logging.warning(f"Error processing IMU data: {str(e)}")
-            imu_data = {
-                "acceleration": [0.0, 0.0, 0.0],
-                "gyroscope": [0.0, 0.0, 0.0],
-                "magnetometer": [0.0, 0.0, 0.0]
-            }
-
-        # Ensures the final values are poerly formatted
-        normalized_temperature = round(float(normalized_temperature), 2)    
-        humidity = round(float(humidity),2)
-        pressure = round(float(pressure), 2)
-        timestamp = datetime.now()
-        sensor_data = {
-            "temperature":normalized_temperature,
-            "humidity": humidity,
-            "pressure": round(pressure, 2),
-            "altitude": altitude,
-            "imu": imu_data,
-            "timestamp": timestamp,
-            "location": "Main System"
+        }
+    except Exception as e:
+        logging.warning(f"Error processing IMU data: {str(e)}")
+        imu_data = {
+            "acceleration": [0.0, 0.0, 0.0],
+            "gyroscope": [0.0, 0.0, 0.0],
+            "magnetometer": [0.0, 0.0, 0.0]
         }
 
-        # Save to MongoDB
-        try:    
-            sensor_data_collection.insert_one(sensor_data)
-        except Exception as e:
-            logging.error(f"Failed to insert sensor data into MongoDB: {str(e)}")
-        
-        # Check thresholds
-        try:
-            exceeded_thresholds = alert_service.check_thresholds(sensor_data)
-            if exceeded_thresholds:
-                logging.info(f"Thresholds exceeded: {exceeded_thresholds}")
-        except Exception as e:
-            logging.error(f"Error checking thresholds: {str(e)}")
-            exceeded_thresholds = []
-            
-        sensor_data["_id"] = str(sensor_data["_id"])
+    # Ensures the final values are poerly formatted
+    normalized_temperature = round(float(normalized_temperature), 2)    
+    humidity = round(float(humidity),2)
+    pressure = round(float(pressure), 2)
+    timestamp = datetime.now()
+    sensor_data = {
+        "temperature":normalized_temperature,
+        "humidity": humidity,
+        "pressure": round(pressure, 2),
+        "altitude": altitude,
+        "imu": imu_data,
+        "timestamp": timestamp,
+        "location": "Main System"
+    }
+    return sensor_data
+
+def persist_sense_hat_sample(sensor_data):
+    """Store a sampled reading and check it against the thresholds, called at the sampler's persist cadence"""
+    # Save to MongoDB
+    try:    
+        ingest_buffer.submit(sensor_data_collection, sensor_data)
+    except Exception as e:
+        logging.error(f"Failed to insert sensor data into MongoDB: {str(e)}")
+    
+    # Check thresholds
+    try:
+        exceeded_thresholds = alert_service.check_thresholds(sensor_data)
+        if exceeded_thresholds:
+            logging.info(f"Thresholds exceeded: {exceeded_thresholds}")
+    except Exception as e:
+        logging.error(f"Error checking thresholds: {str(e)}")
+
+# Background SenseHat sampling, the API only ever reads the latest sample from memory
+sense_hat_sampler = SenseHatSampler(
+    read_sense_hat,
+    persist=persist_sense_hat_sample,
+    sample_interval=float(os.getenv("SENSEHAT_SAMPLE_INTERVAL", 1.0)),
+    persist_interval=float(os.getenv("SENSEHAT_PERSIST_INTERVAL", 10.0)),
+    buffer_size=int(os.getenv("SENSEHAT_BUFFER_SIZE", 600))
+)
+# Fetch sensor data API
+@app.route('/api/sensor-data', methods=['GET'])
+def get_sensor_data():
+    """Latest SenseHat sample from the background sampler, no hardware or database access"""
+    try:
+        # A sample older than a few intervals means the sampler has stopped or stalled
+        sensor_data = sense_hat_sampler.latest(max_age=max(3 * sense_hat_sampler.sample_interval, 5.0))
+        if sensor_data is None:
+            # Read the hardware for this request only, buffering it would be served as the latest from then on
+            sensor_data = sense_hat_sampler.sample_now(buffer=False)
         return jsonify(sensor_data)
         
     except Exception as e:
         logging.error(f"Error in /api/sensor-data: {str(e)}")
-        return jsonify({"Failed to insert sensor data": str(e)}),500
+        return jsonify({"error": str(e)}),500
 
 @app.route('/api/carbon-footprint', methods=['GET'])
 def get_calculate_footprint():
@@ -1661,18 +2079,8 @@ def send_ses_email(subject, message):
         logging.error(f"Error sending SES email: {str(e)}")
 
 def get_cpu_temperature():
-    """Read from the systems CPU temperature to normalise SENSE-HAT readings Reference:https://www.kernel.org/doc/Documentation/thermal/sysfs-api.txt and https://emlogic.no/2024/09/step-by-step-thermal-management/"""
-    file_path = "/sys/class/thermal/thermal_zone0/temp"
-
-    try:
-        with open(file_path, "r") as f:
-            temp = int(f.read()) / 1000.0
-        return temp
-    except FileNotFoundError as e:
-        logging.error(f"Unexpected error reading CPU temp: {str(e)}")
-    except Exception as e:
-        logging.error(f"Error reading CPU temperature: {str(e)}")
-        return None
+    """Smoothed CPU temperature used to normalise SENSE-HAT readings, sampled in the background by cpu_calibration Reference:https://www.kernel.org/doc/Documentation/thermal/sysfs-api.txt and https://emlogic.no/2024/09/step-by-step-thermal-management/"""
+    return cpu_calibration.get_cpu_temperature()
     
 #Historical trends and the ranges that users can apply if the system has operated within the selcted timeframes
 @app.route('/api/temperature-trends', methods=['GET'])
@@ -1687,6 +2095,12 @@ def get_temperature_trends():
         if range_params not in valid_ranges:
             return jsonify({"error": "Invalid range"}), 400
                
+        # Weekly and monthly ranges use hourly rollups when they cover the whole range
+        if range_params != "24h" and rollup_store.covers("temperature", cutoff_time, sensor_data_collection):
+            buckets = rollup_store.read("temperature", cutoff_time, datetime.now(), resolution="1h")
+            if buckets:
+                return jsonify([{"time": bucket["bucket_start"].isoformat(), "temperature": round(bucket["mean"], 2)} for bucket in reversed(buckets)])
+
         trends_cursor = sensor_data_collection.find({"timestamp": {"$gte": cutoff_time}}).sort("timestamp", -1)
         trends = [{"time": trend["timestamp"].isoformat(), "temperature": trend["temperature"]} for trend in trends_cursor]
         return jsonify(trends)
@@ -1730,12 +2144,24 @@ def set_thresholds():
         if flow_rate_threshold:
             thresholds["flow_rate_threshold"] = flow_rate_threshold
         
+        # Per room overrides, e.g. {"nursery": {"temperature_range": [19, 22]}}
+        room_overrides = data.get('room_overrides')
+        if room_overrides is not None:
+            if not isinstance(room_overrides, dict) or not all(isinstance(v, dict) for v in room_overrides.values()):
+                return jsonify({"error": "Room overrides must map room ids to threshold settings"}), 400
+            for room_id, overrides in room_overrides.items():
+                for key in ('temperature_range', 'humidity_range'):
+                    if key in overrides and (not isinstance(overrides[key], list) or len(overrides[key]) != 2):
+                        return jsonify({"error": f"{key} override for {room_id} must be a list of two values"}), 400
+            thresholds["room_overrides"] = room_overrides
+
         # Add notiffication preferences if provided 
         if 'notification_preferences' in data:
             thresholds['notification_preferences'] = data['notification_preferences']
             
         # Store in MongoDB
         thresholds_collection.replace_one({}, thresholds,upsert=True)
+        alert_service.invalidate_cache()
         
         # Also updating in DynamoDB if used
         try:
@@ -1936,15 +2362,13 @@ def predictive_analysis():
                 })
         
         else:
-            # Use ARIMA for prediction with sufficient data
+            # Use ARIMA for prediction with sufficient data, models are cached per series and refit as data arrives
             try:
-                # Use ARIMA model with sufficient data
-                arima_model = ARIMA(df['value'].astype(float), order=(1, 1, 0))
-                arima_fit = arima_model.fit()
-                
+                models, model_status = forecast_registry.get((data_type, device_id), list(df['timestamp']), df['value'].astype(float).values)
+                logging.info(f"Forecast models for {data_type}/{device_id}: {model_status}")
                 
-                # Generate predictions
-                forecast = arima_fit.forecast(steps=prediction_days)
+                # Generate predictions, memoised per horizon
+                forecast = models.forecast(prediction_days)
                 
                 # Formatting the response
                 predictions = []
@@ -1958,17 +2382,10 @@ def predictive_analysis():
                 logging.error(f"ARIMA prediction error: {str(e)}", exc_info=True)
                 return jsonify({"error": f"Failed to generate predictions: {str(e)}"}), 500
             
-            # Use IsolationGForest for anomaly detection
+            # Use the fitted IsolationForest for anomaly detection
             try:
-                # Prepare data for anomaly detection
-                X = df['value'].values.reshape(-1, 1)
-                
-                # Train model
-                iso_forest = IsolationForest(contamination=0.1, random_state=42)
-                anomaly_predictions = iso_forest.fit_predict(X)
-                
-                # Extract animalies
-                anomaly_indices = np.where(anomaly_predictions == -1)[0]
+                # Score the current values, the forest itself is only refit with the ARIMA model
+                anomaly_indices = models.anomalies(df['value'].values)
                 
                 # Format for response
                 anomalies = []
@@ -2006,6 +2423,31 @@ def predictive_analysis():
             "error": "Failed to perform predictive analysis",
             "message": str(e)
         }), 500
+
+@app.route('/api/predictive-analysis/batch', methods=['GET'])
+def batch_predictive_analysis():
+    """Forecasts for every room and metric in one pass, from the hourly rollups"""
+    try:
+        # type=int gives None for values that are not integers, those are rejected below
+        hours = request.args.get('hours', type=int) if 'hours' in request.args else 24
+        history_days = request.args.get('history_days', type=int) if 'history_days' in request.args else 7
+        if hours is None or history_days is None or not 0 < hours <= MAX_BATCH_FORECAST_HOURS or history_days <= 0:
+            return jsonify({"error": f"hours must be between 1 and {MAX_BATCH_FORECAST_HOURS} and history_days positive"}), 400
+        metrics = request.args.get('metrics')
+        metrics = [metric.strip() for metric in metrics.split(',') if metric.strip()] if metrics else list(SENSOR_METRICS + WATER_METRICS)
+
+        end = datetime.now()
+        rows = rollup_store.read_series(end - timedelta(days=history_days), end, metrics=metrics)
+        series = batch_forecaster.forecast_frame(pd.DataFrame(rows, columns=["room_id", "metric", "timestamp", "value"]), hours)
+        return jsonify({
+            "method": batch_forecaster.method,
+            "hours": hours,
+            "series_count": len(series),
+            "series": series
+        })
+    except Exception as e:
+        logging.error(f"Batch predictive analysis error: {str(e)}", exc_info=True)
+        return jsonify({"error": "Failed to perform batch predictive analysis", "message": str(e)}), 500
                     
 @app.route('/api/notification-preferences', methods=['GET'])
 def get_notification():
@@ -2059,6 +2501,7 @@ def set_notification_preferences():
             thresholds_collection.replace_one({"_id": thresholds_id}, thresholds)
         else:
             thresholds_collection.insert_one(thresholds)
+        alert_service.invalidate_cache()
 
         # Also try update in DynamoDB
         try:
@@ -2103,11 +2546,11 @@ def create_alerts_table():
                     'KeyType': 'HASH'  # Partition key
                 }
             ],
-            AttributeDefinitions=[
-                {
-                    'AttributeName': 'id',
-                    'AttributeType': 'S'
-                }
+            AttributeDefinitions=ALERT_ATTRIBUTE_DEFINITIONS,
+            # Time ordered indexes so alert history is read with range queries instead of scans
+            GlobalSecondaryIndexes=[
+                dict(index, ProvisionedThroughput={'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5})
+                for index in ALERT_INDEXES
             ],
             ProvisionedThroughput={
                 'ReadCapacityUnits': 5,
@@ -2126,26 +2569,54 @@ def create_alerts_table():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     
+MAX_ALERT_PAGE = int(os.getenv("MAX_ALERT_PAGE", 500))
+
+def parse_alert_args(args, default_limit=50):
+    """Query parameters shared by the alert routes as (since, until, severity, limit, cursor)
+
+    since and until must be ISO timestamps (ValueError otherwise), severity=all means every
+    severity and limit is capped at MAX_ALERT_PAGE.
+    """
+    try:
+        since = datetime.fromisoformat(args['since'].replace('Z', '+00:00')) if args.get('since') else None
+        until = datetime.fromisoformat(args['until'].replace('Z', '+00:00')) if args.get('until') else None
+    except ValueError:
+        raise ValueError("since and until must be ISO 8601 timestamps")
+    # Alerts are stored with naive local timestamps
+    since, until = [value.astimezone().replace(tzinfo=None) if value is not None and value.tzinfo else value for value in (since, until)]
+
+    severity = args.get('severity')
+    if severity == 'all':
+        severity = None
+    limit = args.get('limit', type=int) if 'limit' in args else default_limit
+    if limit is None or limit < 1:
+        raise ValueError("limit must be a positive integer")
+    return since, until, severity, min(limit, MAX_ALERT_PAGE), args.get('cursor')
+
 #API to fetch alert history      
 @app.route('/api/alerts', methods=['GET'])
 def get_alerts_history():
-    """Fetches all recorded alerts from DynamoDB"""
+    """Fetches recorded alerts from DynamoDB, newest first
+
+    Optional since, until (ISO timestamps), severity, limit and cursor parameters. When there are
+    more alerts the cursor for the next page is returned in the X-Next-Cursor header.
+    """
     try:
-        severity = request.args.get('severity')
+        since, until, severity, limit, cursor = parse_alert_args(request.args)
         
         alert_table_name = os.getenv("ALERT_TABLE", "Alerts")
         alert_table = dynamodb.Table(alert_table_name)
         
-        # Get recent alerts
-        response = alert_table.scan(Limit=50)
-        alerts = response.get('Items', [])
+        # Range query on the severity or month index, only the requested page is read
+        alerts, next_cursor = find_alerts(alert_table, since, until, severity, limit, cursor)
         
-        # Filter by severity if specified
-        if severity and severity != 'all':
-            alerts = [alert for alert in alerts if alert.get('severity') == severity]
-        
-        return jsonify(alerts)
+        response = jsonify(alerts)
+        if next_cursor:
+            response.headers['X-Next-Cursor'] = next_cursor
+        return response
     
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         logging.error(f"Error in /api/alerts: {str(e)}")
         return jsonify({"error": str(e)}), 500
@@ -2210,6 +2681,7 @@ def force_create_alert_dynamodb():
         alert_record = {
             "id": f"alert-{datetime.now().timestamp()}",
             "timestamp": datetime.now().isoformat(), # The current time
+            "alert_month": alert_month(datetime.now()),
             "device_id": "TestDevice",
             "sensor_data": test_data,
             "exceeded_thresholds": ["temperature_high", "humidity_high"],
@@ -2235,10 +2707,15 @@ def force_create_alert_dynamodb():
 @app.route('/api/alerts-dynamodb', methods=['GET'])
 def get_alerts_dynamodb():
         try:  
-            # Query for recent alerts
-            response = alert_table.scan()
-            alerts = response.get('Items', [])          
-            return jsonify(alerts)
+            # Query for recent alerts, a page at a time with the same parameters as /api/alerts
+            since, until, severity, limit, cursor = parse_alert_args(request.args, default_limit=MAX_ALERT_PAGE)
+            alerts, next_cursor = find_alerts(alert_table, since, until, severity, limit, cursor)
+            response = jsonify(alerts)
+            if next_cursor:
+                response.headers['X-Next-Cursor'] = next_cursor
+            return response
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         except Exception as e:
             logging.error(f"Error in /api/alerts-dynamodb: {str(e)}")
             return jsonify({"error": str(e)}), 500
@@ -2299,6 +2776,7 @@ def force_create_alert():
         alert_record = {
             "id": f"alert-{datetime.now().timestamp()}",
             "timestamp": datetime.now().isoformat(),
+            "alert_month": alert_month(datetime.now()),
             "device_id": "TestDevice",
             "sensor_data": test_data,
             "exceeded_thresholds": ["temperature_low", "humidity_high"],
@@ -2336,6 +2814,7 @@ def force_create_alert_dynamo():
         alert_record = {
             "id": f"alert-{datetime.now().timestamp()}",
             "timestamp": datetime.now().isoformat(),
+            "alert_month": alert_month(datetime.now()),
             "device_id": "TestDevice",
             "sensor_data": test_data,
             "exceeded_thresholds": ["temperature_low", "humidity_high"],
@@ -2427,6 +2906,7 @@ def force_alert_test():
         "id": alert_id,
         "device_id": "TestDevice",
         "timestamp": datetime.now().isoformat(),
+        "alert_month": alert_month(datetime.now()),
         "sensor_data": test_data,
         "exceeded_thresholds": exceeded_thresholds,
         "severity": "critical"
@@ -2451,6 +2931,7 @@ def simple_alert_test():
             "id": alert_id,
             "device_id": "TestDevice",
             "timestamp": datetime.now().isoformat(),
+            "alert_month": alert_month(datetime.now()),
             "sensor_data": {
                 "temperature": 2,
                 "humidity": 95,
@@ -2767,6 +3248,17 @@ def detect_anomalies():
         # Run anomaly detection
         result = device_ml_model.detect_anomalies(data)
 
+        # Drift and rate of change are caught on the device's rolling window features
+        if device_ml_model.window_model is not None:
+            try:
+                window = device_ml_model.detect_window_anomalies([data])
+                result["window_anomaly"] = window["is_anomaly"][0]
+                result["window_anomaly_score"] = window["anomaly_score"][0]
+                if window["is_anomaly"][0]:
+                    result["is_anomaly"] = True
+            except Exception as window_error:
+                logging.error(f"Window anomaly detection failed: {str(window_error)}")
+
         # Stores the resuly if it happens to be an anomaly
         if result.get("is_anomaly", False):
             # Add to the anomaly collection
@@ -2813,6 +3305,61 @@ def detect_anomalies():
         logging.error(f"Error in anomaly detection endpoint: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/anomaly-detection/batch', methods=['POST'])
+def detect_anomalies_batch():
+    """Anomaly detection for many readings in one call, results come back as columns"""
+    try:
+        data = request.json
+        if not data:
+            return jsonify({"error": "No data provided"}), 400
+        # Either {"readings": [...]} or columns {"temperature": [...], "humidity": [...], "pressure": [...]}
+        readings = data.get("readings", data) if isinstance(data, dict) else data
+        count = len(readings) if isinstance(readings, list) else max((len(readings.get(name) or []) for name in ("temperature", "humidity", "pressure")), default=0)
+        if count > MAX_ANOMALY_BATCH:
+            return jsonify({"error": f"Too many readings, at most {MAX_ANOMALY_BATCH} per request"}), 400
+
+        try:
+            result = device_ml_model.detect_anomalies_batch(readings)
+        except (ValueError, TypeError, AttributeError) as e:
+            return jsonify({"error": f"Invalid readings: {str(e)}"}), 400
+
+        # Same as the single reading endpoint, window anomalies count as anomalies and are stored
+        if isinstance(readings, list) and device_ml_model.window_model is not None:
+            try:
+                window = device_ml_model.detect_window_anomalies(readings)
+                result["window_anomaly"] = window["is_anomaly"]
+                result["window_anomaly_score"] = window["anomaly_score"]
+                result["is_anomaly"] = [point or windowed for point, windowed in zip(result["is_anomaly"], window["is_anomaly"])]
+                result["anomaly_count"] = sum(result["is_anomaly"])
+            except Exception as window_error:
+                logging.error(f"Window anomaly detection failed: {str(window_error)}")
+
+        # Anomalous rows are stored with one write, only when readings were sent as records
+        if result.get("anomaly_count") and isinstance(readings, list) and not (isinstance(data, dict) and data.get("store") is False):
+            documents = [
+                {
+                    "is_anomaly": True,
+                    "anomaly_score": result["anomaly_score"][row],
+                    "confidence": result["confidence"][row],
+                    "prediction_model": result["prediction_model"],
+                    "timestamp": readings[row].get("timestamp", result["timestamp"]),
+                    "data": {name: readings[row].get(name) for name in ("temperature", "humidity", "pressure")},
+                    "device_id": readings[row].get("device_id", "unknown"),
+                    "room_id": readings[row].get("room_id", "unknown"),
+                    **({"window_anomaly": result["window_anomaly"][row], "window_anomaly_score": result["window_anomaly_score"][row]} if "window_anomaly" in result else {})
+                }
+                for row, anomalous in enumerate(result["is_anomaly"]) if anomalous
+            ]
+            try:
+                db.anomalies.insert_many(documents, ordered=False)
+            except Exception as db_error:
+                logging.error(f"Failed to store anomalies in MongoDB: {str(db_error)}")
+
+        return jsonify(result)
+    except Exception as e:
+        logging.error(f"Error in batch anomaly detection endpoint: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/api/recent-anomalies', methods=['GET'])
 def get_recent_anomalies():
     """Gets the recent detected anomalies"""
@@ -2887,6 +3434,10 @@ def get_energy_savings_summary():
         logging.error(f"Error getting energy savings summary: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+# Start sampling once every helper it uses is defined, there is no SenseHat on CI runners
+if os.getenv("SENSEHAT_SAMPLER_ENABLED", "true").lower() == "true" and os.getenv("CI") != "true":
+    sense_hat_sampler.start()
+
 if __name__ == '__main__':
     validate_environment()
     app.run(host='0.0.0.0',port=5000)
\ No newline at end of file
@@ -0,0 +1,143 @@
+import os
+import time
+import math
+import hashlib
+import logging
+import threading
+import multiprocessing
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+# Set up Logging
+logger = logging.getLogger(__name__)
+
+def series_matrix(frame, key_columns=("room_id", "metric"), time_column="timestamp", value_column="value", freq="1h"):
+    """Long format readings to (keys, timestamps, matrix), one matrix row per series on a shared time grid"""
+    frame = frame.copy()
+    frame[time_column] = pd.to_datetime(frame[time_column])
+    pivot = frame.pivot_table(index=time_column, columns=list(key_columns), values=value_column, aggfunc="mean")
+    # Gaps are carried forward (and back at the start) so every row has a value at every step
+    pivot = pivot.resample(freq).mean().ffill().bfill()
+    return list(pivot.columns), pivot.index, pivot.to_numpy(dtype=float).T
+
+def forecast_ar_diff(matrix, horizon):
+    """ARIMA(1,1,0) for every row at once, the AR coefficient of the differences fitted in closed form"""
+    matrix = np.asarray(matrix, dtype=float)
+    if matrix.shape[1] < 3:
+        return np.repeat(matrix[:, -1:], horizon, axis=1)
+    diffs = np.diff(matrix, axis=1)
+    previous, current = diffs[:, :-1], diffs[:, 1:]
+    denominator = (previous * previous).sum(axis=1)
+    phi = np.divide((previous * current).sum(axis=1), denominator, out=np.zeros(len(matrix)), where=denominator > 0)
+    # Kept stationary like the statsmodels fit
+    phi = np.clip(phi, -0.99, 0.99)
+    steps = phi[:, None] ** np.arange(1, horizon + 1)[None, :]
+    return matrix[:, -1:] + np.cumsum(diffs[:, -1:] * steps, axis=1)
+
+def forecast_holt(matrix, horizon, alphas=(0.1, 0.3, 0.5, 0.8), betas=(0.01, 0.1, 0.3)):
+    """Holt's linear smoothing for every row at once, with the smoothing parameters picked per row
+
+    Every (alpha, beta) pair in the grid is run side by side and each series keeps the pair with
+    the lowest one step ahead squared error.
+    """
+    matrix = np.asarray(matrix, dtype=float)
+    if matrix.shape[1] < 3:
+        return np.repeat(matrix[:, -1:], horizon, axis=1)
+    grid = np.array([(alpha, beta) for alpha in alphas for beta in betas])
+    alpha, beta = grid[:, 0][None, :], grid[:, 1][None, :]
+    level = np.repeat(matrix[:, :1], len(grid), axis=1)
+    trend = np.repeat(matrix[:, 1:2] - matrix[:, :1], len(grid), axis=1)
+    errors = np.zeros_like(level)
+    for t in range(1, matrix.shape[1]):
+        observed = matrix[:, t:t + 1]
+        predicted = level + trend
+        errors += (observed - predicted) ** 2
+        new_level = alpha * observed + (1 - alpha) * predicted
+        trend = beta * (new_level - level) + (1 - beta) * trend
+        level = new_level
+    best = np.argmin(errors, axis=1)
+    rows = np.arange(len(matrix))
+    return level[rows, best][:, None] + trend[rows, best][:, None] * np.arange(1, horizon + 1)[None, :]
+
+METHODS = {"ar": forecast_ar_diff, "holt": forecast_holt}
+
+def _forecast_chunk(task):
+    # Module level so it can be pickled into the process pool
+    method, matrix, horizon = task
+    return METHODS[method](matrix, horizon)
+
+class BatchForecaster:
+    """Forecasts for every room and metric in one pass, cached until the input data changes
+
+    Series are stacked into one matrix and fitted together with vectorised models. Large batches
+    are split into chunks across a process pool. Results are cached by a fingerprint of the
+    matrix, so dashboards asking again for the same data get the stored forecasts.
+    """
+
+    def __init__(self, method="ar", workers=None, chunk_size=2000, ttl=300, max_entries=16, clock=time.monotonic):
+        if method not in METHODS:
+            raise ValueError(f"Unknown forecasting method {method}, expected one of {', '.join(METHODS)}")
+        self.method = method
+        self.workers = workers if workers is not None else min(os.cpu_count() or 1, 4)
+        self.chunk_size = chunk_size
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self._cache = {}
+        self._lock = threading.Lock()
+        self._pool = None
+        self.stats = {"hits": 0, "misses": 0}
+
+    def forecast_matrix(self, matrix, horizon):
+        """Forecast every row of the matrix horizon steps ahead"""
+        matrix = np.asarray(matrix, dtype=float)
+        if self.workers > 1 and len(matrix) > self.chunk_size:
+            chunks = np.array_split(matrix, math.ceil(len(matrix) / self.chunk_size))
+            results = self._get_pool().map(_forecast_chunk, [(self.method, chunk, horizon) for chunk in chunks])
+            return np.vstack(list(results))
+        return METHODS[self.method](matrix, horizon)
+
+    def forecast_frame(self, frame, horizon, freq="1h", key_columns=("room_id", "metric")):
+        """Forecasts for every series in a long format frame of timestamp, key columns and value"""
+        if frame.empty:
+            return []
+        keys, index, matrix = series_matrix(frame, key_columns=key_columns, freq=freq)
+        fingerprint = hashlib.sha1(matrix.tobytes() + repr((keys, str(index[-1]), freq)).encode()).hexdigest()
+        cache_key = (self.method, horizon, fingerprint)
+
+        now = self.clock()
+        with self._lock:
+            entry = self._cache.get(cache_key)
+            if entry is not None and now - entry[0] < self.ttl:
+                self.stats["hits"] += 1
+                return entry[1]
+            self.stats["misses"] += 1
+
+        values = self.forecast_matrix(matrix, horizon)
+        step = pd.tseries.frequencies.to_offset(freq)
+        times = [(index[-1] + step * (i + 1)).isoformat() for i in range(horizon)]
+        results = []
+        for key, row in zip(keys, values):
+            key = key if isinstance(key, tuple) else (key,)
+            result = dict(zip(key_columns, key))
+            result["forecast"] = [{"timestamp": t, "predicted_value": round(float(v), 2)} for t, v in zip(times, row)]
+            results.append(result)
+
+        with self._lock:
+            self._cache[cache_key] = (now, results)
+            while len(self._cache) > self.max_entries:
+                del self._cache[min(self._cache, key=lambda k: self._cache[k][0])]
+        return results
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                # Forking a threaded web server can copy a lock some other thread holds, spawn starts clean workers
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+            return self._pool
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
@@ -1,8 +1,9 @@
 import json
 import boto3
 import os
+import time
+import hashlib
 from datetime import datetime
-import uuid
 
 s3 = boto3.client('s3')
 dynamodb = boto3.resource('dynamodb')
@@ -14,103 +15,285 @@ THRESHOLD_TABLE = os.getenv('THRESHOLD_TABLE', "Thresholds")
 SNS_TOPIC_ARN = os.getenv('SNS_TOPIC_ARN')
 BEDROOM2_BUCKET = os.getenv('BEDROOM2_BUCKET', "bedroom2-longterm-storage")
 BEDROOM1_BUCKET = os.getenv('BEDROOM1_BUCKET', "bedroom1-longterm-storage")
+# Readings are written as one newline delimited JSON object per device and window per invocation
+BATCH_PREFIX = os.getenv('S3_BATCH_PREFIX', "batches/")
+BATCH_WINDOW_MINUTES = int(os.getenv('S3_BATCH_WINDOW_MINUTES', 60))
+# Thresholds are scanned at most once per THRESHOLD_CACHE_TTL seconds per container
+THRESHOLD_CACHE_TTL = int(os.getenv('THRESHOLD_CACHE_TTL', 300))
+# One SNS message per batch lists at most this many readings
+MAX_ALERTS_PER_MESSAGE = 20
 threshold_table = dynamodb.Table(THRESHOLD_TABLE)
+threshold_cache = {"thresholds": None, "loaded_at": None}
+
+# Device id fragment -> table name, destination bucket and the metrics checked against thresholds
+DEVICE_TYPES = [
+    ("Main_Pi", "SenseHatData", SENSEHAT_BUCKET, ("temperature", "humidity")),
+    ("WaterSensor", "WaterFlowData", WATERFLOW_BUCKET, ("flow_rate",)),
+    ("bedroom_pi_1", "BedRoom1Table", BEDROOM1_BUCKET, ("temperature", "humidity")),
+    ("bedroom_pi_2", "BedRoom2Table", BEDROOM2_BUCKET, ("temperature", "humidity")),
+]
+# How each metric is checked, threshold keys are tried in order
+METRIC_RULES = {
+    "temperature": {"keys": ("temperature_range",), "default": [20, 25], "low": "temperature_low", "high": "temperature_high", "label": "Temperature", "unit": "C"},
+    "humidity": {"keys": ("humidity_range",), "default": [30, 50], "low": "humidity_low", "high": "humidity_high", "label": "Humidity", "unit": "%"},
+    "flow_rate": {"keys": ("flow_rate_range", "flow_rate_threshold"), "default": 10, "low": None, "high": "water_usage_high", "label": "Flow rate", "unit": None},
+}
+CRITICAL_THRESHOLDS = ['temperature_high', 'temperature_low', 'humidity_high', 'humidity_low']
+
+def get_thresholds(now=None):
+    """Current thresholds, from the module cache unless it is older than THRESHOLD_CACHE_TTL"""
+    now = time.monotonic() if now is None else now
+    if threshold_cache["loaded_at"] is not None and now - threshold_cache["loaded_at"] < THRESHOLD_CACHE_TTL:
+        return threshold_cache["thresholds"]
+    try:
+        items = threshold_table.scan().get('Items')
+        if not items:
+            print("No thresholds found in database")
+        threshold_cache["thresholds"] = items[0] if items else None
+        threshold_cache["loaded_at"] = now
+    except Exception as e:
+        # Keep using the last thresholds if the table cannot be read
+        print(f"Error loading thresholds: {e}")
+    return threshold_cache["thresholds"]
+
+def evaluate_thresholds(data, metrics, thresholds):
+    """Threshold violations for one reading and the alert lines describing them"""
+    exceeded_thresholds = []
+    lines = []
+    for metric in metrics:
+        value = data.get(metric)
+        if value is None:
+            continue
+        rule = METRIC_RULES[metric]
+        limit = next((thresholds[key] for key in rule["keys"] if thresholds.get(key) is not None), rule["default"])
+        low, high = (limit[0], limit[1]) if isinstance(limit, (list, tuple)) else (None, limit)
+        unit = rule["unit"] or f" {data.get('unit', '')}"
+        if rule["low"] and low is not None and value < low:
+            exceeded_thresholds.append(rule["low"])
+            lines.append(f"{rule['label']} is too low: {value}{unit} Threshold: {low}{unit}")
+        elif high is not None and value > high:
+            exceeded_thresholds.append(rule["high"])
+            lines.append(f"{rule['label']} is too high: {value}{unit} Threshold: {high}{unit}")
+    return exceeded_thresholds, lines
+
+def mark_exceeded(data, exceeded_thresholds):
+    data["exceeded_thresholds"] = exceeded_thresholds
+    data['alert_time'] = datetime.now().isoformat()
+    data['severity'] = 'critical' if any(t in CRITICAL_THRESHOLDS for t in exceeded_thresholds) else 'warning'
+
+def check_batch_thresholds(readings, notify=True):
+    """Check a batch of (metrics, reading) pairs against one copy of the thresholds, with a single SNS alert
+
+    Violations are added to the readings in place. Readings that arrive with pre detected
+    violations are stored as they are without another alert. Returns (reading, alert text) for
+    every reading that exceeded a threshold, the alert is left to the caller when notify is False.
+    """
+    thresholds = get_thresholds()
+    if thresholds is None:
+        return []
+    alerts = []
+    for metrics, data in readings:
+        if data.get("exceeded_thresholds"):
+            continue
+        exceeded_thresholds, lines = evaluate_thresholds(data, metrics, thresholds)
+        if exceeded_thresholds:
+            mark_exceeded(data, exceeded_thresholds)
+            alerts.append((data, f"Alert from {data['device_id']} at {data['timestamp']}:\n" + "\n".join(lines)))
+    if notify:
+        send_alerts(alerts)
+    return alerts
+
+def send_alerts(alerts):
+    """One SNS message listing the (reading, alert text) pairs"""
+    if not alerts or not SNS_TOPIC_ARN:
+        return
+    exceeded_all = sorted({threshold for data, _ in alerts for threshold in data["exceeded_thresholds"]})
+    texts = [text for _, text in alerts]
+    try:
+        alert_message = "\n\n".join(texts[:MAX_ALERTS_PER_MESSAGE])
+        if len(texts) > MAX_ALERTS_PER_MESSAGE:
+            alert_message += f"\n\n...and {len(texts) - MAX_ALERTS_PER_MESSAGE} more readings"
+        alert_message += f"\nThresholds exceeded: {exceeded_all}\n"
+        # Senses SNS notification
+        sns.publish(
+            TopicArn=SNS_TOPIC_ARN,
+            Message=alert_message,
+            Subject=f"Environmental Alert:{', '.join(exceeded_all)}"[:100]
+        )
+        print(f"Alert sent through SNS for {len(texts)} readings: {', '.join(exceeded_all)}")
+    except Exception as e:
+        print(f"Error sending SNS alert: {e}")
 
 def check_thresholds(data, device_type):
     """Checks if sensor data exceeds thresholds and sends SNS notification if so"""
-
+    if "exceeded_thresholds" in data and isinstance(data['exceeded_thresholds'], list):
+        print(f"Using pre detected threshold violations: {data['exceeded_thresholds']}")
+        return data['exceeded_thresholds']
+    metrics = next((metrics for _, table_name, _, metrics in DEVICE_TYPES if table_name == device_type), ())
+    check_batch_thresholds([(metrics, data)])
+    return data.get("exceeded_thresholds", [])
+
+def parse_vector(values):
+    if not values:
+        return None
+    return {axis: float(values.get(axis, {}).get("N", 0)) for axis in ("x", "y", "z")}
+
+def format_record(record):
+    """Parse one stream record into (bucket, metrics to check, reading), None for records that are not stored"""
+    if record["eventName"] not in ["INSERT", "MODIFY"]:
+        return None
+
+    new_data = record["dynamodb"]["NewImage"]
+    timestamp = new_data.get("timestamp", {}).get("S", None)
+    device_id = new_data.get("device_id", {}).get("S", "Unknown Device")
+
+    device_type = next((device for device in DEVICE_TYPES if device[0] in device_id), None)
+    if device_type is None:
+        print(f"Unknown device: {device_id}, skipping record")
+        return None
+    _, table_name, bucket_name, metrics = device_type
+
+    payload_data = new_data.get("payload", {}).get("M", {})
+    if "flow_rate" in metrics:
+        flow_rate = float(payload_data.get("flow_rate", {}).get("N", 0))
+        unit = payload_data.get("unit", {}).get("S", "N/A")
+        temperature, humidity, pressure = None, None, None
+    else:
+        temperature = float(payload_data.get("temperature", {}).get("N", 0))
+        humidity = float(payload_data.get("humidity", {}).get("N", 0))
+        pressure = float(payload_data.get("pressure", {}).get("N", 0))
+        flow_rate = None
+        unit = "N/A"
+
+    imu = None
+    if table_name == "SenseHatData":
+        imu_data = payload_data.get("imu", {}).get("M", {})
+        imu = {name: parse_vector(imu_data.get(name, {}).get("M", {})) for name in ("acceleration", "gyroscope", "magnetometer")}
+
+    # Extract predetecct thresholds for payload
+    exceeded_thresholds = [threshold.get("S", "") for threshold in payload_data.get("exceeded_thresholds", {}).get("L", [])]
+    exceeded_thresholds = [threshold for threshold in exceeded_thresholds if threshold]
+
+    formatted_data = {
+        "device_id": device_id,
+        "timestamp": timestamp,
+        "temperature": temperature,
+        "humidity": humidity,
+        "pressure": pressure,
+        "flow_rate": flow_rate,
+        "unit": unit,
+        "imu": imu,
+    }
+    if exceeded_thresholds:
+        print(f"Found pre detected threshold violations in payload: {exceeded_thresholds}")
+        mark_exceeded(formatted_data, exceeded_thresholds)
+
+    return bucket_name, metrics, formatted_data
+
+def batch_window(timestamp):
+    """Start of the time window a reading is grouped into, None if the timestamp cannot be parsed"""
     try:
-        # Get current thresholds
-        threshold_response = threshold_table.scan()
-        if not threshold_response.get('Items'):
-            print("No thresholds found in database")
-            return []
-        
-        thresholds = threshold_response['Items'][0]
-        exceeded_thresholds = []
-        alert_message = f"Alert from {data['device_id']} at {data['timestamp']}:\n"
-
-        # Check for explicity provided thresholds in data
-        if "exceeded_thresholds" in data and isinstance(data['exceeded_thresholds'], list):
-            print(f"Using pre detected threshold violations: {data['exceeded_thresholds']}")
-            return data['exceeded_thresholds']
-        
-        # Check thresholds based on device type
-        if device_type == "SenseHatData" and data['temperature'] is not None:
-            temp_range = thresholds.get('temperature_range', [20, 25])
-            if data['temperature'] < temp_range[0]:
-                exceeded_thresholds.append('temperature_low')
-                alert_message += f"Temperature is too low: {data['temperature']}C Threshold: {temp_range[0]}C\n"
-            elif data['temperature'] > temp_range[1]:
-                exceeded_thresholds.append('temperature_high')
-                alert_message += f"Temperature is too high: {data['temperature']}C Threshold: {temp_range[1]}C\n"
-
-            if data['humidity'] is not None:
-                humidity_range = thresholds.get('humidity_range', [30, 50])
-                if data['humidity'] < humidity_range[0]:
-                    exceeded_thresholds.append('humidity_low')
-                    alert_message += f"Humidity is too low: {data['humidity']}% Threshold: {humidity_range[0]}%\n"
-                elif data['humidity'] > humidity_range[1]:
-                    exceeded_thresholds.append('humidity_high')
-                    alert_message += f"Humidity is too high: {data['humidity']}% Threshold: {humidity_range[1]}%\n"
-
-        elif device_type == "WaterFlow" and data['flow_rate'] is not None:
-            flow_threshold = thresholds.get('flow_rate_range', 10)
-            if data['flow_rate'] > flow_threshold:
-                exceeded_thresholds.append('water_usage_high')
-                alert_message += f"Flow rate is too high: {data['flow_rate']} {data['unit']} Threshold: {flow_threshold} {data['unit']}\n"
-        
-        elif device_type == "BedRoom1Table" and data['temperature'] is not None:
-            temp_range = thresholds.get('temperature_range', [20, 25])
-            if data['temperature'] < temp_range[0]:
-                exceeded_thresholds.append('temperature_low')
-                alert_message += f"Temperature is too low: {data['temperature']}C Threshold: {temp_range[0]}C\n"
-            elif data['temperature'] > temp_range[1]:
-                exceeded_thresholds.append('temperature_high')
-                alert_message += f"Temperature is too high: {data['temperature']}C Threshold: {temp_range[1]}C\n"
-
-            if data['humidity'] is not None:
-                humidity_range = thresholds.get('humidity_range', [30, 50])
-                if data['humidity'] < humidity_range[0]:
-                    exceeded_thresholds.append('humidity_low')
-                    alert_message += f"Humidity is too low: {data['humidity']}% Threshold: {humidity_range[0]}%\n"
-                elif data['humidity'] > humidity_range[1]:
-                    exceeded_thresholds.append('humidity_high')
-                    alert_message += f"Humidity is too high: {data['humidity']}% Threshold: {humidity_range[1]}%\n"
-
-        elif device_type == "BedRoom2Table" and data['temperature'] is not None:
-            temp_range = thresholds.get('temperature_range', [20, 25])
-            if data['temperature'] < temp_range[0]:
-                exceeded_thresholds.append('temperature_low')
-                alert_message += f"Temperature is too low: {data['temperature']}C Threshold: {temp_range[0]}C\n"
-            elif data['temperature'] > temp_range[1]:
-                exceeded_thresholds.append('temperature_high')
-                alert_message += f"Temperature is too high: {data['temperature']}C Threshold: {temp_range[1]}C\n"
-
-            if data['humidity'] is not None:
-                humidity_range = thresholds.get('humidity_range', [30, 50])
-                if data['humidity'] < humidity_range[0]:
-                    exceeded_thresholds.append('humidity_low')
-                    alert_message += f"Humidity is too low: {data['humidity']}% Threshold: {humidity_range[0]}%\n"
-                elif data['humidity'] > humidity_range[1]:
-                    exceeded_thresholds.append('humidity_high')
-                    alert_message += f"Humidity is too high: {data['humidity']}% Threshold: {humidity_range[1]}%\n"
-
-        if exceeded_thresholds and SNS_TOPIC_ARN:
-            # Format alert message
-            alert_message += f"Thresholds exceeded: {exceeded_thresholds}\n"
-
-            # Senses SNS notification
-            sns.publish(
-                TopicArn=SNS_TOPIC_ARN,
-                Message=alert_message,
-                Subject=f"Environmental Alert:{', '.join(exceeded_thresholds)}"
-            )
-            print(f"Alert sent through SNS: {', '.join(exceeded_thresholds)}")
-        return exceeded_thresholds
+        moment = datetime.fromisoformat(str(timestamp).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    minutes = (moment.hour * 60 + moment.minute) // BATCH_WINDOW_MINUTES * BATCH_WINDOW_MINUTES
+    return moment.replace(hour=minutes // 60, minute=minutes % 60, second=0, microsecond=0)
+
+def record_identity(record, formatted_data):
+    # Sequence numbers are the same when Lambda retries a batch, so keys built from them are too
+    return record.get("dynamodb", {}).get("SequenceNumber") or record.get("eventID") or json.dumps(formatted_data, sort_keys=True)
+
+def sequence_number(identity):
+    """Stream sequence number as an int for ordering, None for identities that are not one"""
+    return int(identity) if str(identity).isdigit() else None
+
+def batch_prefix(device_id, window):
+    if window is None:
+        return f"{BATCH_PREFIX}{device_id}/unknown/"
+    return f"{BATCH_PREFIX}{device_id}/{window:%Y/%m/%d}/{window:%H%M}-"
+
+def batch_key(device_id, window, identities):
+    """Key for a group, named after the first and last sequence numbers it holds"""
+    sequences = [sequence_number(identity) for identity in identities]
+    if sequences and None not in sequences:
+        name = f"{min(sequences)}-{max(sequences)}"
+    else:
+        name = hashlib.sha1("\n".join(sorted(identities)).encode()).hexdigest()[:16]
+    return f"{batch_prefix(device_id, window)}{name}.ndjson"
+
+def delivered_ranges(bucket_name, device_id, window):
+    """(first, last) sequence numbers of the objects already written for a device and window
+
+    A device's records all come from the same stream shard, so every record of the device between
+    an object's first and last sequence numbers is in that object.
+    """
+    prefix = batch_prefix(device_id, window)
+    ranges = []
+    token = None
+    try:
+        while True:
+            kwargs = {"Bucket": bucket_name, "Prefix": prefix}
+            if token:
+                kwargs["ContinuationToken"] = token
+            response = s3.list_objects_v2(**kwargs)
+            for item in response.get("Contents", []):
+                name = item["Key"][len(prefix):].rsplit(".", 1)[0].split("-")
+                if len(name) == 2 and all(part.isdigit() for part in name):
+                    ranges.append((int(name[0]), int(name[1])))
+            token = response.get("NextContinuationToken")
+            if not token:
+                return ranges
     except Exception as e:
-        print(f"Error checking thresholds: {e}")
-        return []
+        # Without the listing the records are written again, a duplicate is better than a gap
+        print(f"Could not list delivered batches under {prefix}: {e}")
+        return ranges
+
+def group_records(records):
+    """Readings not yet stored, grouped by destination bucket, device and time window
+
+    Lambda retries a partial failure from the lowest failed record, so a retry also carries
+    records of groups that were stored the first time. Those are found from the sequence ranges
+    in the existing object names and dropped, so they are neither written nor alerted on again.
+    """
+    groups = {}
+    for record in records:
+        result = format_record(record)
+        if result is None:
+            continue
+        bucket_name, metrics, formatted_data = result
+        group = (bucket_name, formatted_data["device_id"], batch_window(formatted_data["timestamp"]))
+        groups.setdefault(group, []).append((record_identity(record, formatted_data), metrics, formatted_data))
+
+    pending = {}
+    for (bucket_name, device_id, window), items in groups.items():
+        ranges = delivered_ranges(bucket_name, device_id, window)
+        items = [
+            item for item in items
+            if sequence_number(item[0]) is None or not any(first <= sequence_number(item[0]) <= last for first, last in ranges)
+        ]
+        if items:
+            pending[(bucket_name, device_id, window)] = items
+    return pending
+
+def write_batches(groups):
+    """One newline delimited JSON object per group, returns the identities of records that failed to upload"""
+    failed = []
+    for (bucket_name, device_id, window), items in groups.items():
+        items.sort(key=lambda item: str(item[2]["timestamp"]))
+        identities = [identity for identity, _, _ in items]
+        file_name = batch_key(device_id, window, identities)
+        try:
+            s3.put_object(
+                Bucket=bucket_name,
+                Key=file_name,
+                Body="".join(json.dumps(data) + "\n" for _, _, data in items),
+                ContentType="application/x-ndjson"
+            )
+            print(f"Successfully uploaded {len(items)} readings to S3: {file_name} to {bucket_name}")
+        except Exception as e:
+            print(f"Error uploading data to S3: {str(e)}")
+            failed.extend(identities)
+    return failed
 
 def lambda_handler(event, context):
     """Triggers DynamoDB Stream and writes data to S3"""
@@ -118,160 +301,21 @@ def lambda_handler(event, context):
     try:
         print(f"Recieved event: {json.dumps(event, indent=2)}")
 
-        for record in event.get("Records", []):
-            if record["eventName"] not in ["INSERT", "MODIFY"]:
-                continue
-
-            new_data = record["dynamodb"]["NewImage"]
-            timestamp = new_data.get("timestamp", {}).get("S", None)
-            device_id = new_data.get("device_id", {}).get("S", "Unknown Device")
-
-            if "Main_Pi" in device_id:
-                table_name = "SenseHatData"
-                bucket_name = SENSEHAT_BUCKET
-
-            elif "WaterSensor" in device_id:
-                table_name = "WaterFlowData"
-                bucket_name = WATERFLOW_BUCKET
-
-            elif "bedroom_pi_1" in device_id:
-                table_name = "BedRoom1Table"
-                bucket_name = BEDROOM1_BUCKET
-
-            elif "bedroom_pi_2" in device_id:
-                table_name = "BedRoom2Table"
-                bucket_name = BEDROOM2_BUCKET
-            else:
-                print(f"Unknown device: {device_id}, skipping record")
-                continue
-
-            print(f"Extracted Table Name: {table_name}")
-            if table_name == "SenseHatData":
-
-                payload_data = new_data.get("payload", {}).get("M", {})
-            
-                temperature = float(payload_data.get("temperature", {}).get("N", 0))
-                humidity = float(payload_data.get("humidity", {}).get("N", 0))
-                pressure = float(payload_data.get("pressure", {}).get("N", 0)) 
-                flow_rate = None 
-                unit = "N/A"
-            
-                imu_data = payload_data.get("imu", {}).get("M", {})
-                acceleration = imu_data.get("acceleration", {}).get("M", {})
-                gyroscope = imu_data.get("gyroscope", {}).get("M", {})
-                magnetometer = imu_data.get("magnetometer", {}).get("M", {})
-
-            elif table_name == "WaterFlowData":
-                payload_data = new_data.get("payload", {}).get("M", {})
-                flow_rate = float(payload_data.get("flow_rate", {}).get("N", 0))
-                unit = payload_data.get("unit", {}).get("S", "N/A")
-
-                temperature,humidity,pressure = None,None,None
-                imu_data, acceleration,gyroscope, magnetometer = None,None,None,None
-
-            elif table_name == "BedRoom1Table":
-                payload_data = new_data.get("payload", {}).get("M", {})
-
-                temperature = float(payload_data.get("temperature", {}).get("N", 0))
-                humidity = float(payload_data.get("humidity", {}).get("N", 0))
-                pressure = float(payload_data.get("pressure", {}).get("N", 0))
-                flow_rate = None
-                unit = "N/A"
-
-                imu_data = payload_data.get("imu", {}).get("M", {})
-                acceleration = imu_data.get("acceleration", {}).get("M", {})
-                gyroscope = imu_data.get("gyroscope", {}).get("M", {})
-                magnetometer = imu_data.get("magnetometer", {}).get("M", {})
-
-            elif table_name == "BedRoom2Table":
-                payload_data = new_data.get("payload", {}).get("M", {})
-
-                temperature = float(payload_data.get("temperature", {}).get("N", 0))
-                humidity = float(payload_data.get("humidity", {}).get("N", 0))
-                pressure = float(payload_data.get("pressure", {}).get("N", 0))
-                flow_rate = None
-                unit = "N/A"
-
-                imu_data = payload_data.get("imu", {}).get("M", {})
-                acceleration = imu_data.get("acceleration", {}).get("M", {})
-                gyroscope = imu_data.get("gyroscope", {}).get("M", {})
-                magnetometer = imu_data.get("magnetometer", {}).get("M", {})
-
-            imu = {
-                "acceleration": {
-                    "x": float(acceleration.get("x", {}).get("N", 0)),
-                    "y": float(acceleration.get("y", {}).get("N", 0)),
-                    "z": float(acceleration.get("z", {}).get("N", 0))
-                } if acceleration else None,
-                "gyroscope": {
-                    "x": float(gyroscope.get("x", {}).get("N", 0)),
-                    "y": float(gyroscope.get("y", {}).get("N", 0)),
-                    "z": float(gyroscope.get("z", {}).get("N", 0))
-                } if gyroscope else None,
-                "magnetometer": {
-                    "x": float(magnetometer.get("x", {}).get("N", 0)),
-                    "y": float(magnetometer.get("y", {}).get("N", 0)),
-                    "z": float(magnetometer.get("z",{}).get("N", 0))
-                } if magnetometer else None,
-            } if table_name == "SenseHatData" else None
-
-            print(f"Extracted Data :Device ID ={device_id}, Timestamp = {timestamp}")
-            print(f"Extracted Data: Temperature = {temperature}, Humidity = {humidity}, Pressure = {pressure}, Flow Rate = {flow_rate}, Unit = {unit}")
-            if imu:
-                print(f"Extracted Data: IMU = {imu['acceleration']}, Gyroscope = {imu['gyroscope']}, Magnetometer ={imu['magnetometer']}")
-
-            exceeded_thresholds_from_payload = payload_data.get("exceeded_thresholds", {})
-            exceeded_thresholds = []
-
-            if exceeded_thresholds_from_payload:
-                # Extract predetecct thresholds for payload
-                for threshold in exceeded_thresholds_from_payload.get("L", []):
-                    threshold_value = threshold.get("S", "")
-                    if threshold_value:
-                        exceeded_thresholds.append(threshold_value)
-                print(f"Found pre detected threshold violations in payload: {exceeded_thresholds}")
-
-            formatted_data = {
-                "device_id": device_id,
-                "timestamp": timestamp,
-                "temperature": temperature,
-                "humidity": humidity,
-                "pressure": pressure,
-                "flow_rate": flow_rate,
-                "unit": unit,
-                "imu": imu,
-            }
-
-            if not exceeded_thresholds:
-                exceeded_thresholds = check_thresholds(formatted_data, table_name)
-
-            if exceeded_thresholds:
-                formatted_data["exceeded_thresholds"] = exceeded_thresholds
-                formatted_data['alert_time'] = datetime.now().isoformat()
-                formatted_data['severity'] = 'critical' if any(t in ['temperature_high', 'temperature_low', 'humidity_high', 'humidity_low'] for t in exceeded_thresholds ) else 'warning'
-
-
-            unique_id = uuid.uuid4().hex
-            file_name = f"{device_id}_{timestamp}_{unique_id}.json"
-
-            #Uploads object to S3
-            try:
-                alert_key = f"alerts/{device_id}_{timestamp}_{unique_id}.json"
-                s3.put_object(
-                    Bucket=bucket_name,
-                    Key=file_name,
-                    Body=json.dumps(formatted_data),
-                    ContentType="application/json"
-                )
-                print(f"Alert data save to S3: {file_name} to {bucket_name}")
-                print(f"Successfully uploaded data to S3: {file_name} to {bucket_name}")
-            except Exception as e:
-                print(f"Error uploading data to S3: {str(e)}")
-
-        return {
+        groups = group_records(event.get("Records", []))
+        alerts = check_batch_thresholds([(metrics, data) for items in groups.values() for _, metrics, data in items], notify=False)
+        failed = write_batches(groups)
+        # Alerts only go out for stored readings, failed ones are alerted on when the retry stores them
+        failed_ids = set(failed)
+        stored = {id(data) for items in groups.values() for identity, _, data in items if identity not in failed_ids}
+        send_alerts([(data, text) for data, text in alerts if id(data) in stored])
+        response = {
             'statusCode': 200,
             'body': "successfully proccessed records"
         }
+        if failed:
+            # Partial batch response, only these records are retried when ReportBatchItemFailures is enabled
+            response['batchItemFailures'] = [{"itemIdentifier": identity} for identity in failed]
+        return response
     except Exception as e:
         print(f"Lambda Error: {str(e)}")
         return {
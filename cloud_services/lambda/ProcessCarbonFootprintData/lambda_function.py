@@ -1,104 +1,279 @@
-import json
-import boto3
-import pandas as pd
-from io import StringIO
-
-s3 = boto3.client('s3')
-
-SENSEHAT_BUCKET = "sensehat-longterm-storage"
-WATERFLOW_BUCKET = "waterflow-longterm-storage"
-TRAINING_BUCKET = "training-ecodetect"
-BEDROOM2_BUCKET = "bedroom2-longterm-storage"
-SENSEHAT_CSV_FILENAME = "carbon_footprint_training_sensehat.csv"
-WATERFLOW_CSV_FILENAME = "carbon_footprint_training_waterflow.csv"
-COMBINED_CSV_FILENAME = "carbon_footprint_training_combined.csv"
-
-def lambda_handler(event, context):
-    """"Lambda function to fetch CSV data an merge,updates whenever the seperate datasets update"""
-    try:
-        print(f"Recieved event: {json.dumps(event, indent=2)}")
-
-        #Loading existing data from the combined dataset CSV
-        try:
-            combined_response = s3.get_object(Bucket=TRAINING_BUCKET, Key=COMBINED_CSV_FILENAME)
-            df_combined_existing = pd.read_csv(StringIO(combined_response['Body'].read().decode('utf-8')))
-            print(f"Successfully retrieved existing combined CSV from {TRAINING_BUCKET}")
-        except Exception as e:
-            print(f"Failed to retrieve existing combined CSV: {e}")
-            df_combined_existing = pd.DataFrame()
-
-        try:
-            sensehat_response = s3.get_object(Bucket=SENSEHAT_BUCKET, Key=SENSEHAT_CSV_FILENAME)
-            df_sensehat = pd.read_csv(StringIO(sensehat_response['Body'].read().decode('utf-8')))
-            print(f"Successfully retrieved SenseHat CSV from {SENSEHAT_BUCKET}")
-        except Exception as e:
-            print(f"Failed to retrieve SenseHat CSV: {e}")
-            df_sensehat = pd.DataFrame()
-
-        try:
-            waterflow_response = s3.get_object(Bucket=WATERFLOW_BUCKET, Key=WATERFLOW_CSV_FILENAME)
-            df_waterflow = pd.read_csv(StringIO(waterflow_response['Body'].read().decode('utf-8')))
-            print(f"Successfully retrieved WaterFlow CSV from {WATERFLOW_BUCKET}")
-        except Exception as e:
-            print(f"Failed to retrieve WaterFlow CSV: {e}")
-            df_waterflow = pd.DataFrame()
-        
-        if "timestamp" not in df_sensehat.columns:
-            df_sensehat["timestamp"] = None
-        if "timestamp" not in df_waterflow.columns:
-            df_waterflow["timestamp"] = None
-        
-        if not df_sensehat.empty or not df_waterflow.empty:
-            df_combined_new = pd.merge(df_sensehat, df_waterflow, on='timestamp', how='outer')
-        else:
-            df_combined_new = pd.DataFrame()
-
-        if df_combined_new.empty:
-            print("No new data to merge.Combined CSV is not updated")
-            return {
-                'statusCode': 400,
-                'body': json.dumps("No new data to merge")
-            }
-        
-        # fills missing values
-        df_combined_new.fillna({
-            "temperature": 0.0,
-            "humidity": 0.0,
-            "pressure": 0.0,
-            "imu_distance": 0.0,
-            "flow_rate": 0.0,
-            "unit": "N/A"
-        },inplace=True)
-
-        print("Successfully merged SenseHat and Water Flow data")
-
-        if not df_combined_existing.empty:
-            df_combined = pd.concat([df_combined_existing, df_combined_new], ignore_index=True)
-            df_combined.drop_duplicates(subset=['timestamp'], keep='last', inplace=True)
-            print("Successfully combined with existing data")
-        else:
-            df_combined = df_combined_new
-            print("No existing data found, using new data as is")
-
-        csv_buffer = StringIO()
-        df_combined.to_csv(csv_buffer, index=False)
-
-        s3.put_object(
-            Bucket=TRAINING_BUCKET,
-            Key=COMBINED_CSV_FILENAME,
-            Body=csv_buffer.getvalue(),
-            ContentType='text/csv'
-        )
-        
-        print(f"Successfully updated combined CSV to S3: s3://{TRAINING_BUCKET}/{COMBINED_CSV_FILENAME}")
-
-        return {
-            'statusCode': 200,
-            'body': json.dumps("Successfully updated combined CSV to S3")
-        }
-    except Exception as e:
-        print(f"Failed to update combined CSV: {str(e)}")
-        return {
-            'statusCode': 500,
-            'body': json.dumps(f"Failed to combine CSV: {e}")
-        }
+import os
+import json
+import hashlib
+import boto3
+import pandas as pd
+from io import StringIO
+
+s3 = boto3.client('s3')
+
+SENSEHAT_BUCKET = "sensehat-longterm-storage"
+WATERFLOW_BUCKET = "waterflow-longterm-storage"
+TRAINING_BUCKET = "training-ecodetect"
+BEDROOM2_BUCKET = "bedroom2-longterm-storage"
+SENSEHAT_CSV_FILENAME = "carbon_footprint_training_sensehat.csv"
+WATERFLOW_CSV_FILENAME = "carbon_footprint_training_waterflow.csv"
+COMBINED_CSV_FILENAME = "carbon_footprint_training_combined.csv"
+
+# "full" re-merges both source CSVs every time, "incremental" only merges rows appended since the last run
+MERGE_MODE = os.getenv("MERGE_MODE", "full")
+COMBINED_PARTS_PREFIX = os.getenv("COMBINED_PARTS_PREFIX", "combined_parts/")
+COMBINED_STATE_KEY = f"{COMBINED_PARTS_PREFIX}_state.json"
+# Parts are folded back into the combined CSV with a full rebuild once there are this many
+COMPACT_AFTER_PARTS = int(os.getenv("COMPACT_AFTER_PARTS", 24))
+# Bytes before the stored offset that must be unchanged for a source to count as append only
+PREFIX_CHECK_BYTES = 4096
+
+FILL_VALUES = {
+    "temperature": 0.0,
+    "humidity": 0.0,
+    "pressure": 0.0,
+    "imu_distance": 0.0,
+    "flow_rate": 0.0,
+    "unit": "N/A"
+}
+
+SOURCES = {
+    "sensehat": (SENSEHAT_BUCKET, SENSEHAT_CSV_FILENAME),
+    "waterflow": (WATERFLOW_BUCKET, WATERFLOW_CSV_FILENAME)
+}
+
+def read_csv_body(body):
+    if not body.strip():
+        return pd.DataFrame()
+    return pd.read_csv(StringIO(body.decode('utf-8')))
+
+def merge_sources(df_sensehat, df_waterflow):
+    """Outer merge of SenseHat and water flow rows on timestamp with missing values filled"""
+    if "timestamp" not in df_sensehat.columns:
+        df_sensehat["timestamp"] = None
+    if "timestamp" not in df_waterflow.columns:
+        df_waterflow["timestamp"] = None
+
+    if df_sensehat.empty and df_waterflow.empty:
+        return pd.DataFrame()
+    df_combined_new = pd.merge(df_sensehat, df_waterflow, on='timestamp', how='outer')
+    if not df_combined_new.empty:
+        df_combined_new.fillna(FILL_VALUES, inplace=True)
+    return df_combined_new
+
+def write_csv(key, df):
+    csv_buffer = StringIO()
+    df.to_csv(csv_buffer, index=False)
+    s3.put_object(
+        Bucket=TRAINING_BUCKET,
+        Key=key,
+        Body=csv_buffer.getvalue(),
+        ContentType='text/csv'
+    )
+
+def parse_timestamps(values):
+    return pd.to_datetime(pd.Series(values), errors='coerce', utc=True)
+
+def source_state(body):
+    """Where the next incremental run should resume reading a source CSV"""
+    header = body.split(b"\n", 1)[0].decode('utf-8').rstrip("\r") if body else ""
+    return {
+        "offset": len(body),
+        "header": header,
+        "prefix_sha1": hashlib.sha1(body[-PREFIX_CHECK_BYTES:]).hexdigest()
+    }
+
+def full_rebuild(parts=()):
+    """Merge the complete source CSVs into the combined CSV, returns the new state or None without data
+
+    Rows from incremental part files are treated as part of the existing combined data.
+    """
+    #Loading existing data from the combined dataset CSV
+    try:
+        combined_response = s3.get_object(Bucket=TRAINING_BUCKET, Key=COMBINED_CSV_FILENAME)
+        df_combined_existing = pd.read_csv(StringIO(combined_response['Body'].read().decode('utf-8')))
+        print(f"Successfully retrieved existing combined CSV from {TRAINING_BUCKET}")
+    except Exception as e:
+        print(f"Failed to retrieve existing combined CSV: {e}")
+        df_combined_existing = pd.DataFrame()
+
+    if parts:
+        df_parts = [pd.read_csv(StringIO(s3.get_object(Bucket=TRAINING_BUCKET, Key=part)['Body'].read().decode('utf-8'))) for part in parts]
+        df_combined_existing = pd.concat([df_combined_existing] + df_parts, ignore_index=True)
+
+    bodies = {}
+    frames = {}
+    for name, (bucket, key) in SOURCES.items():
+        try:
+            bodies[name] = s3.get_object(Bucket=bucket, Key=key)['Body'].read()
+            frames[name] = read_csv_body(bodies[name])
+            print(f"Successfully retrieved {name} CSV from {bucket}")
+        except Exception as e:
+            print(f"Failed to retrieve {name} CSV: {e}")
+            bodies[name] = None
+            frames[name] = pd.DataFrame()
+
+    df_combined_new = merge_sources(frames["sensehat"], frames["waterflow"])
+    if df_combined_new.empty:
+        return None
+    print("Successfully merged SenseHat and Water Flow data")
+
+    if not df_combined_existing.empty:
+        df_combined = pd.concat([df_combined_existing, df_combined_new], ignore_index=True)
+        df_combined.drop_duplicates(subset=['timestamp'], keep='last', inplace=True)
+        print("Successfully combined with existing data")
+    else:
+        df_combined = df_combined_new
+        print("No existing data found, using new data as is")
+
+    write_csv(COMBINED_CSV_FILENAME, df_combined)
+    print(f"Successfully updated combined CSV to S3: s3://{TRAINING_BUCKET}/{COMBINED_CSV_FILENAME}")
+
+    high_water_mark = parse_timestamps(df_combined["timestamp"]).max()
+    return {
+        "high_water_mark": None if pd.isna(high_water_mark) else high_water_mark.isoformat(),
+        "sources": {name: source_state(body) for name, body in bodies.items() if body is not None},
+        "parts": [],
+        "next_part": 0
+    }
+
+def load_state():
+    try:
+        response = s3.get_object(Bucket=TRAINING_BUCKET, Key=COMBINED_STATE_KEY)
+        return json.loads(response['Body'].read().decode('utf-8'))
+    except Exception as e:
+        print(f"No incremental merge state found: {e}")
+        return None
+
+def save_state(state):
+    s3.put_object(
+        Bucket=TRAINING_BUCKET,
+        Key=COMBINED_STATE_KEY,
+        Body=json.dumps(state, sort_keys=True),
+        ContentType='application/json'
+    )
+
+def read_appended(name, previous):
+    """Rows appended to a source CSV since the last run, (frame, state), or None if it was not only appended to"""
+    bucket, key = SOURCES[name]
+    if previous is None:
+        return None
+    size = s3.head_object(Bucket=bucket, Key=key)['ContentLength']
+    offset = previous["offset"]
+    if size < offset:
+        print(f"{name} CSV shrank from {offset} to {size} bytes")
+        return None
+    if size == offset:
+        return pd.DataFrame(columns=previous["header"].split(",")), previous
+
+    # Re-read the tail of what was seen last time along with the new bytes, to check nothing was rewritten
+    check_start = max(offset - PREFIX_CHECK_BYTES, 0)
+    body = s3.get_object(Bucket=bucket, Key=key, Range=f"bytes={check_start}-{size - 1}")['Body'].read()
+    if hashlib.sha1(body[:offset - check_start]).hexdigest() != previous["prefix_sha1"]:
+        print(f"{name} CSV was modified before byte {offset}")
+        return None
+    appended = body[offset - check_start:]
+    if offset == 0:
+        frame = read_csv_body(appended)
+    else:
+        frame = read_csv_body(previous["header"].encode('utf-8') + b"\n" + appended)
+    # The body now ends at the new offset, so its last bytes are the window the next run checks
+    state = {
+        "offset": size,
+        "header": previous["header"] or appended.split(b"\n", 1)[0].decode('utf-8').rstrip("\r"),
+        "prefix_sha1": hashlib.sha1(body[-PREFIX_CHECK_BYTES:]).hexdigest()
+    }
+    return frame, state
+
+def rebuild_and_reset(previous_state):
+    """Full rebuild that folds any part files back into the combined CSV and starts a fresh state"""
+    parts = previous_state.get("parts", []) if previous_state else []
+    state = full_rebuild(parts)
+    if state is None:
+        return None
+    for part in parts:
+        s3.delete_object(Bucket=TRAINING_BUCKET, Key=part)
+    if previous_state:
+        state["next_part"] = previous_state.get("next_part", 0)
+    save_state(state)
+    return state
+
+def incremental_merge():
+    """Merge only the rows appended to the source CSVs since the high water mark into a new part file
+
+    Falls back to a full rebuild when there is no state yet, a source was rewritten rather than
+    appended to, or an appended row is not newer than the high water mark (late data), so the
+    combined CSV plus its parts always hold the same rows as a full rebuild would.
+    """
+    state = load_state()
+    if state is None:
+        print("Bootstrapping incremental merge with a full rebuild")
+        return "rebuilt", rebuild_and_reset(None)
+
+    appended = {}
+    for name in SOURCES:
+        result = read_appended(name, state["sources"].get(name))
+        if result is None:
+            print(f"{name} CSV cannot be read incrementally, rebuilding")
+            return "rebuilt", rebuild_and_reset(state)
+        appended[name] = result
+
+    frames = {name: frame for name, (frame, _) in appended.items()}
+    new_timestamps = pd.concat([frame["timestamp"] for frame in frames.values() if "timestamp" in frame.columns] or [pd.Series(dtype=object)])
+    if new_timestamps.empty:
+        return "unchanged", state
+
+    parsed = parse_timestamps(new_timestamps)
+    high_water_mark = pd.Timestamp(state["high_water_mark"]) if state.get("high_water_mark") else None
+    if parsed.isna().any() or (high_water_mark is not None and (parsed <= high_water_mark).any()):
+        print("Appended rows are not newer than the high water mark, rebuilding")
+        return "rebuilt", rebuild_and_reset(state)
+
+    df_part = merge_sources(frames["sensehat"], frames["waterflow"])
+    df_part.drop_duplicates(subset=['timestamp'], keep='last', inplace=True)
+    part_key = f"{COMBINED_PARTS_PREFIX}part-{state.get('next_part', 0):06d}.csv"
+    write_csv(part_key, df_part)
+    print(f"Wrote {len(df_part)} new rows to s3://{TRAINING_BUCKET}/{part_key}")
+
+    state["parts"].append(part_key)
+    state["next_part"] = state.get("next_part", 0) + 1
+    state["high_water_mark"] = parsed.max().isoformat()
+    state["sources"] = {name: source for name, (_, source) in appended.items()}
+
+    if len(state["parts"]) >= COMPACT_AFTER_PARTS:
+        print(f"Compacting {len(state['parts'])} parts into the combined CSV")
+        return "compacted", rebuild_and_reset(state)
+    save_state(state)
+    return "appended", state
+
+def lambda_handler(event, context):
+    """"Lambda function to fetch CSV data an merge,updates whenever the seperate datasets update"""
+    try:
+        print(f"Recieved event: {json.dumps(event, indent=2)}")
+
+        if MERGE_MODE == "incremental" or (event or {}).get("mode") == "incremental":
+            outcome, state = incremental_merge()
+            if state is None:
+                print("No new data to merge.Combined CSV is not updated")
+                return {
+                    'statusCode': 400,
+                    'body': json.dumps("No new data to merge")
+                }
+            return {
+                'statusCode': 200,
+                'body': json.dumps({"result": outcome, "parts": len(state["parts"]), "high_water_mark": state["high_water_mark"]})
+            }
+
+        if full_rebuild() is None:
+            print("No new data to merge.Combined CSV is not updated")
+            return {
+                'statusCode': 400,
+                'body': json.dumps("No new data to merge")
+            }
+
+        return {
+            'statusCode': 200,
+            'body': json.dumps("Successfully updated combined CSV to S3")
+        }
+    except Exception as e:
+        print(f"Failed to update combined CSV: {str(e)}")
+        return {
+            'statusCode': 500,
+            'body': json.dumps(f"Failed to combine CSV: {e}")
+        }
@@ -10,6 +10,9 @@ sys.modules['sense_hat'] = MagicMock(SenseHat=mock_sensehat_class)
 
 import pytest
 import os
+import importlib.util
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
 
 @pytest.fixture(autouse=True)
 def create_dummy_cert_files(tmp_path, monkeypatch):
@@ -25,6 +28,91 @@ def create_dummy_cert_files(tmp_path, monkeypatch):
     monkeypatch.setenv("ROOT_CA_PATH2", str(ca_path))
 
 from backend import app 
+import backend
+from latest_cache import LatestReadingCache
+from forecast_registry import ModelRegistry
+from batch_forecast import BatchForecaster
+
+# Helpers shared by the unit and system tests
+class FakeS3:
+    """In memory S3 with ETags, counting calls"""
+    def __init__(self):
+        self.objects = {}
+        self.heads = 0
+        self.gets = 0
+
+    def put(self, bucket, key, body):
+        import hashlib
+        body = body.encode() if isinstance(body, str) else body
+        self.objects[(bucket, key)] = (body, hashlib.md5(body).hexdigest())
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.put(Bucket, Key, Body)
+
+    def head_object(self, Bucket, Key):
+        self.heads += 1
+        body, etag = self.objects[(Bucket, Key)]
+        return {"ETag": f'"{etag}"', "ContentLength": len(body)}
+
+    def list_objects_v2(self, Bucket, Prefix="", **kwargs):
+        return {"Contents": [{"Key": key} for bucket, key in sorted(self.objects) if bucket == Bucket and key.startswith(Prefix)]}
+
+    def get_object(self, Bucket, Key, Range=None):
+        from io import BytesIO
+        self.gets += 1
+        body, etag = self.objects[(Bucket, Key)]
+        if Range:
+            start, end = Range.replace("bytes=", "").split("-")
+            body = body[int(start):int(end) + 1]
+        self.bytes_served = getattr(self, "bytes_served", 0) + len(body)
+        return {"Body": BytesIO(body), "ETag": f'"{etag}"'}
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop((Bucket, Key), None)
+
+def _load_lambda(name):
+    """Import a Lambda's lambda_function.py by path, each one is packaged on its own"""
+    path = os.path.join(os.path.dirname(__file__), "cloud_services", "lambda", name, "lambda_function.py")
+    spec = importlib.util.spec_from_file_location(f"{name}_lambda", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def _fitted_device_model(tmp_path):
+    import numpy as np
+    from sklearn.ensemble import IsolationForest
+    from device_ml import DeviceMLModel
+    rng = np.random.default_rng(3)
+    normal = np.column_stack([rng.normal(22, 1, 500), rng.normal(45, 3, 500), rng.normal(1013, 2, 500)])
+    model = DeviceMLModel(model_path=str(tmp_path / "missing.tflite"), fallback_model_path=str(tmp_path / "missing.pkl"))
+    model.fallback_model = IsolationForest(contamination=0.05, random_state=42).fit(normal.astype(np.float32))
+    return model
+
+@pytest.fixture
+def fake_s3():
+    # A factory, some tests compare two separate buckets
+    return FakeS3
+
+@pytest.fixture
+def load_lambda():
+    return _load_lambda
+
+@pytest.fixture
+def fitted_device_model():
+    return _fitted_device_model
+
+@pytest.fixture(scope="session")
+def live_mongo():
+    # Tests that read and write real collections are skipped without a server instead of
+    # waiting out backend.db's 30 second server selection timeout
+    probe = MongoClient(os.getenv("MONGO_URI"), serverSelectionTimeoutMS=1000)
+    try:
+        probe.admin.command("ping")
+    except PyMongoError as e:
+        pytest.skip(f"MongoDB is not available: {str(e)}")
+    finally:
+        probe.close()
+    return backend.db
 
 @pytest.fixture
 def client():
@@ -32,6 +120,17 @@ def client():
     with app.test_client() as client:
         yield client
 
+@pytest.fixture(autouse=True)
+def empty_latest_cache(monkeypatch):
+    # Each test starts with a cold latest reading cache so lookups go to the (patched) collections
+    monkeypatch.setattr("backend.latest_readings", LatestReadingCache(backend.sensor_data_collection, backend.water_data_collection))
+
+@pytest.fixture(autouse=True)
+def empty_forecast_registry(monkeypatch):
+    # Models fitted for one test's data must not answer another test's request
+    monkeypatch.setattr("backend.forecast_registry", ModelRegistry())
+    monkeypatch.setattr("backend.batch_forecaster", BatchForecaster(workers=1))
+
 @pytest.fixture(autouse=True)
 def mock_env(monkeypatch):
     monkeypatch.setenv("AWS_ACCESS_KEY_ID", "test")
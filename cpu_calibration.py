@@ -0,0 +1,91 @@
+import os
+import logging
+import threading
+from collections import deque
+
+# Set up Logging
+logger = logging.getLogger(__name__)
+
+# Reference: https://www.kernel.org/doc/Documentation/thermal/sysfs-api.txt
+CPU_TEMP_PATH = "/sys/class/thermal/thermal_zone0/temp"
+
+def read_cpu_temperature(path=CPU_TEMP_PATH):
+    """Read the CPU temperature in degrees C from sysfs, None if it is unavailable"""
+    try:
+        with open(path, "r") as f:
+            return float(f.read().strip()) / 1000.0
+    except Exception:
+        return None
+
+class CpuTemperatureMonitor:
+    """Samples the CPU temperature on a timer and keeps a moving average for SenseHat calibration
+
+    The SenseHat sits above the CPU, so readings are corrected using the CPU temperature. That
+    changes slowly, so it is read every refresh_interval seconds on a background thread and
+    averaged over the last window samples. Readers get the published value without touching
+    the file or taking a lock.
+    """
+
+    def __init__(self, path=CPU_TEMP_PATH, refresh_interval=5.0, window=12, reader=read_cpu_temperature):
+        self.path = path
+        self.refresh_interval = refresh_interval
+        self.window = window
+        self.reader = reader
+        self._samples = deque(maxlen=window)
+        self._value = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._warned = False
+
+    @property
+    def value(self):
+        """Smoothed CPU temperature, None when it cannot be read"""
+        if self._thread is None:
+            self.start()
+        return self._value
+
+    def refresh(self):
+        """Take one sample and publish the new average"""
+        temperature = self.reader(self.path)
+        if temperature is None:
+            if not self._warned:
+                logger.warning(f"CPU temperature unavailable at {self.path}, readings will not be calibrated")
+                self._warned = True
+            return self._value
+        self._samples.append(temperature)
+        self._value = sum(self._samples) / len(self._samples)
+        return self._value
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None:
+                # First sample is taken straight away so the value is ready for the caller
+                self.refresh()
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name="cpu-temperature", daemon=True)
+                self._thread.start()
+        return self
+
+    def close(self):
+        self._stop.set()
+        with self._start_lock:
+            if self._thread is not None:
+                self._thread.join(timeout=1)
+                self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Error sampling CPU temperature: {str(e)}")
+
+monitor = CpuTemperatureMonitor(
+    refresh_interval=float(os.getenv("CPU_TEMP_REFRESH_INTERVAL", 5.0)),
+    window=int(os.getenv("CPU_TEMP_WINDOW", 12))
+)
+
+def get_cpu_temperature():
+    """Smoothed CPU temperature from the shared monitor, started on first use"""
+    return monitor.value
@@ -0,0 +1,161 @@
+import os
+import logging
+import argparse
+import threading
+from datetime import datetime, timedelta
+from pymongo import ASCENDING, DESCENDING, MongoClient
+from rollups import RollupStore
+
+# Set up Logging
+logger = logging.getLogger(__name__)
+
+SENSOR_METRICS = ("temperature", "humidity", "pressure")
+
+def index_specs(sensor_retention_days=None, query_log_retention_days=90):
+    """Indexes for every collection, as {collection: [(keys, options)]}"""
+    sensor_indexes = [
+        # Latest reading per room and the room list (distinct can walk this index)
+        ([("room_id", ASCENDING), ("timestamp", DESCENDING)], {"name": "room_id_timestamp"})
+    ]
+    if sensor_retention_days:
+        # Doubles as the timestamp range index, MongoDB removes readings past retention
+        sensor_indexes.append(([("timestamp", ASCENDING)], {"name": "timestamp_ttl", "expireAfterSeconds": int(sensor_retention_days) * 86400}))
+    else:
+        sensor_indexes.append(([("timestamp", DESCENDING)], {"name": "timestamp"}))
+    # Partial index per metric for the historical-data query ({metric: {$exists: true}, timestamp range}),
+    # with the metric in the key so the projected query is covered by the index
+    for metric in SENSOR_METRICS:
+        sensor_indexes.append((
+            [("timestamp", ASCENDING), (metric, ASCENDING)],
+            {"name": f"{metric}_timestamp", "partialFilterExpression": {metric: {"$exists": True}}}
+        ))
+
+    query_log_indexes = [([("user_id", ASCENDING), ("timestamp", DESCENDING)], {"name": "user_id_timestamp"})]
+    if query_log_retention_days:
+        query_log_indexes.append(([("timestamp", ASCENDING)], {"name": "timestamp_ttl", "expireAfterSeconds": int(query_log_retention_days) * 86400}))
+
+    return {
+        "sensor_data": sensor_indexes,
+        "water_data": [
+            ([("room_id", ASCENDING), ("timestamp", DESCENDING)], {"name": "room_id_timestamp"}),
+            ([("timestamp", ASCENDING), ("flow_rate", ASCENDING)], {"name": "flow_rate_timestamp", "partialFilterExpression": {"flow_rate": {"$exists": True}}})
+        ],
+        "anomalies": [
+            ([("room_id", ASCENDING), ("timestamp", DESCENDING)], {"name": "room_id_timestamp"}),
+            ([("timestamp", DESCENDING)], {"name": "timestamp"})
+        ],
+        # sensor_rollups indexes are owned by RollupStore.ensure_indexes, called from provision
+        "query_logs": query_log_indexes,
+        # Dedup entries expire once their breach episode is over
+        "alert_dedup": [([("expires_at_date", ASCENDING)], {"name": "expires_at_ttl", "expireAfterSeconds": 0})],
+        # Stream tickets that were never redeemed
+        "stream_tickets": [([("expires_at_date", ASCENDING)], {"name": "expires_at_ttl", "expireAfterSeconds": 0})]
+    }
+
+def hot_queries():
+    """The queries the API runs most, as (name, collection, filter, sort, projection)"""
+    since = datetime.now() - timedelta(days=7)
+    queries = [
+        ("latest reading for room", "sensor_data", {"room_id": "living_room"}, [("timestamp", -1)], None),
+        ("latest water reading for room", "water_data", {"room_id": "bathroom"}, [("timestamp", -1)], None),
+        ("temperature trends", "sensor_data", {"timestamp": {"$gte": since}}, [("timestamp", -1)], None),
+        ("recent anomalies for room", "anomalies", {"room_id": "living_room"}, [("timestamp", -1)], {"_id": 0}),
+        ("water history", "water_data", {"flow_rate": {"$exists": True}, "timestamp": {"$gte": since}}, None, {"timestamp": 1, "flow_rate": 1, "_id": 0})
+    ]
+    for metric in SENSOR_METRICS:
+        queries.append((f"{metric} history", "sensor_data", {metric: {"$exists": True}, "timestamp": {"$gte": since}}, None, {"timestamp": 1, metric: 1, "_id": 0}))
+    return queries
+
+def ensure_indexes(db, sensor_retention_days=None, query_log_retention_days=90):
+    """Create any missing indexes, returns the names created or confirmed"""
+    created = []
+    for collection_name, indexes in index_specs(sensor_retention_days, query_log_retention_days).items():
+        collection = db[collection_name]
+        for keys, options in indexes:
+            try:
+                created.append(f"{collection_name}.{collection.create_index(keys, **options)}")
+            except Exception as e:
+                # Usually an existing index with the same name but different options
+                logger.warning(f"Could not create index {options['name']} on {collection_name}: {str(e)}")
+    logger.info(f"MongoDB indexes in place: {', '.join(created)}")
+    return created
+
+def _plan_stages(plan):
+    """All stage names in an explain() plan tree"""
+    stages = [plan.get("stage")]
+    for child_key in ("inputStage", "queryPlan"):
+        if child_key in plan:
+            stages.extend(_plan_stages(plan[child_key]))
+    for child in plan.get("inputStages", []):
+        stages.extend(_plan_stages(child))
+    return [stage for stage in stages if stage]
+
+def verify_query_plans(db):
+    """Explain the hot queries and warn about any that scan the whole collection"""
+    collection_scans = []
+    for name, collection_name, query, sort, projection in hot_queries():
+        try:
+            cursor = db[collection_name].find(query, projection)
+            if sort:
+                cursor = cursor.sort(sort)
+            explain = cursor.limit(1).explain()
+            stages = _plan_stages(explain.get("queryPlanner", {}).get("winningPlan", {}))
+        except Exception as e:
+            logger.warning(f"Could not explain query '{name}': {str(e)}")
+            continue
+        if "COLLSCAN" in stages:
+            logger.warning(f"Query '{name}' on {collection_name} uses a COLLSCAN: {query}")
+            collection_scans.append(name)
+        else:
+            logger.debug(f"Query '{name}' on {collection_name} plan: {' <- '.join(stages)}")
+
+    # distinct is explained through the explain command
+    try:
+        explain = db.command({"explain": {"distinct": "sensor_data", "key": "room_id"}, "verbosity": "queryPlanner"})
+        if "COLLSCAN" in _plan_stages(explain.get("queryPlanner", {}).get("winningPlan", {})):
+            logger.warning("Query 'room list' on sensor_data uses a COLLSCAN")
+            collection_scans.append("room list")
+    except Exception as e:
+        logger.warning(f"Could not explain query 'room list': {str(e)}")
+    return collection_scans
+
+def provision(db):
+    """Deploy step, creates indexes and checks the hot query plans using environment settings"""
+    ensure_indexes(
+        db,
+        sensor_retention_days=int(os.getenv("SENSOR_DATA_RETENTION_DAYS", 0)) or None,
+        query_log_retention_days=int(os.getenv("QUERY_LOG_RETENTION_DAYS", 90)) or None
+    )
+    try:
+        RollupStore(db.sensor_rollups).ensure_indexes()
+    except Exception as e:
+        logger.warning(f"Could not create rollup indexes: {str(e)}")
+    return verify_query_plans(db)
+
+def provision_in_background(mongo_uri, timeout_ms=5000):
+    """Run provision on a daemon thread with its own short timeout client, so startup never waits on MongoDB"""
+    def run():
+        client = MongoClient(mongo_uri, serverSelectionTimeoutMS=timeout_ms)
+        try:
+            provision(client.ecodetect)
+        except Exception as e:
+            logger.warning(f"MongoDB index provisioning failed: {str(e)}")
+        finally:
+            client.close()
+
+    thread = threading.Thread(target=run, name="mongo-index-provisioning", daemon=True)
+    thread.start()
+    return thread
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Create MongoDB indexes and check the query plans of hot queries")
+    parser.add_argument("--verify-only", action="store_true", help="Only explain the hot queries")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    db = MongoClient(os.getenv("MONGO_URI")).ecodetect
+    scans = verify_query_plans(db) if args.verify_only else provision(db)
+    print("All hot queries use indexes" if not scans else f"Collection scans: {', '.join(scans)}")
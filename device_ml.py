@@ -3,15 +3,28 @@ import pickle
 import logging
 import os
 from datetime import datetime
+from forest_scorer import ForestScorer
+from window_features import WindowFeatureStore
+
+FEATURES = ("temperature", "humidity", "pressure")
+# Safe default and accepted range for every feature, out of range values are replaced by the default
+FEATURE_DEFAULTS = {"temperature": (22.0, -50, 100), "humidity": (45.0, 0, 100), "pressure": (1013.0, 800, 1200)}
+# Real TFLite flatbuffers carry this file identifier at bytes 4-8, the generated placeholder does not
+TFLITE_IDENTIFIER = b"TFL3"
 
 # Code inspiration: https://pyimagesearch.com/2020/03/02/anomaly-detection-with-keras-tensorflow-and-deep-learning/
 # Code inspiration: https://www.geeksforgeeks.org/anomaly-detection-using-isolation-forest/
 class DeviceMLModel:
     """Machine learning model for on-device anomaly detection"""
 
-    def __init__(self, model_path="models/anomaly_detection.tflite", fallback_model_path="models/isolation_forest.pkl"):
+    def __init__(self, model_path="models/anomaly_detection.tflite", fallback_model_path="models/isolation_forest.pkl", forest_arrays_path="models/isolation_forest.npz", window_model_path="models/window_forest.npz"):
         self.tflite_model_path = model_path
         self.fallback_model_path = fallback_model_path
+        self.forest_arrays_path = forest_arrays_path
+        self.window_model_path = window_model_path
+        self.window_model = None
+        # Rolling per-device features so drift and rate of change can be scored, not just the latest values
+        self.window_store = WindowFeatureStore(max_devices=int(os.getenv("WINDOW_MAX_DEVICES", 10000)))
         self.interpreter = None
         self.fallback_model = None
         self.input_details = None
@@ -31,7 +44,9 @@ class DeviceMLModel:
         """Load the TFLite model and fallback model"""
         try:
             # Try to load TFLite model
-            if os.path.exists(self.tflite_model_path):
+            if os.path.exists(self.tflite_model_path) and not self._is_tflite_file(self.tflite_model_path):
+                logging.warning(f"{self.tflite_model_path} is not a TFLite model, skipping TensorFlow")
+            elif os.path.exists(self.tflite_model_path):
                 logging.info(f"Found TFLite model at {self.tflite_model_path}")
                 try:
                     # Only imports TensorFlow when needed
@@ -55,20 +70,39 @@ class DeviceMLModel:
             else:
                 logging.warning(f"TFLite model not found at {self.tflite_model_path}")
             
-            # Always load fallback model for reliability
-            if os.path.exists(self.fallback_model_path):
+            # Always load fallback model for reliability, the NumPy export avoids importing scikit-learn
+            if self.forest_arrays_path and os.path.exists(self.forest_arrays_path):
+                try:
+                    self.fallback_model = ForestScorer.load(self.forest_arrays_path)
+                    logging.info("Fallback model loaded from NumPy arrays")
+                except Exception as arrays_error:
+                    logging.error(f"Error loading fallback model arrays: {str(arrays_error)}")
+            if self.fallback_model is None and os.path.exists(self.fallback_model_path):
                 try:
                     with open(self.fallback_model_path, 'rb') as f:
                         self.fallback_model = pickle.load(f)
                     logging.info("Fallback model loaded successfully")
                 except Exception as fallback_error:
                     logging.error(f"Error loading fallbackmodel: {str(fallback_error)}")
-            else:
+            elif self.fallback_model is None:
                 logging.warning(f"Fallback model not found at {self.fallback_model_path}")
+
+            # Model trained on window features by model_generator.py, optional
+            if self.window_model_path and os.path.exists(self.window_model_path):
+                try:
+                    self.window_model = ForestScorer.load(self.window_model_path)
+                    logging.info("Window feature model loaded successfully")
+                except Exception as window_error:
+                    logging.error(f"Error loading window feature model: {str(window_error)}")
         except Exception as e:
             logging.error(f"Error loading models: {str(e)}")
             self.model_loaded = False
 
+    @staticmethod
+    def _is_tflite_file(path):
+        with open(path, 'rb') as f:
+            return f.read(8)[4:8] == TFLITE_IDENTIFIER
+
     def _convert_to_python_type(self, value):
         """Convert NumPy types to Python native types for MongoDB compatability"""
         if value is None:
@@ -134,6 +168,110 @@ class DeviceMLModel:
             }
         
     
+    def detect_anomalies_batch(self, readings, use_fallback=False):
+        """Score many readings at once, results are returned as columns in reading order
+
+        readings is either a list of reading dictionaries or a dictionary of columns. The
+        IsolationForest is run once over all rows with score_samples, and the prediction is taken
+        from the same scores (predict is score < offset_) instead of a second pass through the trees.
+        """
+        features = self._extract_features_batch(readings)
+        count = len(features)
+        result = {"count": count, "timestamp": datetime.now().isoformat()}
+
+        if self.fallback_model is not None and (use_fallback or not self.model_loaded or count > 1):
+            # The TFLite interpreter is sized for one row, batches go through the IsolationForest
+            scores = self.fallback_model.score_samples(features) if count else np.empty(0)
+            is_anomaly = scores < self.fallback_model.offset_
+            anomaly_score = 0.5 - scores / 2 # convert to 0-1 scale
+            result["prediction_model"] = "isolation_forest"
+        elif self.model_loaded and not use_fallback:
+            anomaly_score = np.empty(count)
+            for row in range(count):
+                self.interpreter.set_tensor(self.input_details[0]['index'], features[row:row + 1])
+                self.interpreter.invoke()
+                anomaly_score[row] = self.interpreter.get_tensor(self.output_details[0]['index'])[0][0]
+            is_anomaly = anomaly_score > 0.7 # Threshold for anomaly
+            result["prediction_model"] = "tensorflow_lite"
+        else:
+            logging.warning("No models available for anomaly detection")
+            result.update({"error": "No models available", "prediction_model": "none", "anomaly_count": 0,
+                           "is_anomaly": [False] * count, "anomaly_score": [0.0] * count, "confidence": [0.0] * count})
+            return result
+
+        if result["prediction_model"] == "isolation_forest":
+            confidence = np.minimum(np.abs(anomaly_score * 2), 1.0)
+        else:
+            confidence = np.minimum(np.abs(anomaly_score - 0.5) * 2, 1.0)
+        result.update({
+            "anomaly_count": int(is_anomaly.sum()),
+            "is_anomaly": is_anomaly.tolist(),
+            "anomaly_score": anomaly_score.astype(float).tolist(),
+            "confidence": confidence.astype(float).tolist()
+        })
+        return result
+
+    def detect_window_anomalies(self, readings):
+        """Update each reading's device window and score the window features, results as columns
+
+        Readings need a device_id and preferably a timestamp. Readings without a device_id and
+        devices that have not seen enough readings yet are reported as not ready and never flagged.
+        """
+        vectors, ready = {}, []
+        for row, reading in enumerate(readings):
+            device_id = reading.get("device_id")
+            if not device_id:
+                # Readings from different devices would be mixed into one window
+                ready.append(False)
+                continue
+            features, is_ready = self.window_store.update(device_id, reading)
+            vectors[row] = features
+            ready.append(is_ready)
+        count = len(ready)
+        result = {"count": count, "ready": ready, "timestamp": datetime.now().isoformat()}
+        is_anomaly = np.zeros(count, dtype=bool)
+        anomaly_score = np.zeros(count)
+
+        if self.window_model is None:
+            result.update({"error": "No window model available", "prediction_model": "none"})
+        else:
+            result["prediction_model"] = "window_isolation_forest"
+            rows = np.flatnonzero(ready)
+            if len(rows):
+                # One pass over every ready row
+                scores = self.window_model.score_samples(np.vstack([vectors[row] for row in rows]))
+                is_anomaly[rows] = scores < self.window_model.offset_
+                anomaly_score[rows] = 0.5 - scores / 2 # convert to 0-1 scale
+
+        result.update({
+            "anomaly_count": int(is_anomaly.sum()),
+            "is_anomaly": is_anomaly.tolist(),
+            "anomaly_score": anomaly_score.tolist()
+        })
+        return result
+
+    def _extract_features_batch(self, readings):
+        """Feature matrix of shape (N, 3), with the same defaults and range checks as _extract_features"""
+        if isinstance(readings, dict):
+            count = max((len(readings.get(name) or []) for name in FEATURES), default=0)
+            columns = {name: readings.get(name) or [None] * count for name in FEATURES}
+        else:
+            count = len(readings)
+            columns = {name: [reading.get(name) for reading in readings] for name in FEATURES}
+
+        features = np.empty((count, len(FEATURES)), dtype=np.float32)
+        for index, name in enumerate(FEATURES):
+            default, low, high = FEATURE_DEFAULTS[name]
+            if len(columns[name]) != count:
+                raise ValueError(f"Column {name} has {len(columns[name])} values, expected {count}")
+            values = np.array([default if value is None else value for value in columns[name]], dtype=np.float64)
+            out_of_range = (values < low) | (values > high) | np.isnan(values)
+            if out_of_range.any():
+                logging.warning(f"{int(out_of_range.sum())} {name} values out of reasonable range")
+                values[out_of_range] = default # Use as a safe default
+            features[:, index] = values
+        return features
+
     def _extract_features(self, sensor_data):
         """Extract and normalise features from data"""
         # Get value with defaults if missing
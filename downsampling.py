@@ -0,0 +1,61 @@
+import numpy as np
+
+# Reference for the algorithm: Sveinn Steinarsson, "Downsampling Time Series for Visual Representation" (2013)
+
+def lttb(x, y, threshold):
+    """Largest-Triangle-Three-Buckets, returns the indices of the points to keep
+
+    x must be sorted ascending. The first and last points are always kept and one point is
+    picked from each bucket in between, the one forming the largest triangle with the point
+    kept from the previous bucket and the average of the next bucket.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    # Bucket edges for the n - 2 points between the first and last
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    selected = np.empty(threshold, dtype=int)
+    selected[0] = 0
+    selected[-1] = n - 1
+
+    # Averages of every bucket, used as the third corner of the triangle
+    bucket_sums_x = np.add.reduceat(x[1:n - 1], edges[:-1] - 1)
+    bucket_sums_y = np.add.reduceat(y[1:n - 1], edges[:-1] - 1)
+    bucket_sizes = np.diff(edges)
+    avg_x = np.append(bucket_sums_x / bucket_sizes, x[-1])
+    avg_y = np.append(bucket_sums_y / bucket_sizes, y[-1])
+
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        next_x, next_y = avg_x[bucket + 1], avg_y[bucket + 1]
+        # Twice the triangle area for every candidate in the bucket at once
+        areas = np.abs(
+            (x[previous] - next_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (next_y - y[previous])
+        )
+        previous = start + int(np.argmax(areas))
+        selected[bucket + 1] = previous
+    return selected
+
+def time_bucket_pipeline(field, start_time, end_time, points, match=None):
+    """MongoDB aggregation that averages field into at most points equal time buckets"""
+    width_ms = max(int((end_time - start_time).total_seconds() * 1000 / points), 1)
+    query = {field: {"$exists": True, "$ne": None}, "timestamp": {"$gte": start_time, "$lte": end_time}}
+    if match:
+        query.update(match)
+    return [
+        {"$match": query},
+        {"$group": {
+            "_id": {"$floor": {"$divide": [{"$subtract": ["$timestamp", start_time]}, width_ms]}},
+            "timestamp": {"$min": "$timestamp"},
+            "value": {"$avg": f"${field}"},
+            "min": {"$min": f"${field}"},
+            "max": {"$max": f"${field}"},
+            "count": {"$sum": 1}
+        }},
+        {"$sort": {"_id": 1}}
+    ]
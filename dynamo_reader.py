@@ -0,0 +1,133 @@
+import queue
+import logging
+import threading
+from datetime import datetime
+from boto3.dynamodb.conditions import Key
+
+# Set up Logging
+logger = logging.getLogger(__name__)
+
+def _bound(value):
+    # Sort keys are ISO strings, so datetimes are compared as their isoformat
+    return value.isoformat() if isinstance(value, datetime) else value
+
+def projection(attributes):
+    """ProjectionExpression and ExpressionAttributeNames for attribute paths like payload.temperature
+
+    Every name goes through a placeholder, timestamp (like many attribute names) is a reserved word.
+    """
+    names = {}
+    placeholders = {}
+    paths = []
+    for attribute in dict.fromkeys(attributes):
+        parts = []
+        for part in attribute.split("."):
+            if part not in placeholders:
+                placeholders[part] = f"#p{len(placeholders)}"
+                names[placeholders[part]] = part
+            parts.append(placeholders[part])
+        paths.append(".".join(parts))
+    return ", ".join(paths), names
+
+def key_condition(partition_key, partition_value, sort_key=None, start=None, end=None):
+    """Partition equality plus the sort key range, so DynamoDB only reads the items in range"""
+    condition = Key(partition_key).eq(partition_value)
+    start, end = _bound(start), _bound(end)
+    if sort_key is None or (start is None and end is None):
+        return condition
+    if start is not None and end is not None:
+        return condition & Key(sort_key).between(start, end)
+    if start is not None:
+        return condition & Key(sort_key).gte(start)
+    return condition & Key(sort_key).lte(end)
+
+def query_pages(table, partition_key, partition_value, sort_key="timestamp", start=None, end=None, attributes=None, page_size=None, scan_forward=True):
+    """Pages of items for one partition and sort key range, following LastEvaluatedKey to the end"""
+    kwargs = {
+        "KeyConditionExpression": key_condition(partition_key, partition_value, sort_key, start, end),
+        "ScanIndexForward": scan_forward
+    }
+    if attributes:
+        # The keys are always needed, to resume a page and to order segments
+        kwargs["ProjectionExpression"], kwargs["ExpressionAttributeNames"] = projection([partition_key, sort_key] + list(attributes))
+    if page_size:
+        kwargs["Limit"] = page_size
+
+    while True:
+        response = table.query(**kwargs)
+        yield response.get("Items", [])
+        last_key = response.get("LastEvaluatedKey")
+        if not last_key:
+            return
+        kwargs["ExclusiveStartKey"] = last_key
+
+def query_items(table, partition_key, partition_value, sort_key="timestamp", start=None, end=None, attributes=None, page_size=None, scan_forward=True, limit=None):
+    """Items one at a time across every page, stopping early after limit items"""
+    count = 0
+    for page in query_pages(table, partition_key, partition_value, sort_key, start, end, attributes, page_size, scan_forward):
+        for item in page:
+            yield item
+            count += 1
+            if limit is not None and count >= limit:
+                return
+
+def split_range(start, end, segments):
+    """Split [start, end] into segments consecutive ISO string ranges sharing their boundaries"""
+    step = (end - start) / segments
+    bounds = [_bound(start + step * i) for i in range(segments)] + [_bound(end)]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+def query_items_parallel(table, partition_key, partition_value, start, end, segments=4, sort_key="timestamp", attributes=None, page_size=None, prefetch=2):
+    """Items for [start, end] in ascending sort key order, with the range queried as parallel time slices
+
+    Each slice is paged on its own thread into a queue holding at most prefetch pages, and the
+    slices are yielded in order, so memory stays bounded however long the range is.
+    """
+    if segments <= 1 or start is None or end is None:
+        yield from query_items(table, partition_key, partition_value, sort_key, start, end, attributes, page_size)
+        return
+
+    ranges = split_range(start, end, segments)
+    queues = [queue.Queue(maxsize=prefetch) for _ in ranges]
+    stop = threading.Event()
+    done = object()
+
+    def offer(pages, item):
+        # Waits for room in the queue unless the consumer has gone away
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce(index, low, high):
+        pages = queues[index]
+        try:
+            for page in query_pages(table, partition_key, partition_value, sort_key, low, high, attributes, page_size):
+                if index < len(ranges) - 1:
+                    # between is inclusive, an item exactly on a boundary belongs to the next slice
+                    page = [item for item in page if item.get(sort_key) != high]
+                if not offer(pages, page):
+                    return
+            offer(pages, done)
+        except Exception as e:
+            logger.error(f"DynamoDB query for {low} to {high} failed: {str(e)}")
+            offer(pages, e)
+
+    threads = [threading.Thread(target=produce, args=(index, low, high), daemon=True) for index, (low, high) in enumerate(ranges)]
+    for thread in threads:
+        thread.start()
+    try:
+        for pages in queues:
+            while True:
+                page = pages.get()
+                if page is done:
+                    break
+                if isinstance(page, Exception):
+                    raise page
+                yield from page
+    finally:
+        # Also reached when the caller stops early, producers waiting on a full queue give up
+        stop.set()
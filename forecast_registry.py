@@ -0,0 +1,147 @@
+import time
+import logging
+import threading
+import numpy as np
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from sklearn.ensemble import IsolationForest
+from statsmodels.tsa.arima.model import ARIMA
+
+# Set up Logging
+logger = logging.getLogger(__name__)
+
+class FittedModels:
+    """ARIMA and IsolationForest fitted on one series, with forecasts memoised per horizon"""
+
+    def __init__(self, timestamps, values, arima_fit, iso_forest, fitted_at):
+        self.timestamps = list(timestamps)
+        self.values = np.asarray(values, dtype=float)
+        self.arima_fit = arima_fit
+        self.iso_forest = iso_forest
+        self.fitted_at = fitted_at
+        self._forecasts = {}
+        self._lock = threading.Lock()
+
+    def forecast(self, steps):
+        with self._lock:
+            if steps not in self._forecasts:
+                self._forecasts[steps] = np.asarray(self.arima_fit.forecast(steps=steps), dtype=float)
+            return self._forecasts[steps]
+
+    def anomalies(self, values):
+        """Indices of values the fitted IsolationForest marks as anomalies"""
+        if self.iso_forest is None:
+            return np.array([], dtype=int)
+        return np.where(self.iso_forest.predict(np.asarray(values, dtype=float).reshape(-1, 1)) == -1)[0]
+
+def fit_models(timestamps, values, order=(1, 1, 0), clock=time.monotonic):
+    """Fit the forecasting and anomaly models on a series"""
+    values = np.asarray(values, dtype=float)
+    arima_fit = ARIMA(values, order=order).fit()
+    try:
+        iso_forest = IsolationForest(contamination=0.1, random_state=42).fit(values.reshape(-1, 1))
+    except Exception as e:
+        logger.error(f"Anomaly detection error: {str(e)}")
+        iso_forest = None
+    return FittedModels(timestamps, values, arima_fit, iso_forest, clock())
+
+class ModelRegistry:
+    """Fitted models keyed by (data_type, device_id), refit in the background as data arrives
+
+    A request passes the series it just loaded. If the part that overlaps the fitted series is
+    unchanged the cached models are used, and once min_new_points newer points have arrived a
+    refit is started on a worker thread while the old models keep serving. A series that no
+    longer lines up with the fitted one (history rewritten, or so much new data that there is
+    no overlap left) is refit on the request thread. At most max_entries series are kept, the
+    least recently used are dropped first.
+    """
+
+    def __init__(self, fit=fit_models, min_new_points=10, max_workers=1, max_entries=256):
+        self.fit = fit
+        self.min_new_points = min_new_points
+        self.max_entries = max_entries
+        self._models = OrderedDict()
+        self._refitting = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="model-refit")
+        self.stats = {"hits": 0, "misses": 0, "background_refits": 0, "sync_refits": 0, "evictions": 0}
+
+    def get(self, key, timestamps, values):
+        """Models for the series, as (models, status) where status is hit, refreshing or fitted"""
+        timestamps = list(timestamps)
+        values = np.asarray(values, dtype=float)
+        with self._lock:
+            models = self._models.get(key)
+            if models is not None:
+                self._models.move_to_end(key)
+
+        if models is not None:
+            new_points = self._new_points(models, timestamps, values)
+            if new_points is not None:
+                if new_points >= self.min_new_points:
+                    self._refit_in_background(key, timestamps, values)
+                    with self._lock:
+                        self.stats["hits"] += 1
+                    return models, "refreshing"
+                with self._lock:
+                    self.stats["hits"] += 1
+                return models, "hit"
+            with self._lock:
+                self.stats["sync_refits"] += 1
+        else:
+            with self._lock:
+                self.stats["misses"] += 1
+
+        models = self.fit(timestamps, values)
+        with self._lock:
+            self._store(key, models)
+        return models, "fitted"
+
+    def _store(self, key, models):
+        # Called with the lock held
+        self._models[key] = models
+        self._models.move_to_end(key)
+        while len(self._models) > self.max_entries:
+            self._models.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def _new_points(self, models, timestamps, values):
+        """How many points are newer than the fitted series, None if the overlap does not match"""
+        last_fitted = models.timestamps[-1]
+        if last_fitted not in timestamps:
+            return None
+        end = timestamps.index(last_fitted) + 1
+        overlap = min(end, len(models.timestamps))
+        if timestamps[end - overlap:end] != models.timestamps[-overlap:]:
+            return None
+        if not np.allclose(values[end - overlap:end], models.values[-overlap:], equal_nan=True):
+            return None
+        return len(timestamps) - end
+
+    def _refit_in_background(self, key, timestamps, values):
+        with self._lock:
+            if key in self._refitting:
+                return
+            self._refitting.add(key)
+
+        def refit():
+            try:
+                models = self.fit(timestamps, values)
+                with self._lock:
+                    self._store(key, models)
+                    self.stats["background_refits"] += 1
+            except Exception as e:
+                logger.error(f"Background refit of {key} failed: {str(e)}")
+            finally:
+                with self._lock:
+                    self._refitting.discard(key)
+
+        self._executor.submit(refit)
+
+    def wait(self):
+        """Block until queued refits are done, used by tests and on shutdown"""
+        self._executor.submit(lambda: None).result()
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
@@ -0,0 +1,125 @@
+import numpy as np
+
+# Kept free of scikit-learn imports, workers only need NumPy to load and score an exported model
+FORMAT_VERSION = 1
+
+def average_path_length(n_samples):
+    """Average path length of an unsuccessful search in a binary search tree of n samples, c(n)"""
+    n_samples = np.asarray(n_samples, dtype=np.float64)
+    lengths = np.zeros_like(n_samples)
+    lengths[n_samples == 2] = 1.0
+    large = n_samples > 2
+    lengths[large] = 2.0 * (np.log(n_samples[large] - 1.0) + np.euler_gamma) - 2.0 * (n_samples[large] - 1.0) / n_samples[large]
+    return lengths
+
+def node_depths(tree):
+    """Depth of every node of a fitted tree_, the root is 0"""
+    depths = np.zeros(tree.node_count, dtype=np.int64)
+    # Nodes are numbered depth first, so a parent always comes before its children
+    for node in range(tree.node_count):
+        if tree.children_left[node] != -1:
+            depths[tree.children_left[node]] = depths[tree.children_right[node]] = depths[node] + 1
+    return depths
+
+def flatten_isolation_forest(model):
+    """Every tree of a fitted IsolationForest concatenated into flat arrays
+
+    Node indices are made global across trees. Leaves point back at themselves and carry the path
+    length a sample ending there adds to the score (depth + c(node samples)), so scoring is a
+    fixed number of vectorised steps followed by a sum over trees. Only public attributes of the
+    model and its trees are read.
+    """
+    n_features = model.n_features_in_
+    # Trees are only fitted on a column subset when max_features is below the number of features
+    subsample_features = len(model.estimators_features_[0]) != n_features
+    features, thresholds, left, right, leaf_values, roots = [], [], [], [], [], []
+    offset = 0
+    max_depth = 0
+    for estimator, tree_features in zip(model.estimators_, model.estimators_features_):
+        tree = estimator.tree_
+        nodes = np.arange(tree.node_count)
+        is_leaf = tree.children_left == -1
+        # Columns of the original input, trees fitted on a feature subset index into that subset
+        feature = np.asarray(tree_features)[np.maximum(tree.feature, 0)] if subsample_features else np.maximum(tree.feature, 0)
+        features.append(np.where(is_leaf, 0, feature).astype(np.int32))
+        thresholds.append(np.where(is_leaf, np.inf, tree.threshold))
+        right.append(np.where(is_leaf, nodes, tree.children_right).astype(np.int32) + offset)
+        left.append(np.where(is_leaf, nodes, tree.children_left).astype(np.int32) + offset)
+        leaf_values.append(np.where(is_leaf, node_depths(tree) + average_path_length(tree.n_node_samples), 0.0))
+        roots.append(offset)
+        max_depth = max(max_depth, tree.max_depth)
+        offset += tree.node_count
+
+    # scikit-learn compares float32 inputs with float64 thresholds, rounding each threshold down to
+    # the nearest float32 keeps every split the same while comparing in float32
+    thresholds = np.concatenate(thresholds)
+    thresholds32 = thresholds.astype(np.float32)
+    rounded_up = thresholds32.astype(np.float64) > thresholds
+    thresholds32[rounded_up] = np.nextafter(thresholds32[rounded_up], np.float32(-np.inf))
+    return {
+        "format_version": np.array(FORMAT_VERSION),
+        "feature": np.concatenate(features),
+        "threshold": thresholds32,
+        # Children interleaved as [right, left] per node, so the next node is children[node * 2 + goes_left]
+        "children": np.column_stack([np.concatenate(right), np.concatenate(left)]).ravel(),
+        "leaf_value": np.concatenate(leaf_values),
+        "roots": np.array(roots, dtype=np.int32),
+        "max_depth": np.array(max_depth),
+        "n_features": np.array(n_features),
+        "normaliser": np.array(len(model.estimators_) * average_path_length([model.max_samples_])[0]),
+        "offset": np.array(model.offset_)
+    }
+
+def save_forest(model, path):
+    """Write a fitted IsolationForest as an uncompressed .npz that ForestScorer can load"""
+    np.savez(path, **flatten_isolation_forest(model))
+
+class ForestScorer:
+    """IsolationForest scoring from exported arrays, same scores as score_samples without scikit-learn
+
+    Exposes score_samples, decision_function, predict and offset_, so it can stand in for the
+    fitted model wherever those are used.
+    """
+
+    def __init__(self, arrays):
+        if int(arrays["format_version"]) != FORMAT_VERSION:
+            raise ValueError(f"Unsupported forest format version {int(arrays['format_version'])}")
+        self.feature = arrays["feature"]
+        self.threshold = arrays["threshold"]
+        self.children = arrays["children"]
+        self.leaf_value = arrays["leaf_value"]
+        self.roots = arrays["roots"]
+        self.max_depth = int(arrays["max_depth"])
+        self.n_features_in_ = int(arrays["n_features"])
+        self.normaliser = float(arrays["normaliser"])
+        self.offset_ = float(arrays["offset"])
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as arrays:
+            return cls({name: arrays[name] for name in arrays.files})
+
+    def score_samples(self, X, chunk_size=1024):
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.n_features_in_:
+            raise ValueError(f"Expected input of shape (n, {self.n_features_in_}), got {X.shape}")
+        depths = np.empty(len(X))
+        # Rows go through in chunks so the (rows, trees) node arrays stay in cache
+        for start in range(0, len(X), chunk_size):
+            flat = np.ascontiguousarray(X[start:start + chunk_size]).ravel()
+            rows = len(flat) // self.n_features_in_
+            row_offsets = (np.arange(rows, dtype=np.int32) * self.n_features_in_)[:, None]
+            nodes = np.broadcast_to(self.roots, (rows, len(self.roots)))
+            for _ in range(self.max_depth):
+                goes_left = np.take(flat, row_offsets + np.take(self.feature, nodes)) <= np.take(self.threshold, nodes)
+                nodes = np.take(self.children, nodes * 2 + goes_left)
+            depths[start:start + chunk_size] = np.take(self.leaf_value, nodes).sum(axis=1)
+        if self.normaliser == 0:
+            return -np.ones(len(X))
+        return -(2 ** (-depths / self.normaliser))
+
+    def decision_function(self, X):
+        return self.score_samples(X) - self.offset_
+
+    def predict(self, X):
+        return np.where(self.decision_function(X) < 0, -1, 1)
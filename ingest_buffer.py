@@ -0,0 +1,255 @@
+import time
+import queue
+import atexit
+import logging
+import threading
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+
+# Set up Logging
+logger = logging.getLogger(__name__)
+
+class IngestBufferFull(Exception):
+    """Raised when the write-behind queue is full and cannot accept more documents"""
+
+class _PendingWrite:
+    """A document waiting in the queue along with the event used to acknowledge it"""
+    __slots__ = ("collection", "document", "done", "error")
+
+    def __init__(self, collection, document):
+        self.collection = collection
+        self.document = document
+        self.done = threading.Event()
+        self.error = None
+
+class IngestBuffer:
+    """Write-behind buffer that batches MongoDB inserts on a background thread
+
+    Documents are flushed with insert_many once max_batch_size documents are queued or
+    flush_interval seconds have passed since the first document of the batch arrived.
+    With durability="flush" submit() only returns once the document is in MongoDB, with
+    durability="enqueue" it returns as soon as the document is queued.
+    """
+    DURABILITY_MODES = ("enqueue", "flush")
+
+    def __init__(self, max_batch_size=500, flush_interval=0.5, max_queue_size=10000, durability="flush",
+                 enqueue_timeout=1.0, ack_timeout=10.0, max_retries=2, retry_delay=0.2, on_flush=None):
+        if durability not in self.DURABILITY_MODES:
+            raise ValueError(f"Unknown durability mode: {durability}")
+
+        self.max_batch_size = max_batch_size
+        self.flush_interval = flush_interval
+        self.durability = durability
+        self.enqueue_timeout = enqueue_timeout
+        self.ack_timeout = ack_timeout
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        # Called with (collection, documents) after documents are stored, e.g. to update rollups
+        self.on_flush = on_flush
+
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._thread = None
+        self._stopping = threading.Event()
+        self._metrics_lock = threading.Lock()
+        self._metrics = {
+            "enqueued": 0,
+            "flushed": 0,
+            "failed": 0,
+            "rejected": 0,
+            "flushes": 0,
+            "last_batch_size": 0,
+            "last_flush_latency_ms": 0.0,
+            "max_flush_latency_ms": 0.0,
+            "total_flush_latency_ms": 0.0
+        }
+
+    def start(self):
+        """Start the background flush thread"""
+        if self._thread and self._thread.is_alive():
+            return self
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="ingest-buffer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+        return self
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive() and not self._stopping.is_set()
+
+    def submit(self, collection, document):
+        """Queue a document for insertion and return its _id"""
+        # Assign the id up front so callers can return it before the flush happens
+        if '_id' not in document:
+            document['_id'] = ObjectId()
+
+        if not self.running:
+            # No flush thread (stopped or never started), fall back to a direct write
+            collection.insert_one(document)
+            if self.on_flush:
+                self.on_flush(collection, [document])
+            return document['_id']
+
+        pending = _PendingWrite(collection, document)
+        try:
+            self._queue.put(pending, timeout=self.enqueue_timeout)
+        except queue.Full:
+            self._record(rejected=1)
+            raise IngestBufferFull("Ingest queue is full")
+        self._record(enqueued=1)
+
+        if self.durability == "flush":
+            if not pending.done.wait(self.ack_timeout):
+                raise TimeoutError("Timed out waiting for ingest flush")
+            if pending.error:
+                raise pending.error
+        return document['_id']
+
+    def flush(self, timeout=None):
+        """Block until everything queued so far has been written"""
+        marker = _PendingWrite(None, None)
+        if not self.running:
+            return True
+        self._queue.put(marker)
+        return marker.done.wait(timeout)
+
+    def close(self, timeout=10.0):
+        """Stop accepting documents and drain the queue to MongoDB"""
+        if not self._thread:
+            return
+        self._stopping.set()
+        self._thread.join(timeout)
+        # Anything left behind after the thread exits is written here
+        remaining = self._drain_nowait(None)
+        if remaining:
+            self._flush(remaining)
+        self._thread = None
+
+    def metrics(self):
+        """Return queue depth and flush statistics"""
+        with self._metrics_lock:
+            metrics = dict(self._metrics)
+        flushes = metrics.pop("total_flush_latency_ms")
+        metrics["avg_flush_latency_ms"] = round(flushes / metrics["flushes"], 3) if metrics["flushes"] else 0.0
+        metrics["queue_depth"] = self._queue.qsize()
+        metrics["durability"] = self.durability
+        metrics["running"] = self.running
+        return metrics
+
+    def _record(self, **counts):
+        with self._metrics_lock:
+            for key, value in counts.items():
+                self._metrics[key] += value
+
+    def _drain_nowait(self, limit):
+        batch = []
+        while limit is None or len(batch) < limit:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stopping.is_set() or not self._queue.empty():
+            try:
+                first = self._queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+            batch = [first]
+            # Take whatever is already waiting without blocking
+            batch.extend(self._drain_nowait(self.max_batch_size - 1))
+
+            # When requests are not waiting on the write, hold the batch open for the time trigger
+            if self.durability == "enqueue":
+                deadline = time.monotonic() + self.flush_interval
+                while len(batch) < self.max_batch_size and not self._stopping.is_set():
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        # Short waits so a shutdown does not sit out the whole interval
+                        batch.append(self._queue.get(timeout=min(remaining, 0.1)))
+                    except queue.Empty:
+                        continue
+
+            self._flush(batch)
+
+    def _flush(self, batch):
+        writes = [pending for pending in batch if pending.collection is not None]
+        markers = [pending for pending in batch if pending.collection is None]
+
+        # Group documents by collection so each gets one insert_many
+        groups = {}
+        for pending in writes:
+            groups.setdefault(id(pending.collection), []).append(pending)
+
+        start_time = time.perf_counter()
+        for group in groups.values():
+            self._write_group(group)
+        latency = (time.perf_counter() - start_time) * 1000
+
+        if writes:
+            with self._metrics_lock:
+                self._metrics["flushes"] += 1
+                self._metrics["last_batch_size"] = len(writes)
+                self._metrics["last_flush_latency_ms"] = round(latency, 3)
+                self._metrics["max_flush_latency_ms"] = round(max(self._metrics["max_flush_latency_ms"], latency), 3)
+                self._metrics["total_flush_latency_ms"] += latency
+
+        for marker in markers:
+            marker.done.set()
+
+    def _write_group(self, group):
+        collection = group[0].collection
+        pending_writes = group
+        attempt = 0
+        stored = []
+
+        while pending_writes:
+            try:
+                collection.insert_many([pending.document for pending in pending_writes], ordered=False)
+                failed = {}
+            except BulkWriteError as e:
+                failed = {error['index']: error for error in e.details.get('writeErrors', [])}
+                if not failed:
+                    failed = {index: {"errmsg": str(e)} for index in range(len(pending_writes))}
+            except Exception as e:
+                failed = {index: {"errmsg": str(e)} for index in range(len(pending_writes))}
+
+            retry = []
+            for index, pending in enumerate(pending_writes):
+                error = failed.get(index)
+                if error is None:
+                    stored.append(pending.document)
+                    self._finish(pending, None)
+                # Duplicate keys mean an earlier attempt already stored the document
+                elif error.get('code') == 11000 and attempt > 0:
+                    stored.append(pending.document)
+                    self._finish(pending, None)
+                elif attempt < self.max_retries and error.get('code') != 11000:
+                    retry.append(pending)
+                else:
+                    self._finish(pending, Exception(f"Failed to insert document: {error.get('errmsg')}"))
+
+            if retry:
+                attempt += 1
+                logger.warning(f"Retrying {len(retry)} documents (attempt {attempt})")
+                time.sleep(self.retry_delay * attempt)
+            pending_writes = retry
+
+        if stored and self.on_flush:
+            try:
+                self.on_flush(collection, stored)
+            except Exception as e:
+                logger.error(f"Ingest flush callback failed: {str(e)}")
+
+    def _finish(self, pending, error):
+        pending.error = error
+        if error:
+            logger.error(f"Ingest write failed: {error}")
+            self._record(failed=1)
+        else:
+            self._record(flushed=1)
+        pending.done.set()
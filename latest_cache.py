@@ -0,0 +1,143 @@
+import logging
+import threading
+from datetime import datetime
+
+# Set up Logging
+logger = logging.getLogger(__name__)
+
+def _is_newer(document, current):
+    """Whether document is at least as recent as current, arrival order wins if timestamps do not compare"""
+    if current is None:
+        return True
+    try:
+        return document.get("timestamp") >= current.get("timestamp")
+    except TypeError:
+        return True
+
+class LatestReadingCache:
+    """Latest sensor and water reading per room, kept in memory
+
+    The ingest path calls update() with every stored batch so this worker is always current.
+    Readings written by other workers arrive through a MongoDB change stream, and where change
+    streams are not available (standalone servers, mongomock) the cache is rebuilt from the
+    collections every refresh_interval seconds instead. An empty cache means lookups fall back
+    to the database, so a cold or disabled cache never hides data. on_change, if given, is
+    called with (collection_name, documents) for every reading seen on the change stream.
+    """
+
+    def __init__(self, sensor_collection, water_collection, refresh_interval=30, on_change=None):
+        self.sensor_collection = sensor_collection
+        self.water_collection = water_collection
+        self.refresh_interval = refresh_interval
+        self.on_change = on_change
+        self._latest = {sensor_collection.name: {}, water_collection.name: {}}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.mode = "stopped"
+        self.last_refresh = None
+
+    def start(self):
+        """Build the cache from MongoDB and start following new readings"""
+        self.rebuild()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._follow, name="latest-reading-cache", daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+            self._thread = None
+        self.mode = "stopped"
+
+    def update(self, collection_name, documents):
+        """Fold newly stored readings into the cache"""
+        with self._lock:
+            latest = self._latest.get(collection_name)
+            if latest is None:
+                return
+            for document in documents:
+                room_id = document.get("room_id")
+                if room_id is None:
+                    continue
+                if _is_newer(document, latest.get(room_id)):
+                    latest[room_id] = dict(document)
+
+    def clear(self):
+        with self._lock:
+            for latest in self._latest.values():
+                latest.clear()
+
+    def rebuild(self):
+        """Replace the cache with the newest reading per room from each collection"""
+        pipeline = [
+            {"$sort": {"room_id": 1, "timestamp": -1}},
+            {"$group": {"_id": "$room_id", "document": {"$first": "$$ROOT"}}}
+        ]
+        rebuilt = {}
+        try:
+            for collection in (self.sensor_collection, self.water_collection):
+                rebuilt[collection.name] = {
+                    row["_id"]: row["document"]
+                    for row in collection.aggregate(pipeline, allowDiskUse=True)
+                    if row["_id"] is not None
+                }
+        except Exception as e:
+            logger.warning(f"Could not rebuild latest reading cache: {str(e)}")
+            return False
+        with self._lock:
+            self._latest = rebuilt
+        self.last_refresh = datetime.now()
+        return True
+
+    def get(self, room_id):
+        """Latest reading for a room, None when the room is not cached"""
+        with self._lock:
+            sensor = self._latest[self.sensor_collection.name].get(room_id)
+            water = self._latest[self.water_collection.name].get(room_id)
+        if sensor is None and water is None:
+            return None
+        latest = dict(sensor if sensor is not None else water)
+        # Fill in the flow rate from the water collection when the sensor reading has none
+        if room_id == "bathroom" and "flow_rate" not in latest and water is not None and "flow_rate" in water:
+            latest["flow_rate"] = water["flow_rate"]
+        return latest
+
+    def rooms(self):
+        """Rooms with sensor readings, matching distinct("room_id") on the sensor collection"""
+        with self._lock:
+            return sorted(self._latest[self.sensor_collection.name], key=str)
+
+    def stats(self):
+        with self._lock:
+            sizes = {name: len(latest) for name, latest in self._latest.items()}
+        return {
+            "mode": self.mode,
+            "rooms": sizes,
+            "last_refresh": self.last_refresh.isoformat() if self.last_refresh else None
+        }
+
+    def _follow(self):
+        names = [self.sensor_collection.name, self.water_collection.name]
+        pipeline = [{"$match": {"operationType": "insert", "ns.coll": {"$in": names}}}]
+        while not self._stop.is_set():
+            try:
+                with self.sensor_collection.database.watch(pipeline, max_await_time_ms=1000) as stream:
+                    self.mode = "change_stream"
+                    # Catch up on anything written before the stream opened
+                    self.rebuild()
+                    while not self._stop.is_set() and stream.alive:
+                        change = stream.try_next()
+                        if change is not None:
+                            self.update(change["ns"]["coll"], [change["fullDocument"]])
+                            if self.on_change is not None:
+                                self.on_change(change["ns"]["coll"], [change["fullDocument"]])
+            except Exception as e:
+                if self.mode != "polling":
+                    logger.info(f"Change streams unavailable, refreshing latest reading cache every {self.refresh_interval}s: {str(e)}")
+                self.mode = "polling"
+                if self._stop.wait(self.refresh_interval):
+                    break
+                self.rebuild()
@@ -0,0 +1,256 @@
+import json
+import time
+import logging
+import hashlib
+import secrets
+import threading
+from collections import deque, OrderedDict
+from datetime import datetime, timezone
+from bson import ObjectId
+
+# Set up Logging
+logger = logging.getLogger(__name__)
+
+# Fields sent with every event whatever metrics were asked for
+BASE_FIELDS = ("room_id", "device_id", "timestamp", "location")
+
+def _json_default(obj):
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    return str(obj)
+
+def format_event(data, event=None, event_id=None):
+    """Encode one Server-Sent Events message"""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if event:
+        lines.append(f"event: {event}")
+    payload = data if isinstance(data, str) else json.dumps(data, default=_json_default)
+    lines.extend(f"data: {line}" for line in payload.splitlines() or [""])
+    return "\n".join(lines) + "\n\n"
+
+class Subscription:
+    """One connected client, with its filters and a bounded queue of pending events
+
+    When a client reads slower than readings arrive the oldest events are dropped rather than
+    letting the queue grow, a live dashboard only cares about the newest values.
+    """
+
+    def __init__(self, broadcaster, rooms=None, metrics=None, max_queue=100):
+        self.broadcaster = broadcaster
+        self.rooms = set(rooms) if rooms else None
+        self.metrics = set(metrics) if metrics else None
+        self.dropped = 0
+        self._queue = deque(maxlen=max_queue)
+        self._ready = threading.Condition()
+        self._closed = False
+
+    def matches_room(self, room_id):
+        return self.rooms is None or room_id in self.rooms
+
+    def project(self, document):
+        """The part of a reading this client asked for, None if it has none of the requested metrics"""
+        if self.metrics is None:
+            return {k: v for k, v in document.items() if k != "_id"}
+        values = {k: document[k] for k in self.metrics if k in document}
+        if not values:
+            return None
+        values.update({k: document[k] for k in BASE_FIELDS if k in document})
+        return values
+
+    def put(self, message):
+        with self._ready:
+            if len(self._queue) == self._queue.maxlen:
+                self.dropped += 1
+            self._queue.append(message)
+            self._ready.notify()
+
+    def get(self, timeout=None):
+        """Next pending message, None on timeout or once closed"""
+        with self._ready:
+            if not self._queue and not self._closed:
+                self._ready.wait(timeout)
+            return self._queue.popleft() if self._queue else None
+
+    def close(self):
+        with self._ready:
+            self._closed = True
+            self._ready.notify_all()
+        self.broadcaster.unsubscribe(self)
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def events(self, heartbeat=15):
+        """SSE messages for this client, with a comment line as keep-alive when idle"""
+        try:
+            yield format_event({"rooms": sorted(self.rooms) if self.rooms else None, "metrics": sorted(self.metrics) if self.metrics else None}, event="subscribed")
+            while not self._closed:
+                message = self.get(timeout=heartbeat)
+                if message is None:
+                    if not self._closed:
+                        yield ": keep-alive\n\n"
+                    continue
+                yield message
+        finally:
+            self.close()
+
+class LiveBroadcaster:
+    """Fans out stored readings to subscribed dashboard clients
+
+    publish() is called from the ingest path (and from the change stream for readings stored by
+    other workers), encodes each reading once per distinct projection and hands it to every
+    matching subscriber's queue without blocking on slow clients.
+    """
+
+    def __init__(self, max_queue=100, max_subscribers=1000, recent_ids=5000):
+        self.max_queue = max_queue
+        self.max_subscribers = max_subscribers
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        # Ids of recently published readings, the same reading can arrive from ingest and the change stream
+        self._recent = OrderedDict()
+        self._recent_limit = recent_ids
+        self._sequence = 0
+        self.published = 0
+
+    def subscribe(self, rooms=None, metrics=None):
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                return None
+            subscription = Subscription(self, rooms, metrics, self.max_queue)
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def publish(self, collection_name, documents):
+        """Send readings to every subscriber whose filters match"""
+        with self._lock:
+            subscribers = list(self._subscribers)
+            fresh = []
+            for document in documents:
+                document_id = document.get("_id")
+                if document_id is not None:
+                    if document_id in self._recent:
+                        continue
+                    self._recent[document_id] = True
+                    if len(self._recent) > self._recent_limit:
+                        self._recent.popitem(last=False)
+                self._sequence += 1
+                fresh.append((self._sequence, document))
+        if not subscribers or not fresh:
+            return 0
+
+        delivered = 0
+        for sequence, document in fresh:
+            encoded = {}
+            for subscription in subscribers:
+                if not subscription.matches_room(document.get("room_id")):
+                    continue
+                # Clients with the same metric filter share one encoded message
+                key = frozenset(subscription.metrics) if subscription.metrics else None
+                if key not in encoded:
+                    values = subscription.project(document)
+                    encoded[key] = None if values is None else format_event(values, event=collection_name, event_id=sequence)
+                if encoded[key] is not None:
+                    subscription.put(encoded[key])
+                    delivered += 1
+        self.published += len(fresh)
+        return delivered
+
+    def close(self):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            subscription.close()
+
+    def stats(self):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        return {
+            "subscribers": len(subscribers),
+            "published": self.published,
+            "dropped": sum(s.dropped for s in subscribers)
+        }
+
+class StreamTickets:
+    """Short lived single use tickets that let an EventSource open /api/stream
+
+    EventSource cannot send an Authorization header, so an authenticated client first asks for a
+    ticket and puts that in the stream URL. Tickets expire after ttl seconds and are removed when
+    redeemed, so one leaking into an access log is of no use afterwards.
+    """
+
+    def __init__(self, ttl=30.0, max_tickets=10000, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_tickets = max_tickets
+        self._clock = clock
+        self._tickets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def issue(self, user):
+        ticket = secrets.token_urlsafe(32)
+        now = self._clock()
+        with self._lock:
+            self._tickets[ticket] = (now + self.ttl, user)
+            # Tickets are issued in expiry order, so expired and excess ones are at the front
+            while self._tickets:
+                oldest_ticket, (expires, _) = next(iter(self._tickets.items()))
+                if expires > now and len(self._tickets) <= self.max_tickets:
+                    break
+                self._tickets.pop(oldest_ticket)
+        return ticket
+
+    def redeem(self, ticket):
+        """User the ticket was issued to, or None when it is unknown, used or expired"""
+        with self._lock:
+            entry = self._tickets.pop(ticket, None)
+        if entry is None or entry[0] <= self._clock():
+            return None
+        return entry[1]
+
+class MongoStreamTickets:
+    """StreamTickets kept in a MongoDB collection so every gunicorn worker can redeem them
+
+    A ticket issued by one worker is usually redeemed by another, so they cannot live in process
+    memory. Only a hash of the ticket is stored, redeeming deletes the document atomically so a
+    ticket works once, and a TTL index on expires_at_date (created by db_indexes.provision)
+    removes tickets that were never used.
+    """
+
+    def __init__(self, collection, ttl=30.0, clock=time.time):
+        self.collection = collection
+        self.ttl = ttl
+        self._clock = clock
+
+    @staticmethod
+    def _ticket_id(ticket):
+        return hashlib.sha256(ticket.encode()).hexdigest()
+
+    def issue(self, user):
+        ticket = secrets.token_urlsafe(32)
+        expires = self._clock() + self.ttl
+        self.collection.insert_one({
+            "_id": self._ticket_id(ticket),
+            "user": user,
+            "expires_at": expires,
+            "expires_at_date": datetime.fromtimestamp(expires, tz=timezone.utc)
+        })
+        return ticket
+
+    def redeem(self, ticket):
+        """User the ticket was issued to, or None when it is unknown, used or expired"""
+        if not ticket:
+            return None
+        # The TTL monitor only runs once a minute, so expiry is checked here as well
+        entry = self.collection.find_one_and_delete({"_id": self._ticket_id(ticket)})
+        if entry is None or entry["expires_at"] <= self._clock():
+            return None
+        return entry["user"]
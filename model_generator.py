@@ -3,6 +3,8 @@ from sklearn.ensemble import IsolationForest
 import pickle
 import os
 import logging
+from forest_scorer import save_forest
+from window_features import WindowFeatureStore
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -58,6 +60,11 @@ def create_isolation_forest_model():
             pickle.dump(model, f)
         logging.info(f"Isolation Forest model saved to {isolation_forest_path}")
 
+        # Flattened NumPy export, loaded by devices without importing scikit-learn
+        forest_arrays_path = os.path.join(models_dir, 'isolation_forest.npz')
+        save_forest(model, forest_arrays_path)
+        logging.info(f"Isolation Forest arrays saved to {forest_arrays_path}")
+
         # File aaves placeholder to replacce TFLite file
         placeholder_path = os.path.join(models_dir, 'anomaly_direction.tflite')
         with open(placeholder_path, 'wb') as f:
@@ -84,6 +91,41 @@ def create_isolation_forest_model():
         logging.error(f"Error Isolation Forest model: {str(e)}")
         return False, str(e)
 
+def generate_sample_streams(n_devices=50, n_steps=720, interval=30, seed=42):
+    """Generates interleaved synthetic readings from many devices, (device_id, timestamp, reading) in time order"""
+    logging.info(f"Generating {n_steps} readings for each of {n_devices} devices")
+    rng = np.random.default_rng(seed)
+    # Every device has its own baseline and a slow daily cycle with sensor noise on top
+    baselines = np.column_stack([rng.normal(22, 2, n_devices), rng.normal(45, 8, n_devices), rng.normal(1013, 4, n_devices)])
+    cycle = np.sin(2 * np.pi * np.arange(n_steps) * interval / 86400.0)
+    for step in range(n_steps):
+        noise = rng.normal(0, [0.2, 0.8, 0.3], (n_devices, 3))
+        values = baselines + np.outer(np.ones(n_devices), [1.5, 4, 0.5]) * cycle[step] + noise
+        for device in range(n_devices):
+            reading = {"temperature": values[device, 0], "humidity": values[device, 1], "pressure": values[device, 2]}
+            yield f"device-{device}", step * interval, reading
+
+def create_window_model(models_dir='models', streams=None, contamination=0.01):
+    """Trains an Isolation Forest on rolling window features and saves it as NumPy arrays"""
+    store = WindowFeatureStore()
+    rows = []
+    for device_id, timestamp, reading in (streams if streams is not None else generate_sample_streams()):
+        features, ready = store.update(device_id, reading, timestamp)
+        if ready:
+            rows.append(features)
+
+    logging.info(f"Training window feature Isolation Forest on {len(rows)} windows")
+    # Bigger subsamples than the default 256 so windows well outside the training range keep
+    # scoring as more anomalous instead of levelling off at the edge of the data
+    model = IsolationForest(contamination=contamination, max_samples=min(1024, len(rows)), random_state=42)
+    model.fit(np.vstack(rows))
+
+    os.makedirs(models_dir, exist_ok=True)
+    window_model_path = os.path.join(models_dir, 'window_forest.npz')
+    save_forest(model, window_model_path)
+    logging.info(f"Window feature model saved to {window_model_path}")
+    return model
+
 
 if __name__ == "__main__":
     print("n" + "=" * 60)
@@ -94,6 +136,8 @@ if __name__ == "__main__":
     success, message = create_isolation_forest_model() 
     if success:
         print("Insolation Forest Model creation completed successfully")
+        create_window_model()
+        print("Window feature model creation completed successfully")
     else:
         print(f"Model creation failed: {message}")
 
@@ -0,0 +1,263 @@
+import io
+import os
+import json
+import time
+import logging
+import argparse
+import threading
+import pandas as pd
+from io import StringIO
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# Set up Logging
+logger = logging.getLogger(__name__)
+
+PARQUET_AVAILABLE = pq is not None
+MANIFEST_NAME = "_manifest.json"
+
+class S3RangeFile(io.RawIOBase):
+    """Seekable read-only file over an S3 object, every read is a ranged GET
+
+    Lets pyarrow read a Parquet footer and then only the column chunks it needs instead of
+    downloading the whole object.
+    """
+
+    def __init__(self, s3_client, bucket, key, size=None):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.size = size if size is not None else s3_client.head_object(Bucket=bucket, Key=key)["ContentLength"]
+        self.position = 0
+        self.requests = 0
+        self.bytes_read = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.position = offset
+        elif whence == io.SEEK_CUR:
+            self.position += offset
+        else:
+            self.position = self.size + offset
+        return self.position
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.size - self.position
+        end = min(self.position + size, self.size)
+        if end <= self.position:
+            return b""
+        response = self.s3_client.get_object(Bucket=self.bucket, Key=self.key, Range=f"bytes={self.position}-{end - 1}")
+        data = response["Body"].read()
+        self.requests += 1
+        self.bytes_read += len(data)
+        self.position += len(data)
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+def _naive(timestamp):
+    """Timestamps are stored as naive UTC so they compare with the naive datetimes used elsewhere"""
+    if timestamp is None:
+        return None
+    timestamp = pd.Timestamp(timestamp)
+    return timestamp.tz_convert(None) if timestamp.tzinfo is not None else timestamp
+
+def _column_stats(frame):
+    """Min and max of every numeric or timestamp column, as JSON friendly values"""
+    low, high = {}, {}
+    for column in frame.columns:
+        series = frame[column]
+        if pd.api.types.is_datetime64_any_dtype(series):
+            if series.notna().any():
+                low[column], high[column] = series.min().isoformat(), series.max().isoformat()
+        elif pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+            if series.notna().any():
+                low[column], high[column] = float(series.min()), float(series.max())
+    return low, high
+
+class ParquetArchive:
+    """Long term readings stored as one Parquet file per day under s3://bucket/prefix/
+
+    Files are laid out as prefix/date=YYYY-MM-DD/part-0.parquet with a manifest listing every
+    partition with its row count and per-column min/max, so a reader picks the partitions for
+    a time range from a single small object and then range-reads only the columns it needs.
+    """
+
+    def __init__(self, s3_client, bucket, prefix, manifest_ttl=60, row_group_size=50000, clock=time.monotonic):
+        if not PARQUET_AVAILABLE:
+            raise RuntimeError("pyarrow is required for the Parquet archive")
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.manifest_ttl = manifest_ttl
+        self.row_group_size = row_group_size
+        self.clock = clock
+        self._manifest = None
+        self._manifest_loaded_at = None
+        self._lock = threading.Lock()
+
+    def partition_key(self, day):
+        return f"{self.prefix}/date={day:%Y-%m-%d}/part-0.parquet"
+
+    @property
+    def manifest_key(self):
+        return f"{self.prefix}/{MANIFEST_NAME}"
+
+    def manifest(self, refresh=False):
+        """Partition list, {"partitions": {date: {"key", "rows", "min", "max"}}}, None if there is no archive"""
+        with self._lock:
+            if not refresh and self._manifest_loaded_at is not None and self.clock() - self._manifest_loaded_at < self.manifest_ttl:
+                return self._manifest
+            try:
+                response = self.s3_client.get_object(Bucket=self.bucket, Key=self.manifest_key)
+                self._manifest = json.loads(response["Body"].read().decode("utf-8"))
+            except Exception as e:
+                # Usually NoSuchKey, the data has not been converted to Parquet yet
+                logger.debug(f"No Parquet manifest at s3://{self.bucket}/{self.manifest_key}: {str(e)}")
+                self._manifest = None
+            self._manifest_loaded_at = self.clock()
+            return self._manifest
+
+    def exists(self):
+        return bool(self.manifest())
+
+    def write(self, frame):
+        """Merge readings into their daily partitions, newer rows win on duplicate timestamps"""
+        frame = frame.copy()
+        frame["timestamp"] = pd.to_datetime(frame["timestamp"], errors="coerce", utc=True).dt.tz_convert(None)
+        frame = frame.dropna(subset=["timestamp"])
+        if frame.empty:
+            return 0
+
+        manifest = self.manifest(refresh=True) or {"partitions": {}}
+        written = 0
+        for day, rows in frame.groupby(frame["timestamp"].dt.normalize()):
+            date = f"{day:%Y-%m-%d}"
+            key = self.partition_key(day)
+            if date in manifest["partitions"]:
+                existing = self._read_partition(key)
+                rows = pd.concat([existing, rows], ignore_index=True)
+            rows = rows.drop_duplicates(subset=["timestamp"], keep="last").sort_values("timestamp").reset_index(drop=True)
+
+            buffer = io.BytesIO()
+            pq.write_table(pa.Table.from_pandas(rows, preserve_index=False), buffer, row_group_size=self.row_group_size, compression="snappy")
+            self.s3_client.put_object(Bucket=self.bucket, Key=key, Body=buffer.getvalue(), ContentType="application/octet-stream")
+
+            low, high = _column_stats(rows)
+            manifest["partitions"][date] = {"key": key, "rows": len(rows), "size": buffer.tell(), "min": low, "max": high}
+            written += 1
+
+        manifest["updated"] = pd.Timestamp.now('UTC').isoformat()
+        self.s3_client.put_object(Bucket=self.bucket, Key=self.manifest_key, Body=json.dumps(manifest, sort_keys=True), ContentType="application/json")
+        with self._lock:
+            self._manifest = manifest
+            self._manifest_loaded_at = self.clock()
+        return written
+
+    def partitions_for(self, start=None, end=None):
+        """Manifest entries whose timestamp range overlaps [start, end], oldest first"""
+        manifest = self.manifest() or {"partitions": {}}
+        start, end = _naive(start), _naive(end)
+        selected = []
+        for date in sorted(manifest["partitions"]):
+            entry = manifest["partitions"][date]
+            low = pd.Timestamp(entry["min"].get("timestamp", date))
+            high = pd.Timestamp(entry["max"].get("timestamp", date))
+            if (start is None or high >= start) and (end is None or low <= end):
+                selected.append(entry)
+        return selected
+
+    def read(self, start=None, end=None, columns=None):
+        """Readings between start and end, only reading the partitions and columns needed"""
+        wanted = None if columns is None else list(dict.fromkeys(["timestamp"] + list(columns)))
+        start, end = _naive(start), _naive(end)
+        frames = [self._read_partition(entry["key"], wanted, start, end, entry.get("size")) for entry in self.partitions_for(start, end)]
+        frames = [frame for frame in frames if not frame.empty]
+        if not frames:
+            return pd.DataFrame(columns=wanted or ["timestamp"])
+        return pd.concat(frames, ignore_index=True)
+
+    def tail(self, rows, columns=None):
+        """The newest rows, reading partitions from the most recent backwards until there are enough"""
+        wanted = None if columns is None else list(dict.fromkeys(["timestamp"] + list(columns)))
+        frames = []
+        collected = 0
+        for entry in reversed(self.partitions_for()):
+            frame = self._read_partition(entry["key"], wanted, size=entry.get("size"))
+            frames.insert(0, frame)
+            collected += len(frame)
+            if collected >= rows:
+                break
+        if not frames:
+            return pd.DataFrame(columns=wanted or ["timestamp"])
+        return pd.concat(frames, ignore_index=True).tail(rows).reset_index(drop=True)
+
+    def _read_partition(self, key, columns=None, start=None, end=None, size=None):
+        source = S3RangeFile(self.s3_client, self.bucket, key, size=size)
+        parquet_file = pq.ParquetFile(source)
+        if columns is not None:
+            columns = [column for column in columns if column in parquet_file.schema_arrow.names]
+
+        # Skip row groups whose timestamp statistics fall outside the range
+        timestamp_index = parquet_file.schema_arrow.get_field_index("timestamp")
+        row_groups = []
+        for index in range(parquet_file.metadata.num_row_groups):
+            stats = parquet_file.metadata.row_group(index).column(timestamp_index).statistics if timestamp_index >= 0 else None
+            if stats is not None and stats.has_min_max:
+                if (start is not None and pd.Timestamp(stats.max) < start) or (end is not None and pd.Timestamp(stats.min) > end):
+                    continue
+            row_groups.append(index)
+        if not row_groups:
+            return pd.DataFrame(columns=columns or parquet_file.schema_arrow.names)
+
+        frame = parquet_file.read_row_groups(row_groups, columns=columns).to_pandas()
+        if start is not None:
+            frame = frame[frame["timestamp"] >= start]
+        if end is not None:
+            frame = frame[frame["timestamp"] <= end]
+        return frame.reset_index(drop=True)
+
+def convert_csv(s3_client, bucket, csv_key, prefix, chunk_size=200000):
+    """Convert an existing long term CSV into the partitioned Parquet archive"""
+    archive = ParquetArchive(s3_client, bucket, prefix)
+    response = s3_client.get_object(Bucket=bucket, Key=csv_key)
+    content = response["Body"].read().decode("utf-8")
+    partitions = 0
+    rows = 0
+    for chunk in pd.read_csv(StringIO(content), chunksize=chunk_size):
+        if "timestamp" not in chunk.columns:
+            raise ValueError(f"{csv_key} has no timestamp column")
+        partitions += archive.write(chunk)
+        rows += len(chunk)
+    return {"rows": rows, "partitions_written": partitions, "partitions": len(archive.manifest(refresh=True)["partitions"])}
+
+if __name__ == "__main__":
+    import boto3
+
+    parser = argparse.ArgumentParser(description="Convert long term CSVs in S3 into a date partitioned Parquet archive")
+    parser.add_argument("--bucket", required=True, help="Bucket holding the CSV, the archive is written to the same bucket")
+    parser.add_argument("--csv", required=True, help="Key of the CSV to convert")
+    parser.add_argument("--prefix", required=True, help="Key prefix for the Parquet archive, e.g. archive/sensehat")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    result = convert_csv(boto3.client("s3", region_name=os.getenv("AWS_REGION", "eu-west-1")), args.bucket, args.csv, args.prefix)
+    print(f"Converted {result['rows']} rows into {result['partitions']} partitions under s3://{args.bucket}/{args.prefix}/")
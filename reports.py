@@ -10,6 +10,11 @@ from flask import jsonify, request, Blueprint
 from pymongo import MongoClient
 from botocore.exceptions import ClientError
 from boto3.dynamodb.conditions import Key
+from s3_cache import S3CsvCache, DEFAULT_CACHE_DIR
+from parquet_archive import ParquetArchive, PARQUET_AVAILABLE
+from dynamo_reader import query_items_parallel
+from alert_index import find_alerts
+from rollups import summarise_buckets
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -17,6 +22,19 @@ logger = logging.getLogger(__name__)
 s3_client = boto3.client('s3', region_name='eu-west-1')
 ses_client = boto3.client('ses', region_name='eu-west-1')
 dynamodb = boto3.resource('dynamodb', region_name='eu-west-1')
+# Long term CSVs are only downloaded again when their ETag changes
+s3_csv_cache = S3CsvCache(
+    s3_client,
+    cache_dir=os.getenv("S3_CACHE_DIR", DEFAULT_CACHE_DIR),
+    ttl=int(os.getenv("S3_CACHE_TTL", 300))
+)
+# Date partitioned Parquet copies of the long term CSVs, used instead of the CSVs once converted
+if PARQUET_AVAILABLE:
+    sensehat_archive = ParquetArchive(s3_client, os.getenv("SENSEHAT_DATA_BUCKET", "sensehat-longterm-storage"), os.getenv("SENSEHAT_ARCHIVE_PREFIX", "archive/sensehat"))
+    waterflow_archive = ParquetArchive(s3_client, os.getenv("WATERFLOW_DATA_BUCKET", "waterflow-longterm-storage"), os.getenv("WATERFLOW_ARCHIVE_PREFIX", "archive/waterflow"))
+else:
+    sensehat_archive = None
+    waterflow_archive = None
 
 # Load environment variables
 try:
@@ -32,6 +50,10 @@ ALERT_TABLE = os.getenv("ALERT_TABLE","Alerts")
 REPORT_BUCKET = os.getenv("REPORT_BUCKET", "reports-ecodetect")
 SES_EMAIL_SENDER = os.getenv("SES_EMAIL_SENDER")
 THING_NAME = os.getenv("THING_NAME2", "Main_Pi")
+# Report ranges are read from DynamoDB as this many time slices in parallel
+DYNAMO_QUERY_SEGMENTS = int(os.getenv("DYNAMO_QUERY_SEGMENTS", 4))
+DYNAMO_PAGE_SIZE = int(os.getenv("DYNAMO_PAGE_SIZE", 1000))
+SENSOR_FIELDS = ['temperature', 'humidity', 'pressure']
 
 # Create DynamoDB table references
 sensor_table = dynamodb.Table(SENSEHAT_TABLE)
@@ -41,6 +63,11 @@ alert_table = dynamodb.Table(ALERT_TABLE)
 # Create Flask Blueprint
 report_routes = Blueprint('reports', __name__)
 
+# Rollup store set by the backend, long reports for a room take their summary statistics from it
+rollup_store = None
+ROLLUP_REPORT_MIN_DAYS = int(os.getenv("ROLLUP_REPORT_MIN_DAYS", 7))
+ROLLUP_METRICS = {"temperature": "temperature", "humidity": "humidity", "pressure": "pressure", "water_usage": "flow_rate"}
+
 # Inspiration for report generation integration: https://vonkunesnewton.medium.com/generating-pdfs-with-reportlab-ced3b04aedef
 # Inspiration for report generation integration: https://pythonassets.com/posts/create-pdf-documents-in-python-with-reportlab/
 def validate_report_parameters(params):
@@ -97,26 +124,15 @@ def get_date_range(time_range, custom_start=None, custom_end=None):
 def fetch_sensor_data(start_date, end_date, data_types):
     """Fetch sensor data from DynamoDB for the specified period"""
     try:
-        # Convert datetime to string format for DynamoDB query
-        start_timestamp = start_date.isoformat()
-        end_timestamp = end_date.isoformat()
-        
-        # Query DynamoDB for sensor data 
-        response = sensor_table.query(
-            KeyConditionExpression=Key('device_id').eq(THING_NAME) &
-                                    Key('timestamp').between(start_timestamp, end_timestamp),
-            ScanIndexForward=True # ascneding order
+        fields = [field for field in SENSOR_FIELDS if 'all' in data_types or field in data_types]
+        # Every page up to the end of the range, only the requested fields come back
+        items = query_items_parallel(
+            sensor_table, 'device_id', THING_NAME, start_date, end_date,
+            segments=DYNAMO_QUERY_SEGMENTS,
+            attributes=['timestamp'] + fields + [f"payload.{field}" for field in fields],
+            page_size=DYNAMO_PAGE_SIZE
         )
-        
-        logger.debug(f"DynamodDB sensor data response: {response}")
-        
-        items = response.get('Items', [])
-        
-        if not items:
-            logger.warning(f"No sensor data found in DynamoDB for period {start_date} to {end_date}")
-            # Fallback to S3 data
-            return fetch_sensor_data_from_s3(start_date, end_date, data_types)
-        
+
         # Process items based on requested data types
         processed_items = []
         for item in items:
@@ -124,32 +140,23 @@ def fetch_sensor_data(start_date, end_date, data_types):
                 processed_item = {
                     'timestamp': item.get('timestamp')
                 }
-                # Safe extract sensor data using get() 
-                payload = item.get('payload', {})
-                # Include requested fields
-                if 'all' in data_types or 'temperature' in data_types:
-                    if isinstance(payload, dict):
-                        processed_item['temperature'] = float(payload.get('temperature', 0))
-                    else:
-                        # Handle case where the payload might be string
-                        processed_item['temperature'] = float(item.get('temperature', 0))
-                        
-                if 'all' in data_types or 'humidity' in data_types:
-                    if isinstance(payload, dict):
-                        processed_item['humidity'] = float(payload.get('humidity', 0))
-                    else:
-                        processed_item['humidity'] = float(item.get('humidity', 0))
-                        
-                if 'all' in data_types or 'pressure' in data_types:
-                    if isinstance(payload, dict):
-                        processed_item['pressure'] = float(payload.get('pressure', 0))
+                # Safe extract sensor data using get(), older items have the values outside the payload
+                payload = item.get('payload')
+                for field in fields:
+                    if isinstance(payload, dict) and field in payload:
+                        processed_item[field] = float(payload.get(field, 0))
                     else:
-                        processed_item['pressure'] = float(item.get('pressure', 0))
-                        
+                        processed_item[field] = float(item.get(field, 0))
+
                 processed_items.append(processed_item)
                 
             except (TypeError, ValueError) as e:
                 logger.error(f"Error processing sensor data item: {e}")
+
+        if not processed_items:
+            logger.warning(f"No sensor data found in DynamoDB for period {start_date} to {end_date}")
+            # Fallback to S3 data
+            return fetch_sensor_data_from_s3(start_date, end_date, data_types)
         
         logger.debug(f"processed sensor items: {processed_items}")
         return processed_items
@@ -165,13 +172,12 @@ def fetch_sensor_data_from_s3(start_date, end_date, data_types):
         s3_bucket = os.getenv("SENSEHAT_DATA_BUCKET", "sensehat-longterm-storage")
         s3_key = os.getenv("SENSEHAT_DATA_KEY", "carbon_footprint_training_sensehat.csv")
         
-        response = s3_client.get_object(
-            Bucket=s3_bucket,
-            Key=s3_key
-        )
-        
-        content = response['Body'].read().decode('utf-8')
-        df = pd.read_csv(StringIO(content))
+        if sensehat_archive is not None and sensehat_archive.exists():
+            # Only the partitions in range and the requested columns are read
+            columns = [c for c in ("temperature", "humidity", "pressure") if 'all' in data_types or c in data_types]
+            df = sensehat_archive.read(start_date, end_date, columns)
+        else:
+            df = s3_csv_cache.get_frame(s3_bucket, s3_key)
         
         # Convert timestamp strings to datetime objects
         df['timestamp'] = pd.to_datetime(df['timestamp'])
@@ -214,13 +220,10 @@ def fetch_water_data(start_date,end_date):
         s3_bucket = os.getenv("WATERFLOW_DATA_BUCKET", "waterflow-longterm-storage")
         s3_key = os.getenv("WATERFLOW_DATA_KEY", "carbon_footprint_training_waterflow.csv")
         
-        response = s3_client.get_object(
-            Bucket=s3_bucket,
-            Key=s3_key
-        )
-        
-        content = response['Body'].read().decode('utf-8')
-        df = pd.read_csv(StringIO(content))
+        if waterflow_archive is not None and waterflow_archive.exists():
+            df = waterflow_archive.read(start_date, end_date, ["flow_rate"])
+        else:
+            df = s3_csv_cache.get_frame(s3_bucket, s3_key)
         
         # Validate timestamp column
         if 'timestamp' not in df.columns:
@@ -258,22 +261,22 @@ def fetch_water_data(start_date,end_date):
 def fetch_alerts(start_date, end_date):
     """Fetch alerts for DynamoDB for date range"""
     try:
-        # Convert date time to string format for scan filter
-        start_timestamp = start_date.isoformat()
-        end_timestamp = end_date.isoformat()
-        
-        # Scan the alerts table (since alerts could not have a consistent key structure)
-        response = alert_table.scan(
-            FilterExpression=Key('timestamp').between(start_timestamp, end_timestamp)
-        )        
+        # Range queries on the alert indexes, following the cursor until the period is covered
+        items = []
+        cursor = None
+        while True:
+            page, cursor = find_alerts(alert_table, start_date, end_date, limit=500, cursor=cursor)
+            items.extend(page)
+            if not cursor:
+                break
         
-        if not response.get('Items', []):
+        if not items:
             logger.warning(f"No alerts found in DynamoDB for period {start_date} to {end_date}")
             return []
         
         # Process alerts
         processed_alerts = []
-        for item in response.get('Items', []):
+        for item in items:
             processed_alerts.append({
                 'date': item.get('timestamp'),
                 'type': item.get('severity', 'info'),
@@ -285,8 +288,30 @@ def fetch_alerts(start_date, end_date):
         logger.error(f"Error fetching alers from DynamoDB: {str(e)}")
         return []
     
-def calculate_statistics(data, field):
-    """Calculate basic statistics for a specific field"""
+def set_rollup_store(store):
+    """Lets long range room reports read statistics from the rollup collections"""
+    global rollup_store
+    rollup_store = store
+
+def room_rollups(data_type, start_date, end_date, room_id):
+    """Hourly rollup buckets of one room for a long report range, None when they do not cover it"""
+    if not room_id or rollup_store is None or (end_date - start_date).days < ROLLUP_REPORT_MIN_DAYS:
+        return None
+    metric = ROLLUP_METRICS[data_type]
+    try:
+        if not rollup_store.covers(metric, start_date, room_id=room_id):
+            return None
+        return rollup_store.read(metric, start_date, end_date, room_id=room_id, resolution="1h") or None
+    except Exception as e:
+        logger.warning(f"Falling back to raw data for {data_type} statistics: {str(e)}")
+        return None
+
+def calculate_statistics(data, field, rollups=None):
+    """Calculate basic statistics for a specific field, or from rollup buckets when given"""
+    if rollups is not None:
+        stats = summarise_buckets(rollups)
+        return {"min": stats["min"], "max": stats["max"], "avg": stats["avg"], "count": stats["count"]}
+
     if not data:
         return {
             "min": None,
@@ -375,8 +400,11 @@ def find_anomalies(data, field, threshold=2.0):
         logger.error(f"Error calculating anomalies: {str(e)}")
         return []
 
-def generate_report_data(user_id, data_types, start_date, end_date):
-    """Generate the report data structure"""
+def generate_report_data(user_id, data_types, start_date, end_date, room_id=None):
+    """Generate the report data structure
+
+    With a room_id, long ranges take the summary statistics of that room from the rollups.
+    """
     try:
         # Fetch required data
         sensor_data = fetch_sensor_data(start_date, end_date, data_types)
@@ -418,7 +446,10 @@ def generate_report_data(user_id, data_types, start_date, end_date):
             else:
                 continue
             
-            stats = calculate_statistics(data_source, data_type)
+            rollups = room_rollups(data_type, start_date, end_date, room_id)
+            stats = calculate_statistics(data_source, data_type, rollups=rollups)
+            if rollups is not None:
+                stats.update({"source": "rollups", "room_id": room_id})
             if stats and stats['count'] > 0:
                 report["summary"][data_type] = stats
             
@@ -610,7 +641,7 @@ def preview_reports():
         
         try:
             # Generate report data (user_id is amock for the preview)
-            report_data, _ = generate_report_data("preview_user", data_types, start_date, end_date)
+            report_data, _ = generate_report_data("preview_user", data_types, start_date, end_date, room_id=params.get('room_id'))
 
             
             # Check if any data is available
@@ -676,7 +707,7 @@ def generate_report():
         user_id = "user123"
         
         try:
-            report_data, report_id = generate_report_data(user_id, data_types, start_date, end_date)
+            report_data, report_id = generate_report_data(user_id, data_types, start_date, end_date, room_id=params.get('room_id'))
         except ValueError as ve:
             logger.warning(f"Report generation error: {str(ve)}")
             return jsonify({
@@ -0,0 +1,259 @@
+import os
+import math
+import logging
+import argparse
+from datetime import datetime, timedelta
+from pymongo import UpdateOne
+
+# Set up Logging
+logger = logging.getLogger(__name__)
+
+# Rollup resolutions from finest to coarsest, as (name, seconds)
+RESOLUTIONS = (("1m", 60), ("1h", 3600), ("1d", 86400))
+SENSOR_METRICS = ("temperature", "humidity", "pressure")
+WATER_METRICS = ("flow_rate",)
+# How many more buckets than requested read() may fetch before merging them down
+MERGE_OVERSAMPLE = 4
+
+def bucket_start(timestamp, seconds):
+    """Floor a timestamp to the start of its bucket"""
+    epoch = timestamp.replace(tzinfo=None) - datetime(1970, 1, 1)
+    return datetime(1970, 1, 1) + timedelta(seconds=int(epoch.total_seconds() // seconds * seconds))
+
+def summarise_buckets(buckets):
+    """Combine rollup buckets into min, max, avg, std and count"""
+    buckets = [b for b in buckets if b.get("count")]
+    if not buckets:
+        return {"min": None, "max": None, "avg": None, "std": None, "count": 0}
+    count = sum(b["count"] for b in buckets)
+    total = sum(b["sum"] for b in buckets)
+    sumsq = sum(b["sumsq"] for b in buckets)
+    mean = total / count
+    return {
+        "min": min(b["min"] for b in buckets),
+        "max": max(b["max"] for b in buckets),
+        "avg": mean,
+        "std": math.sqrt(max(sumsq / count - mean * mean, 0.0)),
+        "count": count
+    }
+
+def merge_buckets(buckets, start, end, max_points):
+    """Combine consecutive buckets into max_points equal slices of [start, end], exact for the stored sums"""
+    width = (end - start).total_seconds() / max_points
+    merged = {}
+    for bucket in buckets:
+        index = min(int((bucket["bucket_start"] - start).total_seconds() // width), max_points - 1)
+        current = merged.get(index)
+        if current is None:
+            merged[index] = dict(bucket)
+        else:
+            current["count"] += bucket["count"]
+            current["sum"] += bucket["sum"]
+            current["sumsq"] += bucket["sumsq"]
+            current["min"] = min(current["min"], bucket["min"])
+            current["max"] = max(current["max"], bucket["max"])
+    return [merged[index] for index in sorted(merged)]
+
+class RollupStore:
+    """Pre-aggregated min/max/count/sum/sum-of-squares per room and metric at 1 minute, 1 hour and 1 day
+
+    Documents are keyed by room, metric, resolution and bucket start, so each incoming reading
+    becomes an $inc/$min/$max upsert on three documents. Readers pick the finest resolution that
+    keeps a range within a few times max_points buckets and merge those down to max_points.
+    """
+
+    def __init__(self, collection, resolutions=RESOLUTIONS):
+        self.collection = collection
+        self.resolutions = resolutions
+
+    @staticmethod
+    def _bucket_id(room_id, metric, resolution, start):
+        return f"{room_id}|{metric}|{resolution}|{start.isoformat()}"
+
+    def ensure_indexes(self):
+        """Index used by read() to range scan one room, metric and resolution"""
+        self.collection.create_index([("metric", 1), ("resolution", 1), ("bucket_start", 1), ("room_id", 1)])
+
+    def update_from_documents(self, documents, metrics=SENSOR_METRICS):
+        """Fold newly stored readings into the rollups with a single bulk write"""
+        buckets = {}
+        for document in documents:
+            timestamp = document.get("timestamp")
+            if not isinstance(timestamp, datetime):
+                continue
+            room_id = document.get("room_id") or "unknown"
+            for metric in metrics:
+                value = document.get(metric)
+                if isinstance(value, bool) or not isinstance(value, (int, float)) or math.isnan(value):
+                    continue
+                for resolution, seconds in self.resolutions:
+                    key = (room_id, metric, resolution, bucket_start(timestamp, seconds))
+                    bucket = buckets.get(key)
+                    if bucket is None:
+                        buckets[key] = [1, value, value * value, value, value]
+                    else:
+                        bucket[0] += 1
+                        bucket[1] += value
+                        bucket[2] += value * value
+                        bucket[3] = min(bucket[3], value)
+                        bucket[4] = max(bucket[4], value)
+
+        if not buckets:
+            return 0
+        operations = [
+            UpdateOne(
+                {"_id": self._bucket_id(room_id, metric, resolution, start)},
+                {
+                    "$inc": {"count": count, "sum": total, "sumsq": sumsq},
+                    "$min": {"min": low},
+                    "$max": {"max": high},
+                    "$setOnInsert": {"room_id": room_id, "metric": metric, "resolution": resolution, "bucket_start": start}
+                },
+                upsert=True
+            )
+            for (room_id, metric, resolution, start), (count, total, sumsq, low, high) in buckets.items()
+        ]
+        self.collection.bulk_write(operations, ordered=False)
+        return len(operations)
+
+    def compact(self, source, start, end, metrics=SENSOR_METRICS):
+        """Rebuild rollups for a time range from raw readings, replacing what is there
+
+        Used to backfill history that was ingested before rollups existed, or to repair a range.
+        """
+        replaced = 0
+        for metric in metrics:
+            for resolution, seconds in self.resolutions:
+                aligned_start = bucket_start(start, seconds)
+                pipeline = [
+                    {"$match": {metric: {"$type": "number"}, "timestamp": {"$gte": aligned_start, "$lt": end}}},
+                    {"$group": {
+                        "_id": {
+                            "room_id": {"$ifNull": ["$room_id", "unknown"]},
+                            "bucket": {"$floor": {"$divide": [{"$subtract": ["$timestamp", aligned_start]}, seconds * 1000]}}
+                        },
+                        "count": {"$sum": 1},
+                        "sum": {"$sum": f"${metric}"},
+                        "sumsq": {"$sum": {"$multiply": [f"${metric}", f"${metric}"]}},
+                        "min": {"$min": f"${metric}"},
+                        "max": {"$max": f"${metric}"}
+                    }}
+                ]
+                operations = []
+                for row in source.aggregate(pipeline, allowDiskUse=True):
+                    start_of_bucket = aligned_start + timedelta(seconds=int(row["_id"]["bucket"]) * seconds)
+                    room_id = row["_id"]["room_id"]
+                    operations.append(UpdateOne(
+                        {"_id": self._bucket_id(room_id, metric, resolution, start_of_bucket)},
+                        {"$set": {
+                            "room_id": room_id, "metric": metric, "resolution": resolution, "bucket_start": start_of_bucket,
+                            "count": row["count"], "sum": row["sum"], "sumsq": row["sumsq"], "min": row["min"], "max": row["max"]
+                        }},
+                        upsert=True
+                    ))
+                if operations:
+                    self.collection.bulk_write(operations, ordered=False)
+                    replaced += len(operations)
+        return replaced
+
+    def earliest(self, metric, resolution="1m", room_id=None):
+        """Start of the oldest bucket of a metric, None when there are no rollups for it yet"""
+        query = {"metric": metric, "resolution": resolution}
+        if room_id is not None:
+            query["room_id"] = room_id
+        bucket = self.collection.find_one(query, {"_id": 0, "bucket_start": 1}, sort=[("bucket_start", 1)])
+        return bucket["bucket_start"] if bucket else None
+
+    def covers(self, metric, start, raw_collection=None, room_id=None):
+        """Whether the rollups hold every reading of a metric from start onwards
+
+        Rollups only go back to when ingest started updating them, or as far as the compactor has
+        rebuilt them. When they start later than the range, raw_collection is checked for readings
+        in the gap, without it the range is treated as not covered.
+        """
+        earliest = self.earliest(metric, room_id=room_id)
+        if earliest is None:
+            return False
+        if earliest <= start:
+            return True
+        if raw_collection is None:
+            return False
+        query = {metric: {"$exists": True}, "timestamp": {"$gte": start, "$lt": earliest}}
+        if room_id is not None:
+            query["room_id"] = room_id
+        return raw_collection.find_one(query, {"_id": 1}) is None
+
+    def choose_resolution(self, start, end, max_points=500, oversample=MERGE_OVERSAMPLE):
+        """Finest resolution that keeps the range within max_points * oversample buckets
+
+        read() merges the buckets of that resolution down to max_points, so a range that falls
+        between two resolutions (7 days at 100 points) is not answered with a handful of daily buckets.
+        """
+        span = (end - start).total_seconds()
+        for resolution, seconds in self.resolutions:
+            if span / seconds <= max_points * oversample:
+                return resolution, seconds
+        return self.resolutions[-1]
+
+    def read(self, metric, start, end, room_id=None, resolution=None, max_points=500):
+        """Rollup buckets for a metric over a range, merged across rooms unless room_id is given
+
+        Without a resolution the buckets are also merged in time to at most max_points.
+        """
+        merge = resolution is None
+        if resolution is None:
+            resolution, seconds = self.choose_resolution(start, end, max_points)
+        else:
+            seconds = dict(self.resolutions)[resolution]
+
+        query = {"metric": metric, "resolution": resolution, "bucket_start": {"$gte": bucket_start(start, seconds), "$lte": end}}
+        if room_id is not None:
+            query["room_id"] = room_id
+
+        merged = {}
+        for bucket in self.collection.find(query, {"_id": 0}).sort("bucket_start", 1):
+            current = merged.get(bucket["bucket_start"])
+            if current is None:
+                merged[bucket["bucket_start"]] = {k: bucket[k] for k in ("bucket_start", "count", "sum", "sumsq", "min", "max")}
+            else:
+                current["count"] += bucket["count"]
+                current["sum"] += bucket["sum"]
+                current["sumsq"] += bucket["sumsq"]
+                current["min"] = min(current["min"], bucket["min"])
+                current["max"] = max(current["max"], bucket["max"])
+
+        buckets = sorted(merged.values(), key=lambda b: b["bucket_start"])
+        if merge and len(buckets) > max_points:
+            buckets = merge_buckets(buckets, bucket_start(start, seconds), end, max_points)
+        for bucket in buckets:
+            bucket["mean"] = bucket["sum"] / bucket["count"] if bucket["count"] else None
+            bucket["resolution"] = resolution
+        return buckets
+
+    def read_series(self, start, end, metrics=None, resolution="1h"):
+        """Bucket means for every room and metric over a range, as long format rows"""
+        seconds = dict(self.resolutions)[resolution]
+        query = {"resolution": resolution, "bucket_start": {"$gte": bucket_start(start, seconds), "$lte": end}}
+        if metrics:
+            query["metric"] = {"$in": list(metrics)}
+        projection = {"_id": 0, "room_id": 1, "metric": 1, "bucket_start": 1, "count": 1, "sum": 1}
+        return [
+            {"room_id": bucket.get("room_id", "unknown"), "metric": bucket["metric"], "timestamp": bucket["bucket_start"], "value": bucket["sum"] / bucket["count"]}
+            for bucket in self.collection.find(query, projection)
+            if bucket.get("count")
+        ]
+
+if __name__ == "__main__":
+    from pymongo import MongoClient
+
+    parser = argparse.ArgumentParser(description="Rebuild sensor rollups from raw readings")
+    parser.add_argument("--days", type=int, default=30, help="How many days back to compact")
+    args = parser.parse_args()
+
+    db = MongoClient(os.getenv("MONGO_URI")).ecodetect
+    store = RollupStore(db.sensor_rollups)
+    store.ensure_indexes()
+    end = datetime.now()
+    start = end - timedelta(days=args.days)
+    print(f"Sensor buckets written: {store.compact(db.sensor_data, start, end, SENSOR_METRICS)}")
+    print(f"Water buckets written: {store.compact(db.water_data, start, end, WATER_METRICS)}")
@@ -0,0 +1,155 @@
+import os
+import json
+import stat
+import time
+import hashlib
+import logging
+import threading
+import pandas as pd
+from io import StringIO
+
+# Set up Logging
+logger = logging.getLogger(__name__)
+
+# Per user, the shared temp directory would let other local users plant or swap cache files
+DEFAULT_CACHE_DIR = os.path.join(os.getenv("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"), "ecodetect-s3-cache")
+
+class S3CsvCache:
+    """Parsed S3 CSV files cached in memory and on disk, keyed by bucket, key and ETag
+
+    Within ttl seconds of the last check a cached frame is returned without calling S3. After
+    that a head_object call revalidates the ETag, and the object is only downloaded and parsed
+    again when it has changed. The downloaded CSV is also kept in cache_dir, next to a JSON file
+    with its ETag and checksum, so a restarted worker (or another worker) can skip the download
+    for an unchanged object. cache_dir must be private to this user or it is not used.
+    """
+
+    def __init__(self, s3_client, cache_dir=DEFAULT_CACHE_DIR, ttl=300, max_entries=32, clock=time.monotonic):
+        self.s3_client = s3_client
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self.stats = {"hits": 0, "revalidated": 0, "disk_loads": 0, "downloads": 0, "stale": 0}
+
+    def get_frame(self, bucket, key):
+        """DataFrame for s3://bucket/key, a copy so callers are free to modify it"""
+        with self._key_lock(bucket, key):
+            return self._get(bucket, key).copy()
+
+    def invalidate(self, bucket=None, key=None):
+        with self._lock:
+            if bucket is None:
+                self._entries.clear()
+            else:
+                self._entries.pop((bucket, key), None)
+
+    def _key_lock(self, bucket, key):
+        # One download per object at a time, concurrent requests wait for it instead of repeating it
+        with self._lock:
+            return self._key_locks.setdefault((bucket, key), threading.Lock())
+
+    def _get(self, bucket, key):
+        now = self.clock()
+        entry = self._entries.get((bucket, key))
+        if entry is not None and now - entry["checked_at"] < self.ttl:
+            self.stats["hits"] += 1
+            return entry["frame"]
+
+        try:
+            etag = self.s3_client.head_object(Bucket=bucket, Key=key)["ETag"].strip('"')
+        except Exception as e:
+            if entry is not None:
+                # S3 unreachable, better to answer from the last known copy
+                logger.warning(f"Could not revalidate s3://{bucket}/{key}, using cached copy: {str(e)}")
+                self.stats["stale"] += 1
+                return entry["frame"]
+            raise
+
+        if entry is not None and entry["etag"] == etag:
+            entry["checked_at"] = now
+            self.stats["revalidated"] += 1
+            return entry["frame"]
+
+        frame = self._load_from_disk(bucket, key, etag)
+        if frame is None:
+            frame, etag, content = self._download(bucket, key)
+            self._save_to_disk(bucket, key, etag, content)
+        self._store(bucket, key, etag, frame, now)
+        return frame
+
+    def _download(self, bucket, key):
+        response = self.s3_client.get_object(Bucket=bucket, Key=key)
+        content = response['Body'].read().decode('utf-8')
+        self.stats["downloads"] += 1
+        # The ETag of what was actually downloaded, in case the object changed since head_object
+        return pd.read_csv(StringIO(content)), response.get("ETag", "").strip('"'), content
+
+    def _store(self, bucket, key, etag, frame, now):
+        with self._lock:
+            self._entries[(bucket, key)] = {"etag": etag, "frame": frame, "checked_at": now}
+            while len(self._entries) > self.max_entries:
+                oldest = min(self._entries, key=lambda k: self._entries[k]["checked_at"])
+                del self._entries[oldest]
+
+    def _private_cache_dir(self):
+        """cache_dir created with mode 0700, or None when it is shared or owned by someone else"""
+        if not self.cache_dir:
+            return None
+        try:
+            os.makedirs(self.cache_dir, mode=0o700, exist_ok=True)
+            info = os.stat(self.cache_dir)
+        except OSError as e:
+            logger.warning(f"S3 cache directory {self.cache_dir} unavailable: {str(e)}")
+            return None
+        if not stat.S_ISDIR(info.st_mode) or (hasattr(os, "getuid") and info.st_uid != os.getuid()) or info.st_mode & 0o077:
+            logger.warning(f"Not using S3 cache directory {self.cache_dir}, it must be owned by this user with mode 0700")
+            return None
+        return self.cache_dir
+
+    def _disk_paths(self, cache_dir, bucket, key):
+        name = hashlib.sha1(f"{bucket}/{key}".encode()).hexdigest()
+        return os.path.join(cache_dir, f"{name}.csv"), os.path.join(cache_dir, f"{name}.json")
+
+    def _load_from_disk(self, bucket, key, etag):
+        cache_dir = self._private_cache_dir()
+        if cache_dir is None:
+            return None
+        csv_path, meta_path = self._disk_paths(cache_dir, bucket, key)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if meta.get("etag") != etag:
+                return None
+            with open(csv_path, encoding="utf-8") as f:
+                content = f.read()
+            # Another worker may have replaced the CSV after this sidecar was read
+            if hashlib.sha256(content.encode()).hexdigest() != meta.get("sha256"):
+                return None
+            frame = pd.read_csv(StringIO(content))
+            self.stats["disk_loads"] += 1
+            return frame
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable S3 cache file {csv_path}: {str(e)}")
+            return None
+
+    def _save_to_disk(self, bucket, key, etag, content):
+        cache_dir = self._private_cache_dir()
+        if cache_dir is None or not etag:
+            return
+        csv_path, meta_path = self._disk_paths(cache_dir, bucket, key)
+        meta = {"bucket": bucket, "key": key, "etag": etag, "sha256": hashlib.sha256(content.encode()).hexdigest()}
+        try:
+            # Write then rename so other workers never read a half written file, the old version is replaced
+            for path, data in ((csv_path, content), (meta_path, json.dumps(meta))):
+                temp_path = f"{path}.{os.getpid()}.tmp"
+                with open(temp_path, "w", encoding="utf-8") as f:
+                    f.write(data)
+                os.replace(temp_path, path)
+        except Exception as e:
+            logger.warning(f"Could not write S3 cache file for s3://{bucket}/{key}: {str(e)}")
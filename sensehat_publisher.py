@@ -7,6 +7,7 @@ from AWSIoTPythonSDK.MQTTLib import AWSIoTMQTTClient
 import os
 import logging
 import statistics
+import cpu_calibration
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -64,13 +65,8 @@ ALPHA = 0.2 #Normalises factor for IMU data
 
 
 def get_cpu_temperature():
-    """Getting CPU temperature that compensates for SenseHAT heat"""
-    try:
-        with open("/sys/class/thermal/thermal_zone0/temp", "r") as f:
-            return float(f.read()) / 1000.0
-    except Exception as e:
-        logger.warning(f"Could not read CPU temperature: {e}")
-        return None
+    """Getting CPU temperature that compensates for SenseHAT heat, smoothed and sampled in the background"""
+    return cpu_calibration.get_cpu_temperature()
     
 def calibrate_temperature(raw_temp):
     """Apply dynamic temperature calibration based on CPU temperature"""
@@ -0,0 +1,112 @@
+import time
+import logging
+import threading
+from collections import deque
+
+# Set up Logging
+logger = logging.getLogger(__name__)
+
+class SenseHatSampler:
+    """Reads the SenseHat on its own thread at a fixed rate into a ring buffer
+
+    The I2C reads happen here and nowhere else, so API requests never touch the hardware. Every
+    persist_interval seconds the newest sample is handed to persist (store and threshold check),
+    which keeps the write volume independent of how often dashboards poll.
+    """
+
+    def __init__(self, read_sample, persist=None, sample_interval=1.0, persist_interval=10.0, buffer_size=600, clock=time.monotonic):
+        self.read_sample = read_sample
+        self.persist = persist
+        self.sample_interval = sample_interval
+        self.persist_interval = persist_interval
+        self.clock = clock
+        self._buffer = deque(maxlen=buffer_size)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._last_persist = None
+        self.samples_taken = 0
+        self.samples_persisted = 0
+        self.errors = 0
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="sensehat-sampler", daemon=True)
+            self._thread.start()
+        return self
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=max(self.sample_interval, 1) + 1)
+            self._thread = None
+
+    def sample_now(self, buffer=True):
+        """Take one sample immediately, added to the buffer unless buffer is False"""
+        sample = self.read_sample()
+        if not buffer:
+            return sample
+        with self._lock:
+            self._buffer.append((self.clock(), sample))
+            self.samples_taken += 1
+        return sample
+
+    def latest(self, max_age=None):
+        """Newest sample, or None when there is none (or it is older than max_age seconds)"""
+        with self._lock:
+            if not self._buffer:
+                return None
+            taken_at, sample = self._buffer[-1]
+        if max_age is not None and self.clock() - taken_at > max_age:
+            return None
+        return dict(sample)
+
+    def history(self, limit=None):
+        """Buffered samples, oldest first"""
+        with self._lock:
+            samples = [dict(sample) for _, sample in self._buffer]
+        return samples[-limit:] if limit else samples
+
+    def metrics(self):
+        with self._lock:
+            buffered = len(self._buffer)
+        return {
+            "running": self.running,
+            "sample_interval": self.sample_interval,
+            "persist_interval": self.persist_interval,
+            "buffered": buffered,
+            "samples_taken": self.samples_taken,
+            "samples_persisted": self.samples_persisted,
+            "errors": self.errors
+        }
+
+    def tick(self):
+        """One sampling step, persisting the sample when the persist interval has passed"""
+        sample = self.sample_now()
+        now = self.clock()
+        if self.persist is not None and (self._last_persist is None or now - self._last_persist >= self.persist_interval):
+            self._last_persist = now
+            self.persist(dict(sample))
+            self.samples_persisted += 1
+        return sample
+
+    def _run(self):
+        next_tick = self.clock()
+        while not self._stop.is_set():
+            try:
+                self.tick()
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"SenseHat sampling failed: {str(e)}")
+            # Fixed rate, a slow read shortens the wait rather than drifting the schedule
+            next_tick += self.sample_interval
+            delay = next_tick - self.clock()
+            if delay < 0:
+                next_tick = self.clock()
+                delay = 0
+            self._stop.wait(delay)
@@ -6,6 +6,7 @@ import logging
 import os
 import math
 from dotenv import load_dotenv
+import cpu_calibration
 
 logging.basicConfig(
     level=logging.INFO,
@@ -168,13 +169,8 @@ class SensorMonitor:
             return 0
 
     def get_cpu_temperature(self):
-        """Read CPU temperature for more accurate sensor readings"""
-        try:
-            with open("/sys/class/thermal/thermal_zone0/temp", "r") as temp_file:
-                return float(temp_file.read().strip()) / 1000.0
-        except Exception:
-            logging.warning("Could not read CPU temperature")
-            return None
+        """CPU temperature for more accurate sensor readings, from the shared background sampler"""
+        return cpu_calibration.get_cpu_temperature()
 
     def safely_round(self, value, decimals=2):
         """Safely round avalue that might be a string"""
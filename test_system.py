@@ -163,6 +163,404 @@ def test_high_load_performance(client, monkeypatch):
         assert len(failed_requests) == 0, "Some requests failed under load"
         assert statistics.mean(response_times) < 1000, "Average response time exceeds 1000ms under load"
 
+def test_batch_ingest_performance(client):
+    """Compare per reading cost of the single and batch upload endpoints"""
+    round_trip = 0.002 # Simulated MongoDB round trip in seconds
+    readings = [{"room_id": "bench_room", "device_id": "bench_pi", "temperature": 22.0 + i % 5, "humidity": 45.0, "pressure": 1010.0} for i in range(200)]
+
+    def insert_one(document):
+        time.sleep(round_trip)
+        document["_id"] = ObjectId()
+        return MagicMock(inserted_id=document["_id"])
+
+    def insert_many(documents, ordered=True):
+        time.sleep(round_trip)
+        for document in documents:
+            document["_id"] = ObjectId()
+        return MagicMock(inserted_ids=[d["_id"] for d in documents])
+
+    with patch('backend.alert_service._dispatch_alerts'):
+        with patch('backend.sensor_data_collection.insert_one', side_effect=insert_one):
+            with patch('backend.sensor_data_collection.insert_many', side_effect=insert_many):
+                start_time = time.time()
+                for reading in readings:
+                    response = client.post('/api/sensor-data-upload', json=reading)
+                    assert response.status_code == 200
+                single_time = (time.time() - start_time) * 1000 / len(readings)
+
+                start_time = time.time()
+                response = client.post('/api/sensor-data-upload/batch', json=readings)
+                assert response.status_code == 200
+                batch_time = (time.time() - start_time) * 1000 / len(readings)
+
+    print(f"\nIngest per reading: single {single_time:.3f}ms, batch {batch_time:.3f}ms")
+    assert batch_time < single_time, "Batch ingest should be cheaper per reading than single uploads"
+
+def test_threshold_engine_performance():
+    """Compare the vectorised threshold engine with a per reading loop"""
+    import numpy as np
+    from threshold_engine import ThresholdEngine, decode
+    thresholds = {"temperature_range": [20, 25], "humidity_range": [30, 60], "flow_rate_threshold": 10}
+
+    def per_reading(readings):
+        results = []
+        for data in readings:
+            exceeded = []
+            if data['temperature'] < thresholds['temperature_range'][0]:
+                exceeded.append('temperature_low')
+            elif data['temperature'] > thresholds['temperature_range'][1]:
+                exceeded.append('temperature_high')
+            if data['humidity'] < thresholds['humidity_range'][0]:
+                exceeded.append('humidity_low')
+            elif data['humidity'] > thresholds['humidity_range'][1]:
+                exceeded.append('humidity_high')
+            if data['flow_rate'] > thresholds['flow_rate_threshold']:
+                exceeded.append('water_usage_high')
+            results.append(exceeded)
+        return results
+
+    engine = ThresholdEngine(thresholds)
+    rng = np.random.default_rng(42)
+    print("\nThreshold evaluation:")
+    for size in (10_000, 100_000, 1_000_000):
+        temperature = rng.normal(22, 3, size)
+        humidity = rng.normal(45, 12, size)
+        flow_rate = rng.exponential(4, size)
+        readings = [{"temperature": t, "humidity": h, "flow_rate": f} for t, h, f in zip(temperature.tolist(), humidity.tolist(), flow_rate.tolist())]
+
+        start_time = time.perf_counter()
+        expected = per_reading(readings)
+        loop_time = (time.perf_counter() - start_time) * 1000
+
+        start_time = time.perf_counter()
+        masks = engine.evaluate(temperature=temperature, humidity=humidity, flow_rate=flow_rate)
+        vector_time = (time.perf_counter() - start_time) * 1000
+
+        if size == 10_000:
+            assert decode(masks) == expected
+        print(f"{size} readings: loop {loop_time:.1f}ms, vectorised {vector_time:.1f}ms")
+        assert vector_time < loop_time
+
+def test_historical_data_downsampling_performance(client, monkeypatch, live_mongo):
+    """Response time and size of downsampled history as the range grows"""
+    from backend import sensor_data_collection
+    monkeypatch.setattr("backend.verify_token", lambda token: (True, {"sub": "test_user", "email": "test@example.com"}))
+    headers = {"Authorization": "Bearer dummy-token"}
+    start = datetime.now()
+    from datetime import timedelta
+    # 30 days of readings every 5 minutes
+    sensor_data_collection.insert_many([
+        {"timestamp": start - timedelta(minutes=5 * i), "downsample_bench": 20 + (i % 50) / 10} for i in range(8640)
+    ])
+    try:
+        print("\nHistorical data (full vs points=100):")
+        for days in (1, 7, 30):
+            start_time = time.time()
+            full = client.get(f'/api/historical-data?data_type=downsample_bench&days={days}', headers=headers)
+            full_time = (time.time() - start_time) * 1000
+
+            start_time = time.time()
+            bucketed = client.get(f'/api/historical-data?data_type=downsample_bench&days={days}&points=100', headers=headers)
+            bucket_time = (time.time() - start_time) * 1000
+
+            assert full.status_code == 200 and bucketed.status_code == 200
+            assert bucketed.json["point_count"] <= 100
+            print(f"{days} days: full {full_time:.1f}ms ({len(full.data)} bytes), bucketed {bucket_time:.1f}ms ({len(bucketed.data)} bytes)")
+    finally:
+        sensor_data_collection.delete_many({"downsample_bench": {"$exists": True}})
+
+def test_latest_reading_cache_performance(client, monkeypatch, live_mongo):
+    """Room lookups from the latest reading cache against the MongoDB queries they replace"""
+    from backend import sensor_data_collection, water_data_collection
+    from latest_cache import LatestReadingCache
+    documents = [{"room_id": f"cache_bench_{i % 20}", "temperature": 20 + i % 5, "timestamp": datetime.now()} for i in range(2000)]
+    sensor_data_collection.insert_many(documents)
+    try:
+        cache = LatestReadingCache(sensor_data_collection, water_data_collection)
+        assert cache.rebuild()
+
+        start_time = time.time()
+        for i in range(100):
+            sensor_data_collection.find_one({"room_id": f"cache_bench_{i % 20}"}, sort=[("timestamp", -1)])
+        query_time = (time.time() - start_time) * 1000
+
+        start_time = time.time()
+        for i in range(100):
+            assert cache.get(f"cache_bench_{i % 20}") is not None
+        cache_time = (time.time() - start_time) * 1000
+
+        print(f"\n100 room lookups: find_one {query_time:.1f}ms, cache {cache_time:.2f}ms")
+        assert cache_time < query_time
+    finally:
+        sensor_data_collection.delete_many({"room_id": {"$regex": "^cache_bench_"}})
+
+def test_live_stream_fanout_performance():
+    """Publish throughput of the live stream as the number of subscribers on one worker grows"""
+    import threading
+    from live_stream import LiveBroadcaster
+    rooms = ["living_room", "bedroom", "kitchen", "bathroom"]
+    print("\nLive stream fan-out (100 readings):")
+    for subscriber_count in (10, 100, 1000):
+        broadcaster = LiveBroadcaster(max_queue=1000, max_subscribers=subscriber_count)
+        subscriptions = []
+        for i in range(subscriber_count):
+            # Mix of dashboards watching everything, one room, or one metric in one room
+            if i % 3 == 0:
+                subscriptions.append(broadcaster.subscribe())
+            elif i % 3 == 1:
+                subscriptions.append(broadcaster.subscribe(rooms=[rooms[i % 4]]))
+            else:
+                subscriptions.append(broadcaster.subscribe(rooms=[rooms[i % 4]], metrics=["temperature"]))
+
+        received = [0] * subscriber_count
+        def drain(index, subscription):
+            while subscription.get(timeout=1) is not None:
+                received[index] += 1
+        # A sample of subscribers read concurrently while publishing, like real client threads
+        readers = [threading.Thread(target=drain, args=(i, subscriptions[i])) for i in range(0, subscriber_count, max(subscriber_count // 20, 1))]
+        for reader in readers:
+            reader.start()
+
+        readings = [{"_id": i, "room_id": rooms[i % 4], "temperature": 21.0, "humidity": 45.0, "timestamp": datetime.now()} for i in range(100)]
+        start_time = time.time()
+        delivered = 0
+        for reading in readings:
+            delivered += broadcaster.publish("sensor_data", [reading])
+        publish_time = time.time() - start_time
+
+        for reader in readers:
+            reader.join()
+        broadcaster.close()
+        assert delivered > 0
+        print(f"{subscriber_count} subscribers: {delivered} events in {publish_time * 1000:.1f}ms ({delivered / publish_time:.0f} events/s, {100 / publish_time:.0f} readings/s)")
+
+def test_incremental_carbon_merge_performance(monkeypatch, fake_s3, load_lambda):
+    """Cost of one carbon footprint merge run as the history grows, full rebuild against incremental"""
+    import pandas as pd
+    module = load_lambda("ProcessCarbonFootprintData")
+    monkeypatch.setattr(module, "COMPACT_AFTER_PARTS", 1000)
+    start = pd.Timestamp("2024-01-01")
+
+    def rows(first, count):
+        timestamps = [(start + pd.Timedelta(minutes=first + i)).isoformat() for i in range(count)]
+        sensehat = "".join(f"{t},{20 + i % 5},{40 + i % 7},1013\n" for i, t in enumerate(timestamps))
+        waterflow = "".join(f"{t},{i % 9 / 2},L/min\n" for i, t in enumerate(timestamps) if i % 2 == 0)
+        return sensehat, waterflow
+
+    print("\nCarbon footprint merge, 60 new rows per run:")
+    timings = {}
+    for history in (5000, 20000, 80000):
+        old_sensehat, old_waterflow = rows(0, history)
+        new_sensehat, new_waterflow = rows(history, 60)
+        for mode in ("full", "incremental"):
+            s3 = fake_s3()
+            monkeypatch.setattr(module, "s3", s3)
+            monkeypatch.setattr(module, "MERGE_MODE", mode)
+            s3.put(module.SENSEHAT_BUCKET, module.SENSEHAT_CSV_FILENAME, "timestamp,temperature,humidity,pressure\n" + old_sensehat)
+            s3.put(module.WATERFLOW_BUCKET, module.WATERFLOW_CSV_FILENAME, "timestamp,flow_rate,unit\n" + old_waterflow)
+            assert module.lambda_handler({}, None)["statusCode"] == 200
+
+            s3.put(module.SENSEHAT_BUCKET, module.SENSEHAT_CSV_FILENAME, "timestamp,temperature,humidity,pressure\n" + old_sensehat + new_sensehat)
+            s3.put(module.WATERFLOW_BUCKET, module.WATERFLOW_CSV_FILENAME, "timestamp,flow_rate,unit\n" + old_waterflow + new_waterflow)
+            s3.bytes_served = 0
+            start_time = time.time()
+            assert module.lambda_handler({}, None)["statusCode"] == 200
+            timings[(history, mode)] = time.time() - start_time
+            print(f"{history} rows of history, {mode}: {timings[(history, mode)] * 1000:.1f}ms, {s3.bytes_served / 1024:.0f}KB read")
+
+    # Incremental runs read a fixed amount whatever the history size
+    assert timings[(80000, "incremental")] < timings[(80000, "full")] / 5
+
+def test_predictive_analysis_cache_performance(client, monkeypatch):
+    """Latency of /api/predictive-analysis when the models have to be fitted and when they are cached"""
+    import numpy as np
+    from datetime import timedelta
+    monkeypatch.setattr("backend.verify_token", lambda token: (True, {"sub": "test_user"}))
+    start = datetime(2025, 1, 1)
+    items = [{"timestamp": (start + timedelta(hours=i)).isoformat(), "temperature": 21 + np.sin(i / 6.0)} for i in range(100)]
+    table = MagicMock()
+    table.query.return_value = {"Items": list(reversed(items))}
+    monkeypatch.setattr("backend.SENSOR_TABLE", table)
+    headers = {"Authorization": "Bearer dummy-token"}
+
+    def timed(url):
+        start_time = time.time()
+        response = client.get(url, headers=headers)
+        assert response.status_code == 200
+        return (time.time() - start_time) * 1000, response.json
+
+    miss, fitted = timed("/api/predictive-analysis?data_type=temperature&days=7")
+    hits = [timed("/api/predictive-analysis?data_type=temperature&days=7") for _ in range(20)]
+    # A new horizon reuses the fitted model, only the forecast is computed
+    new_horizon, _ = timed("/api/predictive-analysis?data_type=temperature&days=14")
+    hit_times = [elapsed for elapsed, _ in hits]
+    assert all(body["predictions"] == fitted["predictions"] for _, body in hits)
+    print(f"\nPredictive analysis: miss {miss:.1f}ms, hit median {statistics.median(hit_times):.1f}ms, new horizon {new_horizon:.1f}ms")
+    assert statistics.median(hit_times) < miss
+
+def test_batch_forecast_performance():
+    """Forecasting 120 room and metric series, per-series statsmodels ARIMA against the batch engine"""
+    import numpy as np
+    from statsmodels.tsa.arima.model import ARIMA
+    from batch_forecast import BatchForecaster
+    rng = np.random.default_rng(1)
+    matrix = 20 + np.cumsum(rng.normal(size=(120, 168)), axis=1)
+
+    start_time = time.time()
+    arima = np.vstack([ARIMA(row, order=(1, 1, 0)).fit().forecast(steps=24) for row in matrix])
+    arima_time = time.time() - start_time
+
+    timings, forecasts = {}, {}
+    for method in ("ar", "holt"):
+        forecaster = BatchForecaster(method=method, workers=1)
+        start_time = time.time()
+        forecasts[method] = forecaster.forecast_matrix(matrix, 24)
+        timings[method] = time.time() - start_time
+    # 20000 series split over two processes
+    large = 20 + np.cumsum(rng.normal(size=(20000, 168)), axis=1)
+    forecaster = BatchForecaster(workers=2, chunk_size=5000)
+    try:
+        forecaster.forecast_matrix(large[:10], 24)
+        start_time = time.time()
+        forecaster.forecast_matrix(large, 24)
+        pool_time = time.time() - start_time
+    finally:
+        forecaster.close()
+
+    print(f"\n120 series: statsmodels ARIMA {arima_time * 1000:.0f}ms, batch AR {timings['ar'] * 1000:.1f}ms, batch Holt {timings['holt'] * 1000:.1f}ms")
+    print(f"20000 series, batch AR over 2 processes: {pool_time * 1000:.0f}ms")
+    # Same model as ARIMA(1,1,0), only fitted in closed form
+    assert np.abs(forecasts["ar"] - arima).max() < 1.0
+    assert timings["ar"] < arima_time / 50
+
+def test_anomaly_batch_scoring_performance(tmp_path, fitted_device_model):
+    """Anomaly scoring throughput from 1 to 100k readings, one batch call against a call per reading"""
+    import numpy as np
+    model = fitted_device_model(tmp_path)
+    rng = np.random.default_rng(5)
+    columns = {"temperature": rng.normal(22, 2, 100000).tolist(), "humidity": rng.normal(45, 5, 100000).tolist(), "pressure": rng.normal(1013, 4, 100000).tolist()}
+
+    print("\nBatch anomaly scoring:")
+    for size in (1, 100, 1000, 10000, 100000):
+        batch = {name: values[:size] for name, values in columns.items()}
+        start_time = time.time()
+        result = model.detect_anomalies_batch(batch)
+        elapsed = time.time() - start_time
+        assert result["count"] == size
+        print(f"{size} rows: {elapsed * 1000:.1f}ms, {size / elapsed:,.0f} rows/s")
+
+    readings = [{name: columns[name][row] for name in columns} for row in range(200)]
+    start_time = time.time()
+    single = [model.detect_anomalies(reading) for reading in readings]
+    per_reading = time.time() - start_time
+    start_time = time.time()
+    batch = model.detect_anomalies_batch(readings)
+    batched = time.time() - start_time
+    print(f"200 rows one call per reading {per_reading * 1000:.0f}ms, one batch {batched * 1000:.1f}ms")
+    assert batch["is_anomaly"] == [result["is_anomaly"] for result in single]
+    assert batched < per_reading / 10
+
+def test_forest_scorer_cold_start_performance(tmp_path):
+    """Import, load and scoring time of the NumPy forest export against the pickled IsolationForest"""
+    import os
+    import sys
+    import pickle
+    import subprocess
+    import numpy as np
+    from sklearn.ensemble import IsolationForest
+    from forest_scorer import ForestScorer, save_forest
+    rng = np.random.default_rng(2)
+    model = IsolationForest(contamination=0.05, random_state=42).fit(rng.normal(size=(1000, 3)) * [2, 10, 5] + [22, 45, 1013])
+    with open(tmp_path / "forest.pkl", "wb") as f:
+        pickle.dump(model, f)
+    save_forest(model, tmp_path / "forest.npz")
+
+    def import_time(module):
+        # Fresh interpreter each time so nothing is already imported
+        script = f"import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+        return min(float(subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout) for _ in range(3))
+
+    def load_time(load):
+        times = []
+        for _ in range(5):
+            start_time = time.perf_counter()
+            load()
+            times.append(time.perf_counter() - start_time)
+        return min(times)
+
+    sklearn_import, numpy_import = import_time("sklearn.ensemble"), import_time("forest_scorer")
+    pickle_load = load_time(lambda: pickle.load(open(tmp_path / "forest.pkl", "rb")))
+    arrays_load = load_time(lambda: ForestScorer.load(tmp_path / "forest.npz"))
+    scorer = ForestScorer.load(tmp_path / "forest.npz")
+    print(f"\nImport: sklearn.ensemble {sklearn_import * 1000:.0f}ms, forest_scorer {numpy_import * 1000:.0f}ms")
+    print(f"Load: pickle {pickle_load * 1000:.1f}ms, npz {arrays_load * 1000:.1f}ms")
+    for size in (1, 1000, 100000):
+        rows = rng.normal(size=(size, 3)) * [3, 15, 8] + [22, 45, 1013]
+        sklearn_time = load_time(lambda: model.score_samples(rows))
+        numpy_time = load_time(lambda: scorer.score_samples(rows))
+        print(f"{size} rows: sklearn {sklearn_time * 1000:.1f}ms, numpy {numpy_time * 1000:.1f}ms")
+    assert numpy_import < sklearn_import
+    assert arrays_load < pickle_load
+
+def test_window_feature_stream_performance(tmp_path):
+    """Window feature updates for thousands of devices, memory bound and drift detection on a synthetic stream"""
+    import tracemalloc
+    import numpy as np
+    from window_features import WindowFeatureStore
+    from device_ml import DeviceMLModel
+    from model_generator import create_window_model, generate_sample_streams
+
+    # 5000 devices streaming, then 5000 more arriving into a store capped at 5000
+    rng = np.random.default_rng(8)
+    values = rng.normal([22, 45, 1013], [1, 5, 3], (20000, 3)).tolist()
+
+    def stream(store):
+        for step in range(20000):
+            store.update(f"device-{step % 5000}", {"temperature": values[step][0], "humidity": values[step][1], "pressure": values[step][2]}, step)
+
+    start_time = time.time()
+    stream(WindowFeatureStore(max_devices=5000))
+    elapsed = time.time() - start_time
+    # Memory is measured on a second run, tracing slows the updates down
+    store = WindowFeatureStore(max_devices=5000)
+    tracemalloc.start()
+    stream(store)
+    full_memory = tracemalloc.get_traced_memory()[0]
+    for device in range(5000, 10000):
+        store.update(f"device-{device}", {"temperature": 22.0, "humidity": 45.0, "pressure": 1013.0}, 20000 + device)
+    bounded_memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f"\nWindow features: {20000 / elapsed:,.0f} updates/s, {full_memory / 5000:.0f} bytes per device, "
+          f"{bounded_memory / 1024:.0f}KB after 10000 devices with 5000 kept")
+    assert len(store) == 5000 and store.evicted == 5000
+    assert bounded_memory < full_memory * 1.2
+
+    # Drift validation, 10 of 40 devices ramp up 0.1C a minute half way through the stream
+    create_window_model(str(tmp_path))
+    model = DeviceMLModel(model_path=str(tmp_path / "missing.tflite"), fallback_model_path=str(tmp_path / "missing.pkl"), window_model_path=str(tmp_path / "window_forest.npz"))
+    readings, drifting = [], []
+    for device_id, timestamp, reading in generate_sample_streams(n_devices=40, n_steps=360, seed=7):
+        reading = dict(reading, device_id=device_id, timestamp=timestamp)
+        drift = int(device_id.split("-")[1]) < 10 and timestamp >= 180 * 30
+        if drift:
+            reading["temperature"] += (timestamp - 180 * 30) / 60 * 0.1
+        readings.append(reading)
+        drifting.append(drift)
+    start_time = time.time()
+    result = model.detect_window_anomalies(readings)
+    scoring = time.time() - start_time
+
+    # Compared after 20 minutes of drift, once the ramp is past the sensor noise
+    late = np.array([reading["timestamp"] >= 200 * 30 for reading in readings])
+    ready = np.array(result["ready"])
+    flagged = np.array(result["is_anomaly"])
+    drifting = np.array(drifting)
+    detected = flagged[late & ready & drifting].mean()
+    false_positives = flagged[late & ready & ~drifting].mean()
+    print(f"{len(readings)} readings scored in {scoring * 1000:.0f}ms, drift detected {detected:.1%}, steady devices flagged {false_positives:.1%}")
+    assert detected > 0.9
+    assert false_positives < 0.02
+
 """Security Testing"""
 
 def test_authentication_protection(client):
@@ -8,6 +8,8 @@ import importlib
 import pandas as pd
 from io import StringIO
 import os
+import json
+import time
 from reports import generate_report_data, find_anomalies, calculate_statistics,generate_pdf_report,generate_csv_report
 @pytest.fixture
 def app():
@@ -125,20 +127,240 @@ def test_send_alert_sms():
         assert kwargs["TopicArn"] == os.getenv("SNS_TOPIC_ARN")
         assert test_message in kwargs["Message"]
 
-def test_alert_cache_mecahnism():
-    alert_service = AlertService()
-    alert_key = "test_device_temperature_high"
+# Local stand-ins for the AWS services used by the alert pipeline
+class FakeSNS:
+    def __init__(self, fail_times=0, delay=0):
+        self.messages = []
+        self.fail_times = fail_times
+        self.delay = delay
+
+    def publish(self, **kwargs):
+        time.sleep(self.delay)
+        if self.fail_times:
+            self.fail_times -= 1
+            raise Exception("Throttled")
+        self.messages.append(kwargs)
+        return {"MessageId": f"msg-{len(self.messages)}"}
+
+class FakeSES:
+    def __init__(self):
+        self.emails = []
+
+    def send_email(self, **kwargs):
+        self.emails.append(kwargs)
+        return {"MessageId": f"email-{len(self.emails)}"}
+
+class FakeDynamoDB:
+    def __init__(self):
+        self.items = []
+        self.tables = {}
+
+    def Table(self, name):
+        table = MagicMock()
+        table.put_item.side_effect = lambda Item: self.items.append(Item)
+        table.scan.return_value = {"Items": []}
+        table.get_item.return_value = {}
+        self.tables[name] = table
+        return table
+
+@patch.dict(os.environ, {"SNS_TOPIC_ARN": "arn:aws:sns:eu-west-1:123:alerts", "SES_EMAIL_SENDER": "sender@example.com", "SES_EMAIL_RECIPIENT": "recipient@example.com"})
+def test_alert_pipeline_delivers_off_hot_path():
+    from alert_pipeline import AlertPipeline
+    sns, ses, dynamodb = FakeSNS(delay=0.3), FakeSES(), FakeDynamoDB()
+    pipeline = AlertPipeline(max_workers=2, retry_delay=0).start()
+    service = AlertService(sns_client=sns, ses_client=ses, dynamodb=dynamodb, alert_pipeline=pipeline)
+    try:
+        start_time = time.time()
+        exceeded = service.check_thresholds({"temperature": 30, "humidity": 45, "device_id": "pi_1"})
+        # Evaluation is inline, the slow SNS publish is not
+        assert exceeded == ["temperature_high"]
+        assert time.time() - start_time < 0.3
+
+        assert pipeline.wait_idle(timeout=5)
+        assert len(sns.messages) == 1
+        assert len(ses.emails) == 1
+        assert dynamodb.items[0]["exceeded_thresholds"] == ["temperature_high"]
+    finally:
+        pipeline.close()
+
+@patch.dict(os.environ, {"SNS_TOPIC_ARN": "arn:aws:sns:eu-west-1:123:alerts", "SES_EMAIL_SENDER": "sender@example.com", "SES_EMAIL_RECIPIENT": "recipient@example.com"})
+def test_alert_pipeline_retries_failed_delivery():
+    from alert_pipeline import AlertPipeline
+    sns, ses, dynamodb = FakeSNS(fail_times=2), FakeSES(), FakeDynamoDB()
+    pipeline = AlertPipeline(max_workers=1, max_retries=3, retry_delay=0).start()
+    service = AlertService(sns_client=sns, ses_client=ses, dynamodb=dynamodb, alert_pipeline=pipeline)
+    try:
+        service.check_thresholds({"humidity": 80, "device_id": "pi_1"})
+        assert pipeline.wait_idle(timeout=5)
+        # SMS succeeds on the third attempt and the other channels are not resent
+        assert len(sns.messages) == 1
+        assert len(ses.emails) == 1
+        metrics = pipeline.metrics()
+        assert metrics["retried"] == 2
+        assert metrics["failed"] == 0
+    finally:
+        pipeline.close()
+
+@patch.dict(os.environ, {"SNS_TOPIC_ARN": "arn:aws:sns:eu-west-1:123:alerts", "SES_EMAIL_SENDER": "sender@example.com", "SES_EMAIL_RECIPIENT": "recipient@example.com"})
+def test_alert_history_retry_reuses_alert_id():
+    from alert_pipeline import AlertPipeline
+    attempts = []
+    def put_item(Item):
+        attempts.append(Item)
+        if len(attempts) == 1:
+            raise Exception("Read timeout")  # stored, but the response was lost
+    dynamodb = FakeDynamoDB()
+    make_table = dynamodb.Table
+    def table(name):
+        fake_table = make_table(name)
+        fake_table.put_item.side_effect = put_item
+        return fake_table
+    dynamodb.Table = table
+    pipeline = AlertPipeline(max_workers=1, max_retries=3, retry_delay=0).start()
+    service = AlertService(sns_client=FakeSNS(), ses_client=FakeSES(), dynamodb=dynamodb, alert_pipeline=pipeline)
+    try:
+        service.check_thresholds({"humidity": 80, "device_id": "pi_1"})
+        assert pipeline.wait_idle(timeout=5)
+        assert len(attempts) == 2
+        assert attempts[0]["id"] == attempts[1]["id"]
+    finally:
+        pipeline.close()
+
+def test_alert_service_caches_thresholds_and_preferences():
+    mongo_db = MagicMock()
+    mongo_db.thresholds.find_one.return_value = {"temperature_range": [18, 24], "humidity_range": [30, 60]}
+    mongo_db.notification_preferences.find_one.return_value = {"sms_enabled": False, "email_enabled": False}
+    service = AlertService(sns_client=MagicMock(), ses_client=MagicMock(), dynamodb=MagicMock(), mongo_db=mongo_db)
+
+    for temperature in (19, 25, 26):
+        service.check_thresholds({"temperature": temperature, "device_id": "pi_1"})
+
+    # Steady state readings hit the cache instead of MongoDB
+    assert mongo_db.thresholds.find_one.call_count == 1
+    assert mongo_db.notification_preferences.find_one.call_count == 1
+
+    # Writes invalidate the cache so the next reading sees the new values
+    mongo_db.thresholds.find_one.return_value = {"temperature_range": [18, 30], "humidity_range": [30, 60]}
+    service.invalidate_cache()
+    assert service.check_thresholds({"temperature": 26, "device_id": "pi_1"}) == []
+    assert mongo_db.thresholds.find_one.call_count == 2
+
+def test_check_thresholds_matches_batch_engine(capsys):
+    thresholds = {"temperature_range": [18, 24], "humidity_range": [30, 60], "flow_rate_threshold": 10, "room_overrides": {"kitchen": {"temperature_range": [18, 28]}}}
+    service = AlertService(sns_client=MagicMock(), ses_client=MagicMock(), dynamodb=MagicMock())
+    service._dispatch_alerts = MagicMock()
+    readings = [
+        {"temperature": 26, "humidity": 20, "device_id": "pi_1"},
+        {"temperature": 26, "device_id": "pi_1", "room_id": "kitchen"},
+        {"flow_rate": 12.5, "device_id": "WaterSensor_1"},
+        {"payload": {"M": {"device_id": {"S": "pi_2"}, "temperature": {"N": "10"}, "humidity": {"N": "70"}}}}
+    ]
+    single = [service.check_thresholds(reading, thresholds) for reading in readings]
+    assert single == [["temperature_high", "humidity_low"], [], ["water_usage_high"], ["temperature_low", "humidity_high"]]
+    assert single[:3] == service.check_thresholds_batch(readings[:3], thresholds)
+    # Per reading debug output goes through logging, not stdout
+    assert capsys.readouterr().out == ""
 
-    # Initialise to not be in cache
-    assert alert_service._is_alert_in_cache(alert_key) == False
+def test_set_thresholds_invalidates_alert_cache(client, monkeypatch):
+    monkeypatch.setattr("backend.verify_token", lambda token: (True, {"sub": "test_user", "email": "test@example.com"}))
+    with patch('backend.thresholds_collection.replace_one'):
+        with patch('backend.alert_service.invalidate_cache') as mock_invalidate:
+            response = client.post('/api/set-thresholds', json={"temperature_range": [18, 26], "humidity_range": [30, 60]}, headers={"Authorization": "Bearer dummy-token"})
+    assert response.status_code == 200
+    mock_invalidate.assert_called_once()
 
-    # Add to cache
-    alert_service._add_to_cache(alert_key)
-    assert alert_service._is_alert_in_cache(alert_key) == True
+def test_threshold_engine_matches_per_reading_checks():
+    from threshold_engine import ThresholdEngine
+    thresholds = {
+        "temperature_range": [20, 25],
+        "humidity_range": [30, 60],
+        "flow_rate_threshold": 10,
+        "room_overrides": {"nursery": {"temperature_range": [19, 22]}}
+    }
+    readings = [
+        {"room_id": "kitchen", "temperature": 30, "humidity": 80, "flow_rate": 12},
+        {"room_id": "kitchen", "temperature": 23, "humidity": 50},
+        {"room_id": "nursery", "temperature": 23, "humidity": 20},
+        {"room_id": "nursery", "temperature": None, "flow_rate": 5},
+        {"room_id": "office", "temperature": 15}
+    ]
+    exceeded = ThresholdEngine(thresholds).evaluate_records(readings)
+    assert exceeded == [
+        ["temperature_high", "humidity_high", "water_usage_high"],
+        [],
+        ["temperature_high", "humidity_low"],
+        [],
+        ["temperature_low"]
+    ]
 
-    # Test cache expiry 
-    alert_service._alert_cache[alert_key] = datetime.now().timestamp() - (alert_service._CACHE_TTL + 10)
-    assert alert_service._is_alert_in_cache(alert_key) == False
+def test_threshold_engine_columnar_batch():
+    import numpy as np
+    from threshold_engine import ThresholdEngine, TEMPERATURE_HIGH, HUMIDITY_LOW
+    engine = ThresholdEngine({"temperature_range": [20, 25], "humidity_range": [30, 60]})
+    masks = engine.evaluate(temperature=np.array([26.0, 22.0, np.nan]), humidity=np.array([45.0, 10.0, 10.0]))
+    assert list(masks) == [TEMPERATURE_HIGH, HUMIDITY_LOW, HUMIDITY_LOW]
+
+class FakeClock:
+    def __init__(self):
+        self.now = time.time()
+
+    def __call__(self):
+        return self.now
+
+def test_alert_deduplicator_cooldown_and_escalation():
+    from alert_dedup import AlertDeduplicator
+    clock = FakeClock()
+    dedup = AlertDeduplicator(cooldown=60, escalation_factor=2, max_cooldown=600, clock=clock)
+    reading = {"device_id": "pi_1", "room_id": "kitchen"}
+
+    # A reading every 10 seconds during a 10 minute breach
+    sent = []
+    for _ in range(60):
+        decision = dedup.check(reading, ["temperature_high"])
+        if decision.send:
+            sent.append((clock.now, decision.level))
+        clock.now += 10
+
+    # Sent at 0s, then reminders after 60s, 120s and 240s cooldowns
+    assert [level for _, level in sent] == [0, 1, 2, 3]
+    assert [t - sent[0][0] for t, _ in sent] == [0, 60, 180, 420]
+
+    # A different set of thresholds is a separate alert
+    assert dedup.check(reading, ["temperature_high", "humidity_high"]).send
+
+    # Once the breach clears the next one starts a new episode
+    clock.now += 3600
+    decision = dedup.check(reading, ["temperature_high"])
+    assert decision.send and decision.level == 0
+
+def test_alert_deduplicator_shared_store():
+    from backend import db
+    from alert_dedup import AlertDeduplicator, MongoDedupStore
+    collection = db.alert_dedup_test
+    collection.delete_many({})
+    clock = FakeClock()
+    # Two workers sharing one MongoDB collection, building the store does not touch MongoDB
+    collection.create_index = MagicMock(side_effect=AssertionError("index creation belongs to db_indexes"))
+    workers = [AlertDeduplicator(store=MongoDedupStore(collection), cooldown=60, clock=clock) for _ in range(2)]
+    reading = {"device_id": "pi_1", "room_id": "kitchen"}
+    try:
+        decisions = [worker.check(reading, ["humidity_low"]).send for worker in workers for _ in range(5)]
+        assert decisions.count(True) == 1
+    finally:
+        collection.drop()
+
+def test_alert_service_suppresses_repeat_alerts():
+    from alert_dedup import AlertDeduplicator
+    sns_client, ses_client, dynamodb = MagicMock(), MagicMock(), MagicMock()
+    dynamodb.Table.return_value.scan.return_value = {"Items": []}
+    service = AlertService(sns_client=sns_client, ses_client=ses_client, dynamodb=dynamodb, deduplicator=AlertDeduplicator(cooldown=900))
+    service.sns_topic_arn = "arn:aws:sns:eu-west-1:123:alerts"
+
+    for _ in range(20):
+        assert service.check_thresholds({"temperature": 30, "device_id": "pi_1", "room_id": "kitchen"}) == ["temperature_high"]
+
+    assert sns_client.publish.call_count == 1
+    assert dynamodb.Table.return_value.put_item.call_count == 1
 
 # Carbon footprint calculation tests
 def test_calculate_carbon_footprint():
@@ -166,6 +388,815 @@ def test_get_thresholds_api(client, monkeypatch):
         assert response.status_code == 200
         assert response.json["temperature_range"] == [20, 25]
 
+def test_sensor_data_upload_batch(client):
+    readings = [
+        {"room_id": "batch_room", "device_id": "pi_1", "temperature": 22.0, "humidity": 40.0, "pressure": 1010.0},
+        {"device_id": "pi_1", "temperature": 22.0},
+        {"room_id": "batch_room", "device_id": "pi_1", "temperature": 23.0, "humidity": 41.0, "pressure": 1011.0}
+    ]
+    with patch('backend.alert_service._dispatch_alerts'):
+        with patch('backend.sensor_data_collection.insert_many') as mock_insert:
+            response = client.post('/api/sensor-data-upload/batch', json={"readings": readings})
+
+    # Both valid readings go to MongoDB in a single unordered bulk write
+    assert mock_insert.call_count == 1
+    assert len(mock_insert.call_args[0][0]) == 2
+    assert mock_insert.call_args[1]["ordered"] is False
+
+    assert response.status_code == 207
+    assert response.json["accepted"] == 2
+    assert [r["status"] for r in response.json["results"]] == ["ok", "error", "ok"]
+
+def test_sensor_data_upload_batch_write_errors(client):
+    from pymongo.errors import BulkWriteError
+    readings = [{"room_id": "batch_room", "temperature": 22.0}, {"room_id": "batch_room", "temperature": 23.0}]
+    bulk_error = BulkWriteError({"writeErrors": [{"index": 1, "errmsg": "duplicate key"}]})
+
+    with patch('backend.alert_service._dispatch_alerts'):
+        with patch('backend.sensor_data_collection.insert_many', side_effect=bulk_error):
+            response = client.post('/api/sensor-data-upload/batch', json=readings)
+
+    assert response.status_code == 207
+    assert response.json["results"][0]["status"] == "ok"
+    assert response.json["results"][1] == {"index": 1, "status": "error", "error": "duplicate key"}
+
+def test_sensor_data_upload_batch_empty(client):
+    response = client.post('/api/sensor-data-upload/batch', json=[])
+    assert response.status_code == 400
+
+def test_latest_cache_serves_rooms_from_memory(client, monkeypatch):
+    from latest_cache import LatestReadingCache
+    monkeypatch.setattr("backend.verify_token", lambda token: (True, {"sub": "test_user", "email": "test@example.com"}))
+    headers = {"Authorization": "Bearer dummy-token"}
+    sensor_collection, water_collection = MagicMock(), MagicMock()
+    sensor_collection.name, water_collection.name = "sensor_data", "water_data"
+    cache = LatestReadingCache(sensor_collection, water_collection)
+    monkeypatch.setattr("backend.latest_readings", cache)
+    now = datetime.now()
+    cache.update("sensor_data", [
+        {"_id": "a", "room_id": "bathroom", "temperature": 21.0, "timestamp": now},
+        {"_id": "b", "room_id": "bathroom", "temperature": 19.0, "timestamp": now - timedelta(minutes=5)}
+    ])
+    cache.update("water_data", [{"_id": "c", "room_id": "bathroom", "flow_rate": 4.2, "timestamp": now}])
+
+    with patch('backend.sensor_data_collection.find_one', side_effect=AssertionError("should be cached")):
+        with patch('backend.sensor_data_collection.distinct', side_effect=AssertionError("should be cached")):
+            rooms = client.get('/api/rooms', headers=headers)
+            response = client.get('/api/sensor-data/bathroom', headers=headers)
+
+    assert rooms.json == ["bathroom"]
+    # Older readings never replace newer ones, flow rate is merged from the water collection
+    assert response.json["temperature"] == 21.0
+    assert response.json["flow_rate"] == 4.2
+    assert response.json["_id"] == "a"
+
+    # Rooms that are not cached still come from MongoDB
+    with patch('backend.sensor_data_collection.find_one', return_value={"_id": "d", "room_id": "attic", "temperature": 18.0}):
+        assert client.get('/api/sensor-data/attic', headers=headers).json["temperature"] == 18.0
+
+def test_live_broadcaster_filters():
+    from live_stream import LiveBroadcaster
+    broadcaster = LiveBroadcaster(max_queue=2)
+    everything = broadcaster.subscribe()
+    kitchen_temperature = broadcaster.subscribe(rooms=["kitchen"], metrics=["temperature"])
+    humidity = broadcaster.subscribe(metrics=["humidity"])
+
+    broadcaster.publish("sensor_data", [
+        {"_id": 1, "room_id": "kitchen", "temperature": 24.0, "humidity": 40.0},
+        {"_id": 2, "room_id": "bedroom", "temperature": 20.0}
+    ])
+    # The same reading seen again on the change stream is not sent twice
+    broadcaster.publish("sensor_data", [{"_id": 1, "room_id": "kitchen", "temperature": 24.0, "humidity": 40.0}])
+
+    assert '"temperature": 24.0' in kitchen_temperature.get(timeout=0)
+    assert kitchen_temperature.get(timeout=0) is None
+    assert '"humidity": 40.0' in humidity.get(timeout=0)
+    assert humidity.get(timeout=0) is None
+    assert everything.get(timeout=0).startswith("id: 1\nevent: sensor_data\ndata: ")
+    assert "bedroom" in everything.get(timeout=0)
+
+    # A slow client keeps only the newest events
+    broadcaster.publish("sensor_data", [{"_id": i, "room_id": "kitchen", "temperature": float(i)} for i in range(3, 7)])
+    assert everything.dropped == 2
+    assert '"temperature": 5.0' in everything.get(timeout=0)
+
+    kitchen_temperature.close()
+    assert broadcaster.stats()["subscribers"] == 2
+
+def test_stream_endpoint_receives_ingested_readings(client, monkeypatch):
+    monkeypatch.setattr("backend.verify_token", lambda token: (True, {"sub": "test_user", "email": "test@example.com"}))
+    ticket = client.post('/api/stream/ticket', headers={"Authorization": "Bearer dummy-token"}).get_json()["ticket"]
+    response = client.get(f'/api/stream?rooms=stream_room&metrics=temperature&ticket={ticket}', buffered=False)
+    assert response.status_code == 200
+    assert response.mimetype == "text/event-stream"
+    events = response.response
+    assert next(events).decode().startswith("event: subscribed")
+
+    with patch('backend.alert_service._dispatch_alerts'):
+        with patch('backend.sensor_data_collection.insert_many'):
+            client.post('/api/sensor-data-upload/batch', json=[
+                {"room_id": "other_room", "temperature": 30.0},
+                {"room_id": "stream_room", "temperature": 21.5, "humidity": 44.0}
+            ])
+
+    event = next(events).decode()
+    assert '"room_id": "stream_room"' in event
+    assert '"temperature": 21.5' in event
+    assert "humidity" not in event
+    response.close()
+
+def test_stream_tickets_are_single_use_and_expire(client):
+    from live_stream import StreamTickets
+    now = [0.0]
+    tickets = StreamTickets(ttl=30, clock=lambda: now[0])
+    ticket = tickets.issue({"user_id": "test_user"})
+    assert tickets.redeem(ticket) == {"user_id": "test_user"}
+    assert tickets.redeem(ticket) is None
+
+    stale = tickets.issue({"user_id": "test_user"})
+    now[0] = 31.0
+    assert tickets.redeem(stale) is None
+
+    # Shared tickets issued by one worker can be redeemed once by another
+    from backend import db
+    from live_stream import MongoStreamTickets
+    collection = db.stream_tickets_test
+    collection.delete_many({})
+    try:
+        issuer, redeemer = (MongoStreamTickets(collection, ttl=30, clock=lambda: now[0]) for _ in range(2))
+        ticket = issuer.issue({"user_id": "test_user"})
+        assert collection.find_one()["_id"] != ticket
+        assert redeemer.redeem(ticket) == {"user_id": "test_user"}
+        assert issuer.redeem(ticket) is None
+        stale = issuer.issue({"user_id": "test_user"})
+        now[0] = 62.0
+        assert redeemer.redeem(stale) is None
+        assert redeemer.redeem(None) is None
+    finally:
+        collection.drop()
+
+    # The bearer token is no longer accepted in the URL
+    assert client.get('/api/stream?token=dummy-token').status_code == 401
+    assert client.get('/api/stream?ticket=made-up').status_code == 401
+
+def test_sensehat_sampler_persist_cadence():
+    from sensehat_sampler import SenseHatSampler
+    now = [0.0]
+    readings = iter(range(100))
+    persisted = []
+    sampler = SenseHatSampler(lambda: {"temperature": float(next(readings))}, persist=persisted.append,
+                              sample_interval=1, persist_interval=5, buffer_size=3, clock=lambda: now[0])
+    for _ in range(11):
+        sampler.tick()
+        now[0] += 1
+
+    # Sampled every tick, stored every 5 seconds, ring buffer keeps the newest 3
+    assert [p["temperature"] for p in persisted] == [0.0, 5.0, 10.0]
+    assert [s["temperature"] for s in sampler.history()] == [8.0, 9.0, 10.0]
+    assert sampler.latest()["temperature"] == 10.0
+    assert sampler.latest(max_age=0.5) is None
+
+def test_sensor_data_get_is_read_only(client, monkeypatch):
+    from sensehat_sampler import SenseHatSampler
+    monkeypatch.setattr("backend.verify_token", lambda token: (True, {"sub": "test_user", "email": "test@example.com"}))
+    sampler = SenseHatSampler(MagicMock(side_effect=AssertionError("hardware read on request")))
+    sampler._buffer.append((time.monotonic(), {"temperature": 21.3, "humidity": 48.0, "location": "Main System"}))
+    monkeypatch.setattr("backend.sense_hat_sampler", sampler)
+
+    with patch('backend.ingest_buffer.submit') as mock_submit, patch('backend.alert_service.check_thresholds') as mock_check:
+        response = client.get('/api/sensor-data', headers={"Authorization": "Bearer dummy-token"})
+
+    assert response.status_code == 200
+    assert response.json["temperature"] == 21.3
+    mock_submit.assert_not_called()
+    mock_check.assert_not_called()
+
+def test_sensor_data_reads_hardware_when_sampler_stopped(client, monkeypatch):
+    from sensehat_sampler import SenseHatSampler
+    monkeypatch.setattr("backend.verify_token", lambda token: (True, {"sub": "test_user", "email": "test@example.com"}))
+    readings = iter([21.0, 22.0])
+    sampler = SenseHatSampler(lambda: {"temperature": next(readings)})
+    # A sample left over from before the sampler stopped is not served
+    sampler._buffer.append((time.monotonic() - 60, {"temperature": 18.0}))
+    monkeypatch.setattr("backend.sense_hat_sampler", sampler)
+
+    first = client.get('/api/sensor-data', headers={"Authorization": "Bearer dummy-token"})
+    second = client.get('/api/sensor-data', headers={"Authorization": "Bearer dummy-token"})
+    assert first.json["temperature"] == 21.0
+    assert second.json["temperature"] == 22.0
+    assert len(sampler.history()) == 1
+
+def test_s3_csv_cache_revalidates_by_etag(tmp_path, fake_s3):
+    from s3_cache import S3CsvCache
+    s3 = fake_s3()
+    s3.put("bucket", "data.csv", "timestamp,temperature\n2025-01-01,21.0\n2025-01-02,22.0\n")
+    now = [0.0]
+    cache_dir = tmp_path / "s3-cache"
+    cache = S3CsvCache(s3, cache_dir=str(cache_dir), ttl=60, clock=lambda: now[0])
+
+    frame = cache.get_frame("bucket", "data.csv")
+    frame["temperature"] = 0  # callers get their own copy
+    assert list(cache.get_frame("bucket", "data.csv")["temperature"]) == [21.0, 22.0]
+    assert (s3.heads, s3.gets) == (1, 1)
+
+    # After the TTL only the ETag is checked
+    now[0] = 120
+    cache.get_frame("bucket", "data.csv")
+    assert (s3.heads, s3.gets) == (2, 1)
+
+    # A changed object is downloaded again
+    s3.put("bucket", "data.csv", "timestamp,temperature\n2025-01-03,23.0\n")
+    now[0] = 240
+    assert list(cache.get_frame("bucket", "data.csv")["temperature"]) == [23.0]
+    assert s3.gets == 2
+
+    # A new worker finds the CSV on disk, stored next to its ETag rather than pickled
+    fresh = S3CsvCache(s3, cache_dir=str(cache_dir), ttl=60)
+    assert list(fresh.get_frame("bucket", "data.csv")["temperature"]) == [23.0]
+    assert s3.gets == 2 and fresh.stats["disk_loads"] == 1
+    assert sorted(path.suffix for path in cache_dir.iterdir()) == [".csv", ".json"]
+    assert cache_dir.stat().st_mode & 0o777 == 0o700
+
+    # A directory other users can write to is not trusted
+    cache_dir.chmod(0o777)
+    shared = S3CsvCache(s3, cache_dir=str(cache_dir), ttl=60)
+    shared.get_frame("bucket", "data.csv")
+    assert shared.stats["disk_loads"] == 0 and s3.gets == 3
+
+def test_long_term_trends_use_s3_cache(monkeypatch, tmp_path, fake_s3):
+    import backend
+    from s3_cache import S3CsvCache
+    s3 = fake_s3()
+    s3.put("sensehat-longterm-storage", "carbon_footprint_training_sensehat.csv",
+           "timestamp,temperature\n" + "".join(f"2025-01-{d:02d},{20 + d}\n" for d in range(1, 11)))
+    monkeypatch.setattr("backend.s3_csv_cache", S3CsvCache(s3, cache_dir=str(tmp_path)))
+    monkeypatch.setattr("backend.PARQUET_AVAILABLE", False)
+
+    for _ in range(5):
+        trends = backend.get_long_term_sensor_trends()
+    assert len(trends) == 7
+    assert s3.gets == 1
+
+def test_parquet_archive_conversion_and_range_reads(fake_s3):
+    pytest.importorskip("pyarrow")
+    from parquet_archive import ParquetArchive, convert_csv
+    s3 = fake_s3()
+    rows = ["timestamp,temperature,humidity,pressure"]
+    start = datetime(2025, 1, 1)
+    for i in range(30 * 24):
+        rows.append(f"{(start + timedelta(hours=i)).isoformat()},{20 + i % 5},{40 + i % 10},{1000 + i % 7}")
+    s3.put("sensehat", "sensehat.csv", "\n".join(rows) + "\n")
+
+    result = convert_csv(s3, "sensehat", "sensehat.csv", "archive/sensehat")
+    assert result == {"rows": 720, "partitions_written": 30, "partitions": 30}
+
+    archive = ParquetArchive(s3, "sensehat", "archive/sensehat")
+    assert len(archive.partitions_for(datetime(2025, 1, 10), datetime(2025, 1, 12, 23))) == 3
+
+    s3.bytes_served = 0
+    frame = archive.read(datetime(2025, 1, 10), datetime(2025, 1, 12, 23), columns=["temperature"])
+    assert len(frame) == 72
+    assert list(frame.columns) == ["timestamp", "temperature"]
+    # Only the three partitions in range are fetched
+    total_bytes = sum(len(body) for (bucket, key), (body, _) in s3.objects.items() if key.endswith(".parquet"))
+    assert s3.bytes_served < total_bytes / 5
+
+    assert list(archive.tail(7)["timestamp"])[-1] == pd.Timestamp(start + timedelta(hours=719))
+
+    # Rewriting a day merges with what is there, newer values win
+    archive.write(pd.DataFrame([{"timestamp": "2025-01-30T23:00:00", "temperature": 99.0, "humidity": 1.0, "pressure": 1.0}]))
+    assert archive.tail(1)["temperature"].iloc[0] == 99.0
+    assert archive.manifest()["partitions"]["2025-01-30"]["rows"] == 24
+
+def test_fetch_s3_csv_prefers_parquet_archive(monkeypatch, fake_s3):
+    pytest.importorskip("pyarrow")
+    import backend
+    from parquet_archive import ParquetArchive
+    s3 = fake_s3()
+    archive = ParquetArchive(s3, "sensehat-longterm-storage", "archive/sensehat")
+    archive.write(pd.DataFrame({"timestamp": pd.date_range("2025-01-01", periods=100, freq="h"), "temperature": range(100)}))
+    monkeypatch.setattr("backend.parquet_archives", {("sensehat-longterm-storage", "carbon_footprint_training_sensehat.csv"): archive})
+    monkeypatch.setattr("backend.s3_csv_cache", MagicMock(side_effect=AssertionError("CSV should not be read")))
+
+    trends = backend.get_long_term_sensor_trends()
+    assert list(trends["temperature"]) == list(range(93, 100))
+    assert trends["timestamp"].iloc[-1] == "2025-01-05T03:00:00"
+
+def carbon_source_rows(start, count, offset=0):
+    sensehat = "".join(f"2025-01-01T{(start + i) // 60:02d}:{(start + i) % 60:02d}:00,{20 + i % 5},{40 + i % 7},1013\n" for i in range(count))
+    # Water flow readings only every other minute so the outer merge has gaps to fill
+    waterflow = "".join(f"2025-01-01T{(start + i) // 60:02d}:{(start + i) % 60:02d}:00,{(i + offset) % 9 / 2},L/min\n" for i in range(0, count, 2))
+    return sensehat, waterflow
+
+def combined_view(module, s3):
+    """Combined CSV plus any incremental part files, as a reader would see it"""
+    bucket = module.TRAINING_BUCKET
+    frames = [pd.read_csv(s3.get_object(Bucket=bucket, Key=module.COMBINED_CSV_FILENAME)["Body"])]
+    state = json.loads(s3.get_object(Bucket=bucket, Key=module.COMBINED_STATE_KEY)["Body"].read()) if (bucket, module.COMBINED_STATE_KEY) in s3.objects else {"parts": []}
+    frames += [pd.read_csv(s3.get_object(Bucket=bucket, Key=part)["Body"]) for part in state["parts"]]
+    frame = pd.concat(frames, ignore_index=True).drop_duplicates(subset=["timestamp"], keep="last")
+    return frame.sort_values("timestamp").reset_index(drop=True)
+
+def test_incremental_carbon_merge_matches_full_rebuild(monkeypatch, fake_s3, load_lambda):
+    module = load_lambda("ProcessCarbonFootprintData")
+    monkeypatch.setattr(module, "COMPACT_AFTER_PARTS", 3)
+    incremental, full = fake_s3(), fake_s3()
+    sources = {"sensehat": "timestamp,temperature,humidity,pressure\n", "waterflow": "timestamp,flow_rate,unit\n"}
+
+    def append_and_run(sensehat, waterflow):
+        sources["sensehat"] += sensehat
+        sources["waterflow"] += waterflow
+        results = []
+        for s3, mode in ((incremental, "incremental"), (full, "full")):
+            s3.put(module.SENSEHAT_BUCKET, module.SENSEHAT_CSV_FILENAME, sources["sensehat"])
+            s3.put(module.WATERFLOW_BUCKET, module.WATERFLOW_CSV_FILENAME, sources["waterflow"])
+            monkeypatch.setattr(module, "s3", s3)
+            monkeypatch.setattr(module, "MERGE_MODE", mode)
+            results.append(json.loads(module.lambda_handler({}, None)["body"]))
+        # Same rows, dtypes can differ as each part file is parsed on its own
+        pd.testing.assert_frame_equal(combined_view(module, incremental), combined_view(module, full), check_dtype=False)
+        return results[0]
+
+    assert append_and_run(*carbon_source_rows(0, 50))["result"] == "rebuilt"
+    # Appended rows only, the earlier bytes are not downloaded again
+    incremental.bytes_served = 0
+    assert append_and_run(*carbon_source_rows(50, 20, offset=3))["result"] == "appended"
+    assert incremental.bytes_served < 2 * module.PREFIX_CHECK_BYTES + 2000
+    # Only one source has new rows
+    assert append_and_run(*carbon_source_rows(70, 10)[:1], "")["parts"] == 2
+    assert append_and_run(*carbon_source_rows(80, 10))["result"] == "compacted"
+    assert not [key for bucket, key in incremental.objects if key.startswith(module.COMBINED_PARTS_PREFIX + "part-")]
+
+    # A late row older than the high water mark forces a rebuild
+    assert append_and_run(*carbon_source_rows(85, 10))["result"] == "rebuilt"
+    # So does rewriting a source instead of appending to it
+    sources["sensehat"] = sources["sensehat"].replace(",1013\n", ",1012\n", 1)
+    assert append_and_run(*carbon_source_rows(95, 4))["result"] == "rebuilt"
+
+def stream_record(sequence, device_id, timestamp, payload):
+    return {
+        "eventID": f"event-{sequence}",
+        "eventName": "INSERT",
+        "dynamodb": {
+            "SequenceNumber": str(sequence),
+            "NewImage": {"device_id": {"S": device_id}, "timestamp": {"S": timestamp}, "payload": {"M": payload}}
+        }
+    }
+
+def test_stream_lambda_batches_records_per_device_and_window(monkeypatch, fake_s3, load_lambda):
+    module = load_lambda("DynamoDBToS3")
+    s3 = fake_s3()
+    monkeypatch.setattr(module, "s3", s3)
+    monkeypatch.setattr(module, "threshold_table", MagicMock(scan=MagicMock(return_value={"Items": [{"temperature_range": [0, 50], "humidity_range": [0, 100], "flow_rate_range": 100}]})))
+    sensehat = {"temperature": {"N": "21.5"}, "humidity": {"N": "45"}, "pressure": {"N": "1013"}}
+    water = {"flow_rate": {"N": "3.5"}, "unit": {"S": "L/min"}}
+    records = [stream_record(i, "Main_Pi_SenseHat", f"2025-05-07T10:{i:02d}:00Z", sensehat) for i in range(50)]
+    records += [stream_record(100 + i, "Main_Pi_SenseHat", f"2025-05-07T11:{i:02d}:00Z", sensehat) for i in range(10)]
+    records += [stream_record(200 + i, "WaterSensor_1", f"2025-05-07T10:{i:02d}:00Z", water) for i in range(30)]
+    records.append({"eventName": "REMOVE", "dynamodb": {}})
+
+    assert module.lambda_handler({"Records": records}, None)["statusCode"] == 200
+    keys = sorted(key for _, key in s3.objects)
+    # One object per device and hour instead of one per reading
+    assert len(keys) == 3
+    assert keys[0].startswith("batches/Main_Pi_SenseHat/2025/05/07/1000-") and keys[0].endswith(".ndjson")
+    lines = s3.objects[(module.SENSEHAT_BUCKET, keys[0])][0].decode().splitlines()
+    assert len(lines) == 50
+    assert json.loads(lines[0])["temperature"] == 21.5
+    assert sum(1 for bucket, _ in s3.objects if bucket == module.WATERFLOW_BUCKET) == 1
+
+    # A retried invocation overwrites the same objects, as does a retry from a failed group onwards
+    module.lambda_handler({"Records": list(reversed(records))}, None)
+    module.lambda_handler({"Records": records[50:]}, None)
+    assert sorted(key for _, key in s3.objects) == keys
+    assert keys[0] == "batches/Main_Pi_SenseHat/2025/05/07/1000-0-49.ndjson"
+
+    # Failed uploads are reported per record so only they are retried
+    monkeypatch.setattr(module, "s3", MagicMock(put_object=MagicMock(side_effect=Exception("Slow down")), list_objects_v2=MagicMock(return_value={})))
+    response = module.lambda_handler({"Records": records[:3]}, None)
+    assert [failure["itemIdentifier"] for failure in response["batchItemFailures"]] == ["0", "1", "2"]
+
+def test_stream_lambda_retry_after_partial_failure(monkeypatch, fake_s3, load_lambda):
+    module = load_lambda("DynamoDBToS3")
+    s3, sns = fake_s3(), MagicMock()
+    monkeypatch.setattr(module, "sns", sns)
+    monkeypatch.setattr(module, "SNS_TOPIC_ARN", "arn:aws:sns:eu-west-1:0:alerts")
+    monkeypatch.setattr(module, "threshold_table", MagicMock(scan=MagicMock(return_value={"Items": [{"temperature_range": [18, 24], "humidity_range": [30, 60]}]})))
+    hot = {"temperature": {"N": "30"}, "humidity": {"N": "45"}, "pressure": {"N": "1013"}}
+    records = [
+        stream_record(100, "Main_Pi_SenseHat", "2025-05-07T10:00:00Z", hot),
+        stream_record(200, "bedroom_pi_1", "2025-05-07T10:01:00Z", hot),
+        stream_record(300, "Main_Pi_SenseHat", "2025-05-07T10:02:00Z", hot),
+        stream_record(400, "bedroom_pi_1", "2025-05-07T10:03:00Z", hot),
+    ]
+
+    # The bedroom bucket is unavailable, the Main_Pi group is stored and alerted on
+    def put_object(Bucket, Key, Body, **kwargs):
+        if Bucket == module.BEDROOM1_BUCKET:
+            raise Exception("Slow down")
+        s3.put(Bucket, Key, Body)
+    monkeypatch.setattr(module, "s3", MagicMock(put_object=put_object, list_objects_v2=s3.list_objects_v2))
+    response = module.lambda_handler({"Records": records}, None)
+    assert [failure["itemIdentifier"] for failure in response["batchItemFailures"]] == ["200", "400"]
+    assert sns.publish.call_count == 1 and "bedroom" not in sns.publish.call_args.kwargs["Message"]
+
+    # Lambda retries from the lowest failed record, Main_Pi seq 300 comes back but is already stored
+    monkeypatch.setattr(module, "s3", s3)
+    assert "batchItemFailures" not in module.lambda_handler({"Records": records[1:]}, None)
+    assert sorted(key for _, key in s3.objects) == [
+        "batches/Main_Pi_SenseHat/2025/05/07/1000-100-300.ndjson",
+        "batches/bedroom_pi_1/2025/05/07/1000-200-400.ndjson"
+    ]
+    assert sns.publish.call_count == 2
+    assert "Main_Pi" not in sns.publish.call_args.kwargs["Message"] and "bedroom_pi_1" in sns.publish.call_args.kwargs["Message"]
+
+    # Replaying the whole batch again writes and sends nothing
+    module.lambda_handler({"Records": records}, None)
+    assert len(s3.objects) == 2 and sns.publish.call_count == 2
+
+def test_stream_lambda_caches_thresholds_and_checks_batch(monkeypatch, fake_s3, load_lambda):
+    module = load_lambda("DynamoDBToS3")
+    s3, sns = fake_s3(), MagicMock()
+    table = MagicMock(scan=MagicMock(return_value={"Items": [{"temperature_range": [18, 24], "humidity_range": [30, 60], "flow_rate_threshold": 5}]}))
+    monkeypatch.setattr(module, "s3", s3)
+    monkeypatch.setattr(module, "sns", sns)
+    monkeypatch.setattr(module, "threshold_table", table)
+    monkeypatch.setattr(module, "SNS_TOPIC_ARN", "arn:aws:sns:eu-west-1:0:alerts")
+    records = [stream_record(i, "bedroom_pi_2", f"2025-05-07T10:{i:02d}:00Z", {"temperature": {"N": str(20 + i % 8)}, "humidity": {"N": "45"}, "pressure": {"N": "1013"}}) for i in range(40)]
+    records += [stream_record(100 + i, "WaterSensor_1", f"2025-05-07T10:{i:02d}:00Z", {"flow_rate": {"N": str(i)}, "unit": {"S": "L/min"}}) for i in range(10)]
+    records.append(stream_record(200, "Main_Pi_SenseHat", "2025-05-07T10:00:00Z", {"temperature": {"N": "40"}, "humidity": {"N": "45"}, "pressure": {"N": "1013"}, "exceeded_thresholds": {"L": [{"S": "temperature_high"}]}}))
+
+    module.lambda_handler({"Records": records}, None)
+    # A retry of readings already stored does not alert again
+    module.lambda_handler({"Records": records}, None)
+    # One scan per container and one alert per batch, not one of each per record
+    assert table.scan.call_count == 1
+    assert sns.publish.call_count == 1
+    assert "water_usage_high" in sns.publish.call_args.kwargs["Subject"]
+
+    readings = [json.loads(line) for (bucket, key), (body, _) in s3.objects.items() for line in body.decode().splitlines()]
+    hot = [r for r in readings if r["device_id"] == "bedroom_pi_2" and r.get("exceeded_thresholds")]
+    assert len(hot) == 15 and all(r["exceeded_thresholds"] == ["temperature_high"] and r["severity"] == "critical" for r in hot)
+    water = [r for r in readings if r["device_id"] == "WaterSensor_1" and r.get("exceeded_thresholds")]
+    assert [r["flow_rate"] for r in water] == [6.0, 7.0, 8.0, 9.0]
+    assert next(r for r in readings if r["device_id"] == "Main_Pi_SenseHat")["exceeded_thresholds"] == ["temperature_high"]
+
+    # Refreshed once the TTL has passed, and readings after the stored ones still alert
+    module.threshold_cache["loaded_at"] -= module.THRESHOLD_CACHE_TTL + 1
+    module.lambda_handler({"Records": records[:40] + [stream_record(40, "bedroom_pi_2", "2025-05-07T10:40:00Z", {"temperature": {"N": "30"}, "humidity": {"N": "45"}, "pressure": {"N": "1013"}})]}, None)
+    assert table.scan.call_count == 2
+    assert sns.publish.call_count == 2
+    assert "10:40:00" in sns.publish.call_args.kwargs["Message"] and "10:07:00" not in sns.publish.call_args.kwargs["Message"]
+
+"""DynamoDB Reader Testing"""
+class FakeDynamoTable:
+    """Sorted items for one partition, answering query with pages of at most Limit items"""
+    def __init__(self, items, max_page=None):
+        self.items = sorted(items, key=lambda item: item["timestamp"])
+        self.max_page = max_page
+        self.calls = []
+
+    def _matches(self, condition, item):
+        expression = condition.get_expression()
+        operator, values = expression["operator"], expression["values"]
+        if operator == "AND":
+            return all(self._matches(value, item) for value in values)
+        value = item.get(values[0].name)
+        if operator == "BETWEEN":
+            return values[1] <= value <= values[2]
+        return {"=": value == values[1], ">=": value >= values[1], "<=": value <= values[1]}[operator]
+
+    def query(self, **kwargs):
+        self.calls.append(kwargs)
+        items = [item for item in self.items if self._matches(kwargs["KeyConditionExpression"], item)]
+        forward = kwargs.get("ScanIndexForward", True)
+        if not forward:
+            items.reverse()
+        if "ExclusiveStartKey" in kwargs:
+            start = kwargs["ExclusiveStartKey"]["timestamp"]
+            items = [item for item in items if (item["timestamp"] > start if forward else item["timestamp"] < start)]
+        page_size = min(kwargs.get("Limit") or len(items), self.max_page or len(items))
+        page = items[:page_size]
+        last_key = {key: page[-1][key] for key in ("id", "device_id", "timestamp") if page and key in page[-1]}
+        if "ProjectionExpression" in kwargs:
+            names = kwargs["ExpressionAttributeNames"]
+            projected = []
+            for item in page:
+                result = {}
+                for path in kwargs["ProjectionExpression"].split(", "):
+                    parts = [names[part] for part in path.split(".")]
+                    if parts[0] in item and (len(parts) == 1 or isinstance(item[parts[0]], dict) and parts[1] in item[parts[0]]):
+                        if len(parts) == 1:
+                            result[parts[0]] = item[parts[0]]
+                        else:
+                            result.setdefault(parts[0], {})[parts[1]] = item[parts[0]][parts[1]]
+                projected.append(result)
+            page = projected
+        response = {"Items": page}
+        if len(items) > page_size:
+            response["LastEvaluatedKey"] = last_key
+        return response
+
+def dynamo_items(count, start=datetime(2025, 5, 1)):
+    return [{
+        "device_id": "Main_Pi",
+        "timestamp": (start + timedelta(minutes=i)).isoformat(),
+        "payload": {"temperature": 20 + i % 5, "humidity": 45, "pressure": 1013, "imu": {"x": 1}}
+    } for i in range(count)]
+
+def test_dynamo_reader_paginates_and_projects():
+    from dynamo_reader import query_items, query_items_parallel
+    table = FakeDynamoTable(dynamo_items(2500), max_page=400)
+    start, end = datetime(2025, 5, 1, 10), datetime(2025, 5, 2, 10)
+
+    items = list(query_items(table, "device_id", "Main_Pi", start=start, end=end, attributes=["payload.temperature"], page_size=1000))
+    # Everything in range across every page, not just the first 1MB
+    assert len(items) == 1441 and len(table.calls) == 4
+    assert items[0] == {"device_id": "Main_Pi", "timestamp": "2025-05-01T10:00:00", "payload": {"temperature": 20}}
+    # timestamp is a reserved word so it only appears through a placeholder
+    assert "timestamp" not in table.calls[0]["ProjectionExpression"]
+
+    parallel = list(query_items_parallel(table, "device_id", "Main_Pi", start, end, segments=4, attributes=["payload.temperature"], page_size=100))
+    assert parallel == items
+
+    # Stopping early does not read the rest of the range
+    table.calls.clear()
+    assert len(list(query_items(table, "device_id", "Main_Pi", start=start, page_size=100, limit=150))) == 150
+    assert len(table.calls) == 2
+
+def test_report_sensor_data_reads_every_page(monkeypatch):
+    import reports
+    monkeypatch.setattr(reports, "sensor_table", FakeDynamoTable(dynamo_items(3000), max_page=500))
+    monkeypatch.setattr(reports, "THING_NAME", "Main_Pi")
+    data = reports.fetch_sensor_data(datetime(2025, 5, 1), datetime(2025, 5, 4), ["temperature"])
+    assert len(data) == 3000
+    assert data[-1] == {"timestamp": "2025-05-03T01:59:00", "temperature": 24.0}
+
+def test_alert_queries_use_indexes_with_cursor():
+    from alert_index import find_alerts, alert_month
+    alerts = [{
+        "id": f"alert-{i}",
+        "timestamp": (datetime(2025, 1, 1) + timedelta(hours=12 * i)).isoformat(),
+        "severity": "critical" if i % 3 == 0 else "warning"
+    } for i in range(200)]
+    for alert in alerts:
+        alert["alert_month"] = alert_month(alert["timestamp"])
+    table = FakeDynamoTable(alerts)
+    table.scan = MagicMock(side_effect=AssertionError("alerts should not be scanned"))
+    since, until = datetime(2025, 1, 10), datetime(2025, 3, 20)
+    expected = sorted([a for a in alerts if since.isoformat() <= a["timestamp"] <= until.isoformat()], key=lambda a: a["timestamp"], reverse=True)
+
+    # Pages of 25 across month partitions, newest first, until the cursor runs out
+    seen, cursor = [], None
+    while True:
+        page, cursor = find_alerts(table, since, until, limit=25, cursor=cursor)
+        assert len(page) <= 25
+        seen.extend(page)
+        if not cursor:
+            break
+    assert seen == expected
+    assert {call["IndexName"] for call in table.calls} == {"month-timestamp-index"}
+
+    critical, cursor = find_alerts(table, since, until, severity="critical", limit=500)
+    assert critical == [a for a in expected if a["severity"] == "critical"] and cursor is None
+    assert table.calls[-1]["IndexName"] == "severity-timestamp-index"
+
+def test_alerts_fall_back_to_scan_before_migration():
+    from alert_index import find_alerts
+    from botocore.exceptions import ClientError
+    table = MagicMock()
+    table.query.side_effect = ClientError({"Error": {"Code": "ValidationException", "Message": "The table does not have the specified index"}}, "Query")
+    table.scan.return_value = {"Items": [{"id": "a", "timestamp": "2025-01-01T00:00:00"}, {"id": "b", "timestamp": "2025-02-01T00:00:00"}]}
+    alerts, cursor = find_alerts(table, severity="critical")
+    assert [a["id"] for a in alerts] == ["b", "a"] and cursor is None
+    assert "FilterExpression" in table.scan.call_args.kwargs
+
+def test_alerts_endpoint_pages_with_cursor(client, monkeypatch):
+    from alert_index import alert_month
+    monkeypatch.setattr("backend.verify_token", lambda token: (True, {"sub": "user"}))
+    alerts = [{"id": f"alert-{i}", "timestamp": (datetime(2025, 4, 1) + timedelta(hours=i)).isoformat(), "severity": "warning"} for i in range(30)]
+    for alert in alerts:
+        alert["alert_month"] = alert_month(alert["timestamp"])
+    monkeypatch.setattr("backend.dynamodb", MagicMock(Table=MagicMock(return_value=FakeDynamoTable(alerts))))
+    headers = {"Authorization": "Bearer dummy-token"}
+
+    response = client.get("/api/alerts?since=2025-04-01T00:00:00&until=2025-04-30T00:00:00&limit=20", headers=headers)
+    assert response.status_code == 200
+    assert len(response.json) == 20 and response.json[0]["id"] == "alert-29"
+    response = client.get(f"/api/alerts?since=2025-04-01T00:00:00&until=2025-04-30T00:00:00&limit=20&cursor={response.headers['X-Next-Cursor']}", headers=headers)
+    assert [a["id"] for a in response.json] == [f"alert-{i}" for i in range(9, -1, -1)]
+    assert "X-Next-Cursor" not in response.headers
+
+    assert client.get("/api/alerts?since=yesterday", headers=headers).status_code == 400
+    assert client.get("/api/alerts?limit=many", headers=headers).status_code == 400
+
+    # Both alert routes read the same parameters, severity=all is every severity on either
+    monkeypatch.setattr("backend.alert_table", FakeDynamoTable(alerts))
+    response = client.get("/api/alerts-dynamodb?since=2025-04-01T00:00:00&until=2025-04-30T00:00:00&severity=all", headers=headers)
+    assert response.status_code == 200 and len(response.json) == 30
+
+"""Ingest Buffer Testing"""
+class RecordingCollection:
+    def __init__(self, fail_times=0):
+        self.batches = []
+        self.fail_times = fail_times
+
+    def insert_many(self, documents, ordered=True):
+        if self.fail_times:
+            self.fail_times -= 1
+            raise Exception("Connection reset")
+        self.batches.append(list(documents))
+
+    def insert_one(self, document):
+        self.batches.append([document])
+
+def test_ingest_buffer_flush_durability():
+    from ingest_buffer import IngestBuffer
+    collection = RecordingCollection()
+    buffer = IngestBuffer(durability="flush").start()
+    try:
+        document_id = buffer.submit(collection, {"room_id": "kitchen", "temperature": 21.0})
+        # With ack-after-flush the document is stored by the time submit returns
+        assert collection.batches[0][0]["_id"] == document_id
+    finally:
+        buffer.close()
+
+def test_ingest_buffer_size_and_time_triggers():
+    from ingest_buffer import IngestBuffer
+    collection = RecordingCollection()
+    buffer = IngestBuffer(durability="enqueue", max_batch_size=5, flush_interval=0.2).start()
+    try:
+        for i in range(12):
+            buffer.submit(collection, {"room_id": "kitchen", "temperature": i})
+        assert buffer.flush(timeout=2)
+        assert [len(batch) for batch in collection.batches] == [5, 5, 2]
+        metrics = buffer.metrics()
+        assert metrics["flushed"] == 12
+        assert metrics["queue_depth"] == 0
+        assert metrics["flushes"] == 3
+    finally:
+        buffer.close()
+
+def test_ingest_buffer_retries_and_drains_on_close():
+    from ingest_buffer import IngestBuffer
+    collection = RecordingCollection(fail_times=1)
+    buffer = IngestBuffer(durability="enqueue", flush_interval=5, retry_delay=0).start()
+    for i in range(3):
+        buffer.submit(collection, {"room_id": "kitchen", "temperature": i})
+    buffer.close()
+    # Closing drains the open batch and the failed first attempt is retried
+    assert sum(len(batch) for batch in collection.batches) == 3
+    assert buffer.metrics()["failed"] == 0
+
+def test_lttb_keeps_shape():
+    import numpy as np
+    from downsampling import lttb
+    x = np.arange(1000, dtype=float)
+    y = np.sin(x / 50)
+    y[500] = 10 # A spike that every-Nth sampling would miss
+
+    selected = lttb(x, y, 100)
+    assert len(selected) == 100
+    assert selected[0] == 0 and selected[-1] == 999
+    assert 500 in selected
+    assert list(selected) == sorted(selected)
+
+def test_historical_data_downsampled(client, monkeypatch):
+    from backend import sensor_data_collection
+    monkeypatch.setattr("backend.verify_token", lambda token: (True, {"sub": "test_user", "email": "test@example.com"}))
+    start = datetime.now() - timedelta(days=2)
+    sensor_data_collection.insert_many([
+        {"timestamp": start + timedelta(minutes=5 * i), "downsample_test": 20 + (i % 10)} for i in range(500)
+    ])
+    try:
+        for mode in ("bucket", "lttb"):
+            response = client.get(f'/api/historical-data?data_type=downsample_test&days=3&points=50&mode={mode}', headers={"Authorization": "Bearer dummy-token"})
+            assert response.status_code == 200
+            points = response.json["historical_data"]
+            assert 5 <= len(points) <= 50
+            timestamps = [point["timestamp"] for point in points]
+            assert timestamps == sorted(timestamps)
+
+        response = client.get('/api/historical-data?data_type=downsample_test&points=1', headers={"Authorization": "Bearer dummy-token"})
+        assert response.status_code == 400
+    finally:
+        sensor_data_collection.delete_many({"downsample_test": {"$exists": True}})
+
+def test_rollups_incremental_matches_compaction(monkeypatch):
+    import numpy as np
+    from backend import db
+    from rollups import RollupStore, summarise_buckets
+    raw, incremental, compacted = db.rollup_test_raw, db.rollup_test_incremental, db.rollup_test_compacted
+    start = datetime(2025, 3, 1, 10, 0, 0)
+    readings = [
+        {"room_id": room, "timestamp": start + timedelta(seconds=37 * i), "temperature": 20 + (i % 13) * 0.5, "humidity": 40 + i % 7}
+        for i in range(200) for room in ("kitchen", "bedroom")
+    ]
+    try:
+        raw.insert_many([dict(r) for r in readings])
+        RollupStore(incremental).update_from_documents(readings[:150])
+        RollupStore(incremental).update_from_documents(readings[150:])
+        RollupStore(compacted).compact(raw, start, start + timedelta(days=1))
+
+        end = start + timedelta(hours=6)
+        for resolution in ("1m", "1h", "1d"):
+            a = RollupStore(incremental).read("temperature", start, end, resolution=resolution)
+            b = RollupStore(compacted).read("temperature", start, end, resolution=resolution)
+            assert [x["count"] for x in a] == [x["count"] for x in b]
+            assert np.allclose([x["sum"] for x in a], [x["sum"] for x in b])
+
+        # Statistics from the rollups match the raw values
+        values = np.array([r["temperature"] for r in readings if r["room_id"] == "kitchen"])
+        stats = summarise_buckets(RollupStore(incremental).read("temperature", start, end, room_id="kitchen", resolution="1h"))
+        assert stats["count"] == len(values)
+        assert stats["min"] == values.min() and stats["max"] == values.max()
+        assert np.isclose(stats["avg"], values.mean())
+        assert np.isclose(stats["std"], values.std())
+
+        # Rollups only cover a range when nothing older is left in the raw readings
+        store = RollupStore(incremental)
+        assert store.earliest("temperature") == start
+        assert store.covers("temperature", start + timedelta(minutes=5))
+        assert store.covers("temperature", start - timedelta(days=1), raw)
+        assert not store.covers("temperature", start - timedelta(days=1))
+        raw.insert_one({"room_id": "kitchen", "timestamp": start - timedelta(hours=3), "temperature": 18.0})
+        assert not store.covers("temperature", start - timedelta(days=1), raw)
+        assert not store.covers("pressure", start)
+
+        # Long room reports take their statistics from the rollups, scoped to that room
+        import reports
+        monkeypatch.setattr(reports, "rollup_store", store)
+        with patch('reports.fetch_sensor_data', return_value=[{"timestamp": start.isoformat(), "temperature": 99.0}]), \
+                patch('reports.fetch_water_data', return_value=[]), patch('reports.fetch_alerts', return_value=[]):
+            report, _ = generate_report_data("test_user", ["temperature"], start, start + timedelta(days=7), room_id="kitchen")
+            assert report["summary"]["temperature"]["source"] == "rollups"
+            assert report["summary"]["temperature"]["count"] == len(values)
+            assert np.isclose(report["summary"]["temperature"]["avg"], values.mean())
+            # Without a room, or when the rollups start after the range, the fetched rows are used
+            for room_id, range_start in ((None, start), ("kitchen", start - timedelta(days=1))):
+                report, _ = generate_report_data("test_user", ["temperature"], range_start, start + timedelta(days=7), room_id=room_id)
+                assert report["summary"]["temperature"]["avg"] == 99.0 and "source" not in report["summary"]["temperature"]
+    finally:
+        raw.drop()
+        incremental.drop()
+        compacted.drop()
+
+def test_rollup_resolution_choice():
+    from rollups import RollupStore
+    store = RollupStore(MagicMock())
+    now = datetime(2025, 3, 1)
+    assert store.choose_resolution(now - timedelta(hours=2), now)[0] == "1m"
+    assert store.choose_resolution(now - timedelta(days=7), now)[0] == "1h"
+    assert store.choose_resolution(now - timedelta(days=365), now)[0] == "1d"
+
+    # 7 days at 100 points reads the hourly buckets and merges them, instead of 8 daily ones
+    hourly = [{"bucket_start": now - timedelta(days=7) + timedelta(hours=h), "count": 2, "sum": 40.0, "sumsq": 800.0, "min": 19.0, "max": 21.0} for h in range(168)]
+    store.collection.find.return_value.sort.return_value = hourly
+    buckets = store.read("temperature", now - timedelta(days=7), now, max_points=100)
+    assert store.collection.find.call_args.args[0]["resolution"] == "1h"
+    assert 90 <= len(buckets) <= 100
+    assert sum(bucket["count"] for bucket in buckets) == 336 and all(bucket["mean"] == 20.0 for bucket in buckets)
+
+def test_provision_in_background_uses_short_timeout(monkeypatch):
+    import db_indexes
+    clients = []
+    def fake_client(uri, **options):
+        clients.append((uri, options))
+        return MagicMock()
+    provisioned = []
+    monkeypatch.setattr(db_indexes, "MongoClient", fake_client)
+    monkeypatch.setattr(db_indexes, "provision", lambda db: provisioned.append(db))
+    db_indexes.provision_in_background("mongodb://example", timeout_ms=1000).join(timeout=5)
+    assert clients == [("mongodb://example", {"serverSelectionTimeoutMS": 1000})]
+    assert len(provisioned) == 1
+
+def test_ensure_indexes_specs():
+    import db_indexes
+    db = MagicMock()
+    db.__getitem__.return_value.create_index.side_effect = lambda keys, **options: options["name"]
+    created = db_indexes.ensure_indexes(db, sensor_retention_days=30)
+    assert "sensor_data.room_id_timestamp" in created
+    assert "sensor_data.temperature_timestamp" in created
+    assert "query_logs.timestamp_ttl" in created
+    assert "alert_dedup.expires_at_ttl" in created
+    assert "stream_tickets.expires_at_ttl" in created
+
+    calls = {c.kwargs["name"]: c for c in db.__getitem__.return_value.create_index.call_args_list}
+    assert calls["timestamp_ttl"].kwargs["expireAfterSeconds"] in (30 * 86400, 90 * 86400)
+    assert calls["humidity_timestamp"].kwargs["partialFilterExpression"] == {"humidity": {"$exists": True}}
+
+def test_verify_query_plans_flags_collscan():
+    import db_indexes
+    indexed = {"queryPlanner": {"winningPlan": {"stage": "LIMIT", "inputStage": {"stage": "FETCH", "inputStage": {"stage": "IXSCAN"}}}}}
+    scanned = {"queryPlanner": {"winningPlan": {"stage": "SORT", "inputStage": {"stage": "COLLSCAN"}}}}
+    db = MagicMock()
+    db.__getitem__.side_effect = lambda name: MagicMock(**{
+        "find.return_value.sort.return_value.limit.return_value.explain.return_value": scanned if name == "anomalies" else indexed,
+        "find.return_value.limit.return_value.explain.return_value": indexed
+    })
+    db.command.return_value = {"queryPlanner": {"winningPlan": {"stage": "PROJECTION_COVERED", "inputStage": {"stage": "DISTINCT_SCAN"}}}}
+    assert db_indexes.verify_query_plans(db) == ["recent anomalies for room"]
+
 """Sensor Testing from the SenseHAT"""
 
 def test_calibrate_temperature_high_humidity(monkeypatch):
@@ -208,6 +1239,285 @@ def test_calibrate_temperature_no_cpu(monkeypatch):
     calibrated = calibrate_temperature(raw_temp)
     assert round(calibrated, 1) == 35.4
 
+def test_cpu_temperature_monitor_smooths_without_file_reads(tmp_path):
+    from cpu_calibration import CpuTemperatureMonitor, read_cpu_temperature
+    temp_file = tmp_path / "temp"
+    temp_file.write_text("50000\n")
+    reads = []
+    def reader(path):
+        reads.append(path)
+        return read_cpu_temperature(path)
+
+    monitor = CpuTemperatureMonitor(path=str(temp_file), refresh_interval=60, window=2, reader=reader)
+    try:
+        assert monitor.value == 50.0
+        # Reads come from the published value, not the file
+        for _ in range(100):
+            monitor.value
+        assert len(reads) == 1
+
+        temp_file.write_text("54000\n")
+        assert monitor.refresh() == 52.0
+        temp_file.write_text("56000\n")
+        assert monitor.refresh() == 55.0
+    finally:
+        monitor.close()
+
+    assert CpuTemperatureMonitor(path=str(tmp_path / "missing")).refresh() is None
+
+def test_model_registry_reuses_and_refits_models():
+    import numpy as np
+    from forecast_registry import ModelRegistry, fit_models
+    fits = []
+    def counting_fit(timestamps, values):
+        fits.append(len(values))
+        return fit_models(timestamps, values)
+    registry = ModelRegistry(fit=counting_fit, min_new_points=5)
+    timestamps = list(pd.date_range("2025-01-01", periods=120, freq="h"))
+    values = 20 + np.sin(np.arange(120) / 6.0)
+
+    models, status = registry.get(("temperature", "Main_Pi"), timestamps[:100], values[:100])
+    assert status == "fitted"
+    assert models.forecast(3) is models.forecast(3)  # memoised per horizon
+    assert registry.get(("temperature", "Main_Pi"), timestamps[:100], values[:100]) == (models, "hit")
+    # A couple of new points keep the old models
+    assert registry.get(("temperature", "Main_Pi"), timestamps[2:102], values[2:102]) == (models, "hit")
+
+    # Enough new points refit in the background while the old models are served
+    assert registry.get(("temperature", "Main_Pi"), timestamps[10:110], values[10:110]) == (models, "refreshing")
+    registry.wait()
+    refreshed, status = registry.get(("temperature", "Main_Pi"), timestamps[10:110], values[10:110])
+    assert status == "hit" and refreshed is not models and refreshed.timestamps[-1] == timestamps[109]
+
+    # Changed history is refit straight away
+    changed = values.copy()
+    changed[105] += 5
+    assert registry.get(("temperature", "Main_Pi"), timestamps[10:110], changed[10:110])[1] == "fitted"
+    assert fits == [100, 100, 100]
+    assert registry.stats == {"hits": 4, "misses": 1, "background_refits": 1, "sync_refits": 1, "evictions": 0}
+
+    # Only the most recently used series are kept
+    from forecast_registry import FittedModels
+    small = ModelRegistry(fit=lambda timestamps, values: FittedModels(timestamps, values, None, None, 0), max_entries=2)
+    for device in ("a", "b", "a", "c"):
+        small.get(("temperature", device), timestamps[:3], values[:3])
+    assert list(small._models) == [("temperature", "a"), ("temperature", "c")]
+    assert small.stats["evictions"] == 1
+
+def test_batch_forecast_matches_per_series_models():
+    import numpy as np
+    from statsmodels.tsa.arima.model import ARIMA
+    from batch_forecast import BatchForecaster, forecast_ar_diff, forecast_holt
+    rng = np.random.default_rng(7)
+    # Random walks whose differences follow AR(1) processes with different coefficients
+    matrix = np.zeros((4, 300))
+    for row, phi in enumerate((-0.5, 0.0, 0.4, 0.8)):
+        diffs = np.zeros(300)
+        for t in range(1, 300):
+            diffs[t] = phi * diffs[t - 1] + rng.normal()
+        matrix[row] = 20 + np.cumsum(diffs)
+
+    batch = forecast_ar_diff(matrix, 12)
+    assert batch.shape == (4, 12)
+    for row in range(4):
+        single = ARIMA(matrix[row], order=(1, 1, 0)).fit().forecast(steps=12)
+        assert np.allclose(batch[row], single, atol=0.5)
+
+    # Holt follows a straight line exactly
+    line = np.vstack([np.arange(50) * 0.5 + 10, np.full(50, 3.0)])
+    assert np.allclose(forecast_holt(line, 3), [[35, 35.5, 36], [3, 3, 3]])
+
+    # Chunked across the process pool gives the same forecasts as one pass
+    forecaster = BatchForecaster(workers=2, chunk_size=1)
+    try:
+        assert np.allclose(forecaster.forecast_matrix(matrix, 12), batch)
+    finally:
+        forecaster.close()
+
+def test_batch_forecast_frame_is_cached():
+    import numpy as np
+    from batch_forecast import BatchForecaster
+    timestamps = pd.date_range("2025-01-01", periods=48, freq="h")
+    rows = [
+        {"room_id": room, "metric": metric, "timestamp": t, "value": 20 + i * 0.1}
+        for room in ("kitchen", "office") for metric in ("temperature", "humidity")
+        for i, t in enumerate(timestamps)
+        if not (room == "office" and i % 5 == 0)  # gaps are filled
+    ]
+    forecaster = BatchForecaster(workers=1)
+    series = forecaster.forecast_frame(pd.DataFrame(rows), 6)
+    assert [(s["room_id"], s["metric"]) for s in series] == [("kitchen", "humidity"), ("kitchen", "temperature"), ("office", "humidity"), ("office", "temperature")]
+    assert series[0]["forecast"][0] == {"timestamp": "2025-01-03T00:00:00", "predicted_value": 24.8}
+    assert forecaster.forecast_frame(pd.DataFrame(rows), 6) is series
+    # New data changes the fingerprint
+    rows.append({"room_id": "kitchen", "metric": "humidity", "timestamp": timestamps[-1] + pd.Timedelta(hours=1), "value": 30})
+    assert forecaster.forecast_frame(pd.DataFrame(rows), 6) is not series
+    assert forecaster.stats == {"hits": 1, "misses": 2}
+
+def test_batch_predictive_analysis_endpoint(client, monkeypatch):
+    monkeypatch.setattr("backend.verify_token", lambda token: (True, {"sub": "test_user"}))
+    start = datetime(2025, 1, 1)
+    rows = [{"room_id": "kitchen", "metric": "temperature", "timestamp": start + pd.Timedelta(hours=i), "value": 21.0} for i in range(24)]
+    store = MagicMock()
+    store.read_series.return_value = rows
+    monkeypatch.setattr("backend.rollup_store", store)
+    headers = {"Authorization": "Bearer dummy-token"}
+    response = client.get("/api/predictive-analysis/batch?hours=3&metrics=temperature", headers=headers)
+    assert response.status_code == 200
+    assert response.json["series_count"] == 1
+    assert [point["predicted_value"] for point in response.json["series"][0]["forecast"]] == [21.0, 21.0, 21.0]
+    assert store.read_series.call_args.kwargs["metrics"] == ["temperature"]
+    assert client.get("/api/predictive-analysis/batch?hours=0", headers=headers).status_code == 400
+    assert client.get("/api/predictive-analysis/batch?hours=six", headers=headers).status_code == 400
+    assert client.get("/api/predictive-analysis/batch?history_days=1.5", headers=headers).status_code == 400
+
+def test_detect_anomalies_batch_matches_single_readings(tmp_path, fitted_device_model):
+    model = fitted_device_model(tmp_path)
+    readings = [
+        {"temperature": 22.1, "humidity": 44, "pressure": 1012},
+        {"temperature": 35, "humidity": 90, "pressure": 990},
+        {"temperature": 150, "humidity": 45},  # out of range and missing values use the defaults
+        {"temperature": 21.5, "humidity": 47, "pressure": 1014}
+    ]
+    batch = model.detect_anomalies_batch(readings)
+    assert batch["prediction_model"] == "isolation_forest" and batch["count"] == 4
+    for row, reading in enumerate(readings):
+        single = model.detect_anomalies(reading)
+        assert batch["is_anomaly"][row] == single["is_anomaly"]
+        assert batch["anomaly_score"][row] == pytest.approx(single["anomaly_score"])
+        assert batch["confidence"][row] == pytest.approx(single["confidence"])
+    assert batch["is_anomaly"][1] and batch["anomaly_count"] == sum(batch["is_anomaly"])
+
+    # Columns give the same results as records
+    columns = {name: [reading.get(name) for reading in readings] for name in ("temperature", "humidity", "pressure")}
+    assert model.detect_anomalies_batch(columns)["anomaly_score"] == batch["anomaly_score"]
+    assert model.detect_anomalies_batch([])["count"] == 0
+    with pytest.raises(ValueError):
+        model.detect_anomalies_batch({"temperature": [20, 21], "humidity": [40]})
+
+def test_anomaly_detection_batch_endpoint(client, monkeypatch, tmp_path, fitted_device_model):
+    monkeypatch.setattr("backend.verify_token", lambda token: (True, {"sub": "test_user"}))
+    monkeypatch.setattr("backend.device_ml_model", fitted_device_model(tmp_path))
+    headers = {"Authorization": "Bearer dummy-token"}
+    anomalies = MagicMock()
+    monkeypatch.setattr("backend.db", MagicMock(anomalies=anomalies))
+    readings = [{"temperature": 22, "humidity": 45, "pressure": 1013, "room_id": "kitchen"}, {"temperature": 40, "humidity": 95, "pressure": 950, "room_id": "office"}]
+    response = client.post("/api/anomaly-detection/batch", json={"readings": readings}, headers=headers)
+    assert response.status_code == 200
+    assert response.json["is_anomaly"] == [False, True]
+    stored = anomalies.insert_many.call_args.args[0]
+    assert [document["room_id"] for document in stored] == ["office"]
+
+    assert client.post("/api/anomaly-detection/batch", json={"temperature": [22, 40], "humidity": [45, 95], "pressure": [1013, 950]}, headers=headers).json["is_anomaly"] == [False, True]
+    monkeypatch.setattr("backend.MAX_ANOMALY_BATCH", 1)
+    assert client.post("/api/anomaly-detection/batch", json={"readings": readings}, headers=headers).status_code == 400
+    monkeypatch.setattr("backend.MAX_ANOMALY_BATCH", 100)
+
+    # Window anomalies are merged and stored the same way as on the single reading endpoint
+    model = fitted_device_model(tmp_path)
+    model.window_model = MagicMock()
+    model.detect_window_anomalies = lambda readings: {"is_anomaly": [True, False], "anomaly_score": [0.9, 0.1]}
+    monkeypatch.setattr("backend.device_ml_model", model)
+    response = client.post("/api/anomaly-detection/batch", json={"readings": readings}, headers=headers)
+    assert response.json["is_anomaly"] == [True, True] and response.json["anomaly_count"] == 2
+    assert response.json["window_anomaly"] == [True, False]
+    stored = anomalies.insert_many.call_args.args[0]
+    assert [(document["room_id"], document["window_anomaly"]) for document in stored] == [("kitchen", True), ("office", False)]
+
+def test_forest_scorer_matches_isolation_forest(tmp_path):
+    import sys
+    import subprocess
+    import numpy as np
+    from sklearn.ensemble import IsolationForest
+    from forest_scorer import ForestScorer, save_forest
+    rng = np.random.default_rng(11)
+    X = rng.normal(size=(800, 3)) * [2, 10, 5] + [22, 45, 1013]
+    test_rows = rng.normal(size=(2000, 3)) * [5, 25, 12] + [22, 45, 1013]
+    for options in ({"contamination": 0.05}, {"max_features": 2}):
+        model = IsolationForest(random_state=42, **options).fit(X)
+        save_forest(model, tmp_path / "forest.npz")
+        scorer = ForestScorer.load(tmp_path / "forest.npz")
+        assert np.allclose(scorer.score_samples(test_rows), model.score_samples(test_rows), rtol=0, atol=1e-12)
+        assert (scorer.predict(test_rows) == model.predict(test_rows)).all()
+    with pytest.raises(ValueError):
+        scorer.score_samples(test_rows[:, :2])
+
+    # The shipped arrays are an export of the shipped model
+    import pickle
+    models_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "models")
+    with open(os.path.join(models_dir, "isolation_forest.pkl"), "rb") as f:
+        shipped = pickle.load(f)
+    shipped_arrays = ForestScorer.load(os.path.join(models_dir, "isolation_forest.npz"))
+    assert np.allclose(shipped_arrays.score_samples(test_rows), shipped.score_samples(test_rows), rtol=0, atol=1e-12)
+
+    # Devices load the arrays and skip the placeholder TFLite file without scikit-learn or TensorFlow
+    (tmp_path / "placeholder.tflite").write_bytes(b"PLACEHOLDER")
+    script = (
+        "import sys; from device_ml import DeviceMLModel; "
+        f"model = DeviceMLModel(model_path={str(tmp_path / 'placeholder.tflite')!r}, fallback_model_path='missing.pkl', forest_arrays_path={str(tmp_path / 'forest.npz')!r}); "
+        "result = model.detect_anomalies_batch([{'temperature': 22, 'humidity': 45, 'pressure': 1013}]); "
+        "print(result['prediction_model'], 'sklearn' in sys.modules, 'tensorflow' in sys.modules)"
+    )
+    output = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+    assert output.stdout.split() == ["isolation_forest", "False", "False"]
+
+def test_window_feature_store_tracks_device_windows():
+    import numpy as np
+    from window_features import WindowFeatureStore, feature_names
+    rng = np.random.default_rng(4)
+    seconds = np.arange(300) * 30.0
+    temperature = 20 + 0.05 * seconds / 60 + rng.normal(0, 0.3, 300)
+    # Without decay the windows are plain running statistics
+    store = WindowFeatureStore(half_life=1e12, min_samples=50, max_devices=2)
+    for step, (t, value) in enumerate(zip(seconds, temperature)):
+        features, ready = store.update("kitchen", {"temperature": value, "humidity": 45, "pressure": 1013}, t)
+        assert ready == (step >= 49)
+    summary = store.summary("kitchen")["temperature"]
+    assert summary["mean"] == pytest.approx(temperature.mean())
+    assert summary["variance"] == pytest.approx(temperature.var())
+    assert summary["slope"] == pytest.approx(np.polyfit(seconds / 60, temperature, 1)[0])
+    assert len(features) == len(feature_names()) == 9
+    assert features[0] == pytest.approx(temperature.std(), rel=1e-5)
+
+    # Missing values leave that metric's window alone and ISO timestamps are accepted
+    store.update("office", {"temperature": 21.0, "timestamp": "2025-01-01T00:00:00Z"})
+    assert store.summary("office")["humidity"]["count"] == 0
+    # The least recently updated device is dropped once the store is full
+    store.update("office", {"temperature": 21.5, "timestamp": "2025-01-01T00:00:30Z"})
+    store.update("hall", {"temperature": 19.0}, 0)
+    assert len(store) == 2 and store.summary("kitchen") is None and store.evicted == 1
+
+def test_detect_window_anomalies_flags_drift(tmp_path):
+    import numpy as np
+    from device_ml import DeviceMLModel
+    from model_generator import create_window_model, generate_sample_streams
+    create_window_model(str(tmp_path), generate_sample_streams(n_devices=10, n_steps=400))
+    model = DeviceMLModel(model_path=str(tmp_path / "missing.tflite"), fallback_model_path=str(tmp_path / "missing.pkl"), window_model_path=str(tmp_path / "window_forest.npz"))
+    assert model.window_model is not None
+
+    flagged = {"steady": [], "drifting": []}
+    for device_id, timestamp, reading in generate_sample_streams(n_devices=2, n_steps=240, seed=9):
+        reading = dict(reading, device_id=device_id, timestamp=timestamp)
+        if device_id == "device-1" and timestamp >= 120 * 30:
+            # Temperature creeps up 0.1C a minute, each reading alone still looks normal
+            reading["temperature"] += (timestamp - 120 * 30) / 60 * 0.1
+        result = model.detect_window_anomalies([reading])
+        if result["ready"][0] and timestamp >= 150 * 30:
+            flagged["steady" if device_id == "device-0" else "drifting"].append(result["is_anomaly"][0])
+    assert np.mean(flagged["drifting"]) > 0.5
+    assert np.mean(flagged["steady"]) < 0.1
+
+    # Readings without a device_id are not pooled into a shared window
+    anonymous = model.detect_window_anomalies([{"temperature": 22.0 + i, "humidity": 45, "pressure": 1013, "timestamp": i * 30} for i in range(40)])
+    assert not any(anonymous["ready"]) and anonymous["anomaly_count"] == 0
+    assert len(model.window_store) == 2
+
+    # A trained window model ships with the repo, so the endpoints use it by default
+    from forest_scorer import ForestScorer
+    from window_features import feature_names
+    shipped = ForestScorer.load(os.path.join(os.path.dirname(os.path.abspath(__file__)), "models", "window_forest.npz"))
+    assert shipped.n_features_in_ == len(feature_names())
+
 def test_predictive_analysis_valid_data(client):
     response = client.get("/api/predictive-analysis?data_type=temperature&days=3")
     assert response.status_code == 200
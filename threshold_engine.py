@@ -0,0 +1,152 @@
+import os
+import logging
+import argparse
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
+
+# Set up Logging
+logger = logging.getLogger(__name__)
+
+# Bit flags for each exceeded threshold, in the order codes are reported
+THRESHOLD_CODES = ("temperature_low", "temperature_high", "humidity_low", "humidity_high", "water_usage_high")
+TEMPERATURE_LOW, TEMPERATURE_HIGH, HUMIDITY_LOW, HUMIDITY_HIGH, WATER_USAGE_HIGH = (1 << i for i in range(len(THRESHOLD_CODES)))
+
+DEFAULT_THRESHOLDS = {
+    "temperature_range": [20, 25],
+    "humidity_range": [30, 60],
+    "flow_rate_threshold": 10
+}
+
+def thresholds_for_room(thresholds, room_id):
+    """Merge a room's overrides on top of the global thresholds"""
+    overrides = (thresholds.get("room_overrides") or {}).get(room_id)
+    if not overrides:
+        return thresholds
+    merged = dict(thresholds)
+    merged.update(overrides)
+    return merged
+
+def _limits(thresholds):
+    """Flatten thresholds into (temp_low, temp_high, humidity_low, humidity_high, flow_high), NaN when unset"""
+    temperature_range = thresholds.get("temperature_range") or [np.nan, np.nan]
+    humidity_range = thresholds.get("humidity_range") or [np.nan, np.nan]
+    flow_rate_threshold = thresholds.get("flow_rate_threshold")
+    return [
+        float(temperature_range[0]), float(temperature_range[1]),
+        float(humidity_range[0]), float(humidity_range[1]),
+        np.nan if flow_rate_threshold is None else float(flow_rate_threshold)
+    ]
+
+def _column(values, size):
+    """Turn a column into a float array, None for a missing column becomes all NaN"""
+    if values is None:
+        return np.full(size, np.nan)
+    return pd.to_numeric(pd.Series(values, copy=False), errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+
+class ThresholdEngine:
+    """Evaluates thresholds for a whole batch of readings at once with NumPy
+
+    Rows are matched against their room's thresholds (global thresholds merged with any
+    room_overrides), and the result is a uint8 bitmask per row using the THRESHOLD_CODES flags.
+    Missing values are NaN and never trigger a threshold.
+    """
+
+    def __init__(self, thresholds=None, room_overrides=None):
+        thresholds = dict(thresholds or DEFAULT_THRESHOLDS)
+        if room_overrides is not None:
+            thresholds["room_overrides"] = room_overrides
+        self.thresholds = thresholds
+        self.room_overrides = thresholds.get("room_overrides") or {}
+        self._default_limits = np.array(_limits(thresholds))
+
+    def evaluate(self, temperature=None, humidity=None, flow_rate=None, room_ids=None):
+        """Return the exceeded-threshold bitmask for every row"""
+        columns = [c for c in (temperature, humidity, flow_rate, room_ids) if c is not None]
+        size = len(columns[0]) if columns else 0
+
+        temperature = _column(temperature, size)
+        humidity = _column(humidity, size)
+        flow_rate = _column(flow_rate, size)
+        limits = self._row_limits(room_ids, size)
+
+        masks = np.zeros(size, dtype=np.uint8)
+        # NaN comparisons are always False so missing values are skipped
+        with np.errstate(invalid="ignore"):
+            temperature_low = temperature < limits[:, 0]
+            masks[temperature_low] |= TEMPERATURE_LOW
+            masks[~temperature_low & (temperature > limits[:, 1])] |= TEMPERATURE_HIGH
+            humidity_low = humidity < limits[:, 2]
+            masks[humidity_low] |= HUMIDITY_LOW
+            masks[~humidity_low & (humidity > limits[:, 3])] |= HUMIDITY_HIGH
+            masks[flow_rate > limits[:, 4]] |= WATER_USAGE_HIGH
+        return masks
+
+    def evaluate_records(self, records):
+        """Evaluate a list of reading dicts and return the exceeded codes for each one"""
+        if not records:
+            return []
+        frame = pd.DataFrame.from_records(records)
+        masks = self.evaluate(
+            temperature=frame["temperature"] if "temperature" in frame else None,
+            humidity=frame["humidity"] if "humidity" in frame else None,
+            flow_rate=frame["flow_rate"] if "flow_rate" in frame else None,
+            room_ids=frame["room_id"] if "room_id" in frame else None
+        )
+        return decode(masks)
+
+    def _row_limits(self, room_ids, size):
+        if room_ids is None or not self.room_overrides:
+            return np.broadcast_to(self._default_limits, (size, len(self._default_limits)))
+
+        # One limits row per distinct room, then gathered back out to every reading
+        codes, rooms = pd.factorize(pd.Series(room_ids, copy=False), use_na_sentinel=False)
+        table = np.array([_limits(thresholds_for_room(self.thresholds, room)) for room in rooms]).reshape(len(rooms), -1)
+        return table[codes]
+
+def decode(masks):
+    """Convert bitmasks into lists of threshold codes"""
+    masks = np.asarray(masks, dtype=np.uint8)
+    decoded = [[] for _ in range(len(masks))]
+    for bit, code in enumerate(THRESHOLD_CODES):
+        for row in np.flatnonzero(masks & (1 << bit)):
+            decoded[row].append(code)
+    return decoded
+
+def backfill_exceedances(collection, thresholds, start, end, chunk_size=50000):
+    """Evaluate stored readings in chunks and count exceeded thresholds per room and code"""
+    engine = ThresholdEngine(thresholds)
+    projection = {"_id": 0, "room_id": 1, "temperature": 1, "humidity": 1, "flow_rate": 1}
+    cursor = collection.find({"timestamp": {"$gte": start, "$lte": end}}, projection).batch_size(chunk_size)
+
+    counts = {}
+    chunk = []
+    for document in cursor:
+        chunk.append(document)
+        if len(chunk) >= chunk_size:
+            _count_chunk(engine, chunk, counts)
+            chunk = []
+    if chunk:
+        _count_chunk(engine, chunk, counts)
+    return counts
+
+def _count_chunk(engine, chunk, counts):
+    rooms = [document.get("room_id", "unknown") for document in chunk]
+    for room, codes in zip(rooms, engine.evaluate_records(chunk)):
+        for code in codes:
+            counts.setdefault(room, {}).setdefault(code, 0)
+            counts[room][code] += 1
+
+if __name__ == "__main__":
+    from pymongo import MongoClient
+
+    parser = argparse.ArgumentParser(description="Re-evaluate stored sensor readings against the current thresholds")
+    parser.add_argument("--days", type=int, default=7, help="How many days of readings to evaluate")
+    args = parser.parse_args()
+
+    db = MongoClient(os.getenv("MONGO_URI")).ecodetect
+    thresholds = db.thresholds.find_one({}, {"_id": 0}) or DEFAULT_THRESHOLDS
+    end = datetime.now()
+    counts = backfill_exceedances(db.sensor_data, thresholds, end - timedelta(days=args.days), end)
+    for room, room_counts in sorted(counts.items(), key=lambda item: str(item[0])):
+        print(f"{room}: {room_counts}")
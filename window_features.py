@@ -0,0 +1,151 @@
+import time
+import math
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime
+import numpy as np
+
+# Set up Logging
+logger = logging.getLogger(__name__)
+
+METRICS = ("temperature", "humidity", "pressure")
+# Scored features are level free, so one model covers rooms with different baselines
+WINDOW_FEATURES = ("std", "slope", "ewma_gap")
+
+def feature_names(metrics=METRICS):
+    """Column names of the vectors returned by WindowFeatureStore, metric by metric"""
+    return [f"{metric}_{feature}" for metric in metrics for feature in WINDOW_FEATURES]
+
+def _seconds(timestamp):
+    if timestamp is None:
+        return time.time()
+    if isinstance(timestamp, (int, float)):
+        return float(timestamp)
+    if isinstance(timestamp, str):
+        timestamp = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+    return timestamp.timestamp()
+
+class MetricWindow:
+    """Exponentially weighted mean, variance, trend and EWMA of one metric, in constant memory
+
+    Mean and variance use Welford's update with older samples decayed by their age, so they
+    describe roughly the last half_life seconds without storing the samples. The slope is the
+    weighted least squares trend of value against time (per minute), kept with the same decayed
+    Welford covariance. The EWMA uses a shorter half life so it reacts before the window mean does.
+    """
+
+    __slots__ = ("weight", "mean", "m2", "time_mean", "time_m2", "covariance", "ewma", "last_seen", "count")
+
+    def __init__(self):
+        self.weight = 0.0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.time_mean = 0.0
+        self.time_m2 = 0.0
+        self.covariance = 0.0
+        self.ewma = 0.0
+        self.last_seen = None
+        self.count = 0
+
+    def update(self, seconds, value, half_life, ewma_half_life, origin):
+        if self.last_seen is None:
+            decay = ewma_decay = 0.0
+            self.ewma = value
+        else:
+            # Out of order samples are treated as arriving at the same time as the last one
+            elapsed = max(seconds - self.last_seen, 0.0)
+            decay = 0.5 ** (elapsed / half_life)
+            ewma_decay = 0.5 ** (elapsed / ewma_half_life)
+            self.ewma = ewma_decay * self.ewma + (1 - ewma_decay) * value
+        self.last_seen = max(seconds, self.last_seen or seconds)
+        self.count += 1
+
+        # Minutes since the device was first seen keep the time terms small
+        minutes = (seconds - origin) / 60.0
+        self.weight = decay * self.weight + 1.0
+        value_delta = value - self.mean
+        time_delta = minutes - self.time_mean
+        self.mean += value_delta / self.weight
+        self.time_mean += time_delta / self.weight
+        self.m2 = decay * self.m2 + value_delta * (value - self.mean)
+        self.time_m2 = decay * self.time_m2 + time_delta * (minutes - self.time_mean)
+        self.covariance = decay * self.covariance + time_delta * (value - self.mean)
+
+    def summary(self):
+        variance = max(self.m2 / self.weight, 0.0) if self.weight else 0.0
+        slope = self.covariance / self.time_m2 if self.time_m2 > 1e-12 else 0.0
+        return {"mean": self.mean, "variance": variance, "std": math.sqrt(variance), "slope": slope, "ewma": self.ewma, "count": self.count}
+
+    def features(self):
+        summary = self.summary()
+        # ewma_gap is how far the recent values have moved away from the window mean
+        return (summary["std"], summary["slope"], summary["ewma"] - summary["mean"])
+
+class DeviceWindow:
+    __slots__ = ("origin", "windows")
+
+    def __init__(self, origin, metric_count):
+        self.origin = origin
+        self.windows = [MetricWindow() for _ in range(metric_count)]
+
+class WindowFeatureStore:
+    """Per-device window features for streaming anomaly detection
+
+    Every device keeps one MetricWindow per metric, a fixed handful of floats however long it has
+    been streaming. Devices are kept in least recently updated order and the oldest are dropped
+    once there are more than max_devices, so memory stays bounded with thousands of devices.
+    """
+
+    def __init__(self, metrics=METRICS, half_life=900.0, ewma_half_life=120.0, min_samples=30, max_devices=10000):
+        self.metrics = tuple(metrics)
+        self.half_life = half_life
+        self.ewma_half_life = ewma_half_life
+        self.min_samples = min_samples
+        self.max_devices = max_devices
+        self._devices = OrderedDict()
+        self._lock = threading.Lock()
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self._devices)
+
+    def update(self, device_id, reading, timestamp=None):
+        """Fold a reading into the device's windows, returns (features, ready)
+
+        ready is False until every metric has min_samples values, before that the features are
+        too noisy to score.
+        """
+        seconds = _seconds(timestamp if timestamp is not None else reading.get("timestamp"))
+        with self._lock:
+            device = self._devices.get(device_id)
+            if device is None:
+                device = DeviceWindow(seconds, len(self.metrics))
+                self._devices[device_id] = device
+                while len(self._devices) > self.max_devices:
+                    self._devices.popitem(last=False)
+                    self.evicted += 1
+            else:
+                self._devices.move_to_end(device_id)
+
+            features = []
+            ready = True
+            for metric, window in zip(self.metrics, device.windows):
+                value = reading.get(metric)
+                if isinstance(value, (int, float, np.floating)) and not isinstance(value, bool) and math.isfinite(value):
+                    window.update(seconds, float(value), self.half_life, self.ewma_half_life, device.origin)
+                features.extend(window.features())
+                ready = ready and window.count >= self.min_samples
+        return np.array(features, dtype=np.float32), ready
+
+    def summary(self, device_id):
+        """Window mean, variance, slope and EWMA per metric of a device, None for unknown devices"""
+        with self._lock:
+            device = self._devices.get(device_id)
+            if device is None:
+                return None
+            return {metric: window.summary() for metric, window in zip(self.metrics, device.windows)}
+
+    def clear(self):
+        with self._lock:
+            self._devices.clear()